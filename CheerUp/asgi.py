@@ -15,6 +15,7 @@ from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 
 import chat.routing
+import events.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "CheerUp.settings")
 
@@ -24,7 +25,12 @@ application = ProtocolTypeRouter(
     {
         "http": django_asgi_app,
         "websocket": AllowedHostsOriginValidator(
-            AuthMiddlewareStack(URLRouter(chat.routing.websocket_urlpatterns))
+            AuthMiddlewareStack(
+                URLRouter(
+                    chat.routing.websocket_urlpatterns
+                    + events.routing.websocket_urlpatterns
+                )
+            )
         ),
     }
 )
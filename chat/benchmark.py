@@ -0,0 +1,99 @@
+"""Load test of the chat WebSocket path.
+
+``run_benchmark`` opens ``clients`` WebsocketCommunicator connections in
+each of ``rooms`` rooms, has every client send ``messages`` messages, and
+times every delivery from the moment it was sent until a client of the
+room received it. Everything runs in-process through the real routing
+and ChatConsumer, against whichever channel layer is configured; the
+chat_benchmark command switches to InMemoryChannelLayer unless told
+otherwise, so it runs offline.
+"""
+
+import asyncio
+import json
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from .routing import websocket_urlpatterns
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+async def _receive(communicator, expected, latencies, timeout):
+    for _ in range(expected):
+        data = json.loads(await communicator.receive_from(timeout=timeout))
+        sent_at = json.loads(data["message"])["sent_at"]
+        latencies.append(time.perf_counter() - sent_at)
+
+
+async def _send(communicator, client, messages, sender_id, recipient_id):
+    for sequence in range(messages):
+        payload = json.dumps(
+            {"client": client, "sequence": sequence, "sent_at": time.perf_counter()}
+        )
+        await communicator.send_to(
+            text_data=json.dumps(
+                {
+                    "message": payload,
+                    "sender_id": sender_id,
+                    "recipient_id": recipient_id,
+                }
+            )
+        )
+        # let the consumers run between sends like separate clients would
+        await asyncio.sleep(0)
+
+
+async def run_benchmark(rooms, clients, messages, sender_id, recipient_id, timeout=10):
+    """Return the delivery statistics of one run, latencies in milliseconds."""
+    application = URLRouter(websocket_urlpatterns)
+    connections = []
+    for room in range(rooms):
+        for _ in range(clients):
+            communicator = WebsocketCommunicator(
+                application, f"/ws/chat/benchmark-{room}/"
+            )
+            connected, _ = await communicator.connect(timeout=timeout)
+            if not connected:
+                raise RuntimeError("Could not connect to the chat consumer.")
+            connections.append(communicator)
+
+    latencies = []
+    # every client gets the messages of every client in its room
+    expected = clients * messages
+    started = time.perf_counter()
+    receivers = [
+        asyncio.ensure_future(_receive(communicator, expected, latencies, timeout))
+        for communicator in connections
+    ]
+    await asyncio.gather(
+        *(
+            _send(communicator, client, messages, sender_id, recipient_id)
+            for client, communicator in enumerate(connections)
+        )
+    )
+    await asyncio.gather(*receivers)
+    elapsed = time.perf_counter() - started
+
+    for communicator in connections:
+        await communicator.disconnect()
+
+    sent = rooms * clients * messages
+    return {
+        "connections": len(connections),
+        "messages_sent": sent,
+        "deliveries": len(latencies),
+        "elapsed_s": elapsed,
+        "messages_per_s": sent / elapsed,
+        "deliveries_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
@@ -0,0 +1,17 @@
+# constants of the chat app
+
+# ChatConsumer writes messages in batches of at most this many rows...
+MESSAGE_FLUSH_BATCH_SIZE = 50
+# ...and never keeps a message unwritten for longer than this
+MESSAGE_FLUSH_INTERVAL_MS = 200
+# a batch is dropped after this many writes failed in a row, the retries
+# back off from MESSAGE_FLUSH_INTERVAL_MS and together wait about 3 minutes
+MESSAGE_FLUSH_MAX_ATTEMPTS = 10
+
+# number of messages on the chat page and per "load older" request
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# a user counts as online while a heartbeat arrived within the TTL,
+# ChatConsumer sends one every PRESENCE_HEARTBEAT_SECONDS while connected
+PRESENCE_TTL_SECONDS = 60
+PRESENCE_HEARTBEAT_SECONDS = 20
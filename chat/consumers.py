@@ -1,44 +1,124 @@
 # consumers.py
 
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .models import Message
+from .models import Message, conversation_key
+from .persistence import message_queue
+from . import presence
+from .constants import PRESENCE_HEARTBEAT_SECONDS
 from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User  # <-- Add this import
+from django.utils import timezone
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"chat_{self.room_name}"
+        # user ids already checked on this connection
+        self.known_user_ids = set()
+        user = self.scope.get("user")
+        self.user_id = user.id if user is not None and user.is_authenticated else None
+        self.heartbeat_task = None
         # Join room group
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
         await self.accept()
 
+        if self.user_id is not None:
+            await sync_to_async(presence.user_connected)(self.user_id, self.room_name)
+            # keep the user online while the socket is open, whether or not
+            # the client sends heartbeats of its own
+            self.heartbeat_task = asyncio.ensure_future(self.send_heartbeats())
+            members = await sync_to_async(presence.room_members)(self.room_name)
+            await self.send(text_data=json.dumps({"online": sorted(members)}))
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {"type": "chat.presence", "user_id": self.user_id, "online": True},
+            )
+
     async def disconnect(self, close_code):
         # Leave room group
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        if self.user_id is not None:
+            await sync_to_async(presence.user_disconnected)(
+                self.user_id, self.room_name
+            )
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {"type": "chat.presence", "user_id": self.user_id, "online": False},
+            )
+        # write whatever this connection still has queued
+        await message_queue.flush()
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        # heartbeats and typing indicators never touch the database
+        if data.get("type") == "heartbeat":
+            if self.user_id is not None:
+                await sync_to_async(presence.heartbeat)(self.user_id, self.room_name)
+            return
+        if data.get("type") == "typing":
+            if self.user_id is not None:
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        "type": "chat.typing",
+                        "user_id": self.user_id,
+                        "typing": bool(data.get("typing")),
+                        "sender_channel": self.channel_name,
+                    },
+                )
+            return
+
         message = data["message"]
-        sender_id = data["sender_id"]
-        recipient_id = data["recipient_id"]
+        sender_id = int(data["sender_id"])
+        recipient_id = int(data["recipient_id"])
 
-        await self.save_message(sender_id, recipient_id, message)
+        if not await self.users_exist(sender_id, recipient_id):
+            await self.send(text_data=json.dumps({"error": "Unknown user."}))
+            return
 
         # Send message to room group
         await self.channel_layer.group_send(
             self.room_group_name, {"type": "chat.message", "message": message}
         )
 
+        await self.save_message(sender_id, recipient_id, message)
+
+    async def send_heartbeats(self):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
+            await sync_to_async(presence.heartbeat)(self.user_id, self.room_name)
+
+    async def users_exist(self, *user_ids):
+        missing = set(user_ids) - self.known_user_ids
+        if missing:
+            found = await self.count_users(missing)
+            if found != len(missing):
+                return False
+            self.known_user_ids |= missing
+        return True
+
     @sync_to_async
-    def save_message(self, sender_id, recipient_id, message):
-        sender = User.objects.get(id=sender_id)
-        recipient = User.objects.get(id=recipient_id)
+    def count_users(self, user_ids):
+        return User.objects.filter(id__in=user_ids).count()
 
-        Message.objects.create(sender=sender, recipient=recipient, content=message)
+    async def save_message(self, sender_id, recipient_id, message):
+        await message_queue.put(
+            # bulk_create skips Message.save, set the conversation here; the
+            # timestamp is the time of receipt, not of the batched write
+            Message(
+                sender_id=sender_id,
+                recipient_id=recipient_id,
+                content=message,
+                conversation=conversation_key(sender_id, recipient_id),
+                timestamp=timezone.now(),
+            )
+        )
 
     # Receive message from room group
     async def chat_message(self, event):
@@ -46,3 +126,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Send message to WebSocket
         await self.send(text_data=json.dumps({"message": message}))
+
+    async def chat_presence(self, event):
+        if event["user_id"] == self.user_id:
+            return
+        await self.send(
+            text_data=json.dumps(
+                {"presence": {"user_id": event["user_id"], "online": event["online"]}}
+            )
+        )
+
+    async def chat_typing(self, event):
+        if event["sender_channel"] == self.channel_name:
+            return
+        await self.send(
+            text_data=json.dumps(
+                {"typing": {"user_id": event["user_id"], "typing": event["typing"]}}
+            )
+        )
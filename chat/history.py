@@ -0,0 +1,59 @@
+"""Keyset pagination over the messages of one conversation.
+
+Messages are read newest first on the (conversation, timestamp) index and
+a cursor encodes the oldest message already shown, so loading older
+messages costs the same index range scan however long the history is.
+"""
+
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+from .constants import CHAT_HISTORY_PAGE_SIZE
+from .models import Message, conversation_key
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(message):
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from error
+
+
+def conversation_history(user_id, other_user_id, before=None, limit=None):
+    """Return (messages, older_cursor) for the page of messages before ``before``.
+
+    Messages come back oldest first, ready to be displayed. ``older_cursor``
+    is None once the start of the conversation is reached.
+    """
+    limit = limit or CHAT_HISTORY_PAGE_SIZE
+    queryset = (
+        Message.objects.filter(conversation=conversation_key(user_id, other_user_id))
+        .select_related("sender")
+        .order_by("-timestamp", "-id")
+    )
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        queryset = queryset.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+        )
+    # fetch one extra row to know whether there is anything older
+    messages = list(queryset[: limit + 1])
+    older_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        older_cursor = encode_cursor(messages[-1])
+    messages.reverse()
+    return messages, older_cursor
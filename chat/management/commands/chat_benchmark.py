@@ -0,0 +1,92 @@
+# chat/management/commands/chat_benchmark.py
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from chat.benchmark import run_benchmark
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        # never drop messages because a consumer fell behind
+        "CONFIG": {"capacity": 100_000},
+    }
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test ChatConsumer: open ROOMS x CLIENTS websocket connections, "
+        "send MESSAGES messages from every client and report send-to-receive "
+        "latency and throughput. Messages are saved as usual and rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=10)
+        parser.add_argument("--clients", type=int, default=5, help="per room")
+        parser.add_argument("--messages", type=int, default=20, help="per client")
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=10,
+            help="Seconds to wait for any single frame (default: 10)",
+        )
+        parser.add_argument(
+            "--configured-layer",
+            action="store_true",
+            help="Use CHANNEL_LAYERS from the settings (e.g. a local Redis) "
+            "instead of the in-memory layer",
+        )
+
+    def handle(self, *args, **options):
+        for name in ("rooms", "clients", "messages"):
+            if options[name] < 1:
+                raise CommandError(f"--{name} must be at least 1")
+
+        if options["configured_layer"]:
+            result = self.run(options)
+        else:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                result = self.run(options)
+
+        self.stdout.write(
+            f"{result['connections']} connections, "
+            f"{result['messages_sent']} messages, "
+            f"{result['deliveries']} deliveries in {result['elapsed_s']:.2f}s"
+        )
+        self.stdout.write(
+            f"throughput: {result['messages_per_s']:.0f} messages/s, "
+            f"{result['deliveries_per_s']:.0f} deliveries/s"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"latency: p50 {result['p50_ms']:.2f} ms, "
+                f"p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms"
+            )
+        )
+
+    def run(self, options):
+        # the consumer saves what it receives, keep none of it
+        try:
+            with transaction.atomic():
+                sender = User.objects.create(username="chat-benchmark-sender")
+                recipient = User.objects.create(username="chat-benchmark-recipient")
+                result = async_to_sync(run_benchmark)(
+                    options["rooms"],
+                    options["clients"],
+                    options["messages"],
+                    sender.id,
+                    recipient.id,
+                    timeout=options["timeout"],
+                )
+                raise Rollback
+        except Rollback:
+            pass
+        return result
@@ -0,0 +1,46 @@
+# Generated by Django 4.1 on 2026-10-18 16:07
+
+from django.db import migrations, models
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Concat
+
+
+def backfill_conversation(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+
+    def key(low, high):
+        return Concat(
+            Cast(low, CharField()),
+            Value("-"),
+            Cast(high, CharField()),
+            output_field=CharField(),
+        )
+
+    Message.objects.filter(sender_id__lte=F("recipient_id")).update(
+        conversation=key("sender_id", "recipient_id")
+    )
+    Message.objects.filter(sender_id__gt=F("recipient_id")).update(
+        conversation=key("recipient_id", "sender_id")
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="conversation",
+            field=models.CharField(default="", editable=False, max_length=41),
+        ),
+        migrations.RunPython(backfill_conversation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "timestamp"],
+                name="chat_message_conversation_idx",
+            ),
+        ),
+    ]
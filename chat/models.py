@@ -2,6 +2,13 @@
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+def conversation_key(user_id, other_user_id):
+    """Key shared by both directions of a conversation: "<min id>-<max id>"."""
+    low, high = sorted((int(user_id), int(other_user_id)))
+    return f"{low}-{high}"
 
 
 class Message(models.Model):
@@ -12,7 +19,21 @@ class Message(models.Model):
         User, on_delete=models.CASCADE, related_name="received_messages"
     )
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the message is received, it is written later in a batch
+    timestamp = models.DateTimeField(default=timezone.now)
+    conversation = models.CharField(max_length=41, editable=False, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "timestamp"],
+                name="chat_message_conversation_idx",
+            )
+        ]
+
+    def save(self, *args, **kwargs):
+        self.conversation = conversation_key(self.sender_id, self.recipient_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.sender.username} to {self.recipient.username}: {self.content}"
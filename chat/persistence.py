@@ -0,0 +1,163 @@
+"""Write-behind queue for chat messages.
+
+ChatConsumer broadcasts a message to the room first and then hands it to
+``message_queue``, which saves the queued messages of every connection of
+this worker with one bulk_create once MESSAGE_FLUSH_BATCH_SIZE messages
+are waiting or MESSAGE_FLUSH_INTERVAL_MS after the first one arrived.
+
+Consumers flush the queue when they disconnect, and whatever is still
+queued when the interpreter exits is written synchronously, so a clean
+shutdown loses nothing. A failed write puts the batch back in front of the
+queue; a failed timed or batch-size flush is logged and tried again after
+an interval that doubles with every failure in a row, and after
+MESSAGE_FLUSH_MAX_ATTEMPTS of them the batch is dropped.
+
+A batch rejected by the database itself (IntegrityError, DataError) is
+written again one row at a time, so a single bad message is logged and
+dropped instead of holding back the rest of the queue.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.db import DataError, IntegrityError, transaction
+
+from .constants import (
+    MESSAGE_FLUSH_BATCH_SIZE,
+    MESSAGE_FLUSH_INTERVAL_MS,
+    MESSAGE_FLUSH_MAX_ATTEMPTS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteQueue:
+    def __init__(
+        self,
+        batch_size=MESSAGE_FLUSH_BATCH_SIZE,
+        interval_ms=None,
+        max_attempts=MESSAGE_FLUSH_MAX_ATTEMPTS,
+    ):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.interval_ms = (
+            MESSAGE_FLUSH_INTERVAL_MS if interval_ms is None else interval_ms
+        )
+        # flush_sync may run outside the event loop, guard the list itself
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        # writes that failed in a row
+        self._failures = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def put(self, message):
+        with self._lock:
+            self._pending.append(message)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            await self._flush_or_retry()
+        elif not self._timer_running():
+            self._schedule()
+
+    def _schedule(self, delay_ms=None):
+        self._timer = asyncio.ensure_future(
+            self._flush_later(self.interval_ms if delay_ms is None else delay_ms)
+        )
+
+    def _timer_running(self):
+        # a timer left behind by an event loop that has since been closed
+        # will never fire
+        return (
+            self._timer is not None
+            and not self._timer.done()
+            and self._timer.get_loop() is asyncio.get_running_loop()
+        )
+
+    async def _flush_later(self, delay_ms):
+        await asyncio.sleep(delay_ms / 1000)
+        self._timer = None
+        await self._flush_or_retry()
+
+    async def _flush_or_retry(self):
+        try:
+            await self.flush()
+        except Exception:
+            # the batch is back in the queue, nothing else may arrive to
+            # flush it so try again, backing off while the database is down
+            logger.exception("Could not save %d queued chat messages", len(self))
+            if len(self) and not self._timer_running():
+                self._schedule(self.interval_ms * 2**self._failures)
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def _write(self, batch):
+        from .models import Message
+
+        try:
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create(batch)
+            except (IntegrityError, DataError):
+                self._write_rows(batch)
+        except Exception:
+            self._failed(batch)
+            raise
+        with self._lock:
+            self._failures = 0
+
+    def _write_rows(self, batch):
+        from .models import Message
+
+        for index, message in enumerate(batch):
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create([message])
+            except (IntegrityError, DataError):
+                logger.exception(
+                    "The database rejected chat message %d -> %d, dropping it",
+                    message.sender_id,
+                    message.recipient_id,
+                )
+            except Exception:
+                # only the rows not written yet go back in the queue
+                del batch[:index]
+                raise
+
+    def _failed(self, batch):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.max_attempts:
+                self._pending[:0] = batch
+                return
+            self._failures = 0
+        logger.error(
+            "Dropping %d chat messages after %d failed writes",
+            len(batch),
+            self.max_attempts,
+        )
+
+    async def flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        batch = self._take()
+        if batch:
+            await sync_to_async(self._write)(batch)
+
+    def flush_sync(self):
+        batch = self._take()
+        if batch:
+            self._write(batch)
+
+
+message_queue = MessageWriteQueue()
+atexit.register(message_queue.flush_sync)
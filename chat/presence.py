@@ -0,0 +1,133 @@
+"""Who is connected to chat, kept in the cache (Redis in production).
+
+Every key expires after PRESENCE_TTL_SECONDS unless a heartbeat refreshes
+it, so users of a crashed worker drop out on their own and nothing about
+presence is ever written to the database. ChatConsumer sends the heartbeats
+itself while a socket is open.
+
+- ``presence:user:<id>`` counts the user's open chat sockets; the user is
+  online while it exists. ``online_users`` checks any number of users with
+  one get_many.
+- ``presence:room:<room>`` holds the user ids in a room with their last
+  heartbeat. On Redis it is a sorted set scored by that time, changed with
+  atomic ZADD/ZREM so concurrent connections never lose each other's
+  updates. Other caches (LocMem in tests) keep a dict that is
+  read-modify-write, a lost update heals with the next heartbeat.
+"""
+
+import time
+
+from django.core.cache import cache, caches
+
+from .constants import PRESENCE_TTL_SECONDS
+
+
+def _user_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+def _room_key(room):
+    return f"presence:room:{room}"
+
+
+def _redis():
+    """Return the Redis connection behind the default cache, or None."""
+    try:
+        from django_redis import get_redis_connection
+        from django_redis.cache import RedisCache
+    except ImportError:
+        return None
+    if not isinstance(caches["default"], RedisCache):
+        return None
+    return get_redis_connection("default")
+
+
+def _touch_room(room, user_id):
+    now = time.time()
+    redis = _redis()
+    if redis is not None:
+        key = cache.make_key(_room_key(room))
+        with redis.pipeline() as pipe:
+            pipe.zadd(key, {user_id: now})
+            pipe.zremrangebyscore(key, "-inf", now - PRESENCE_TTL_SECONDS)
+            pipe.expire(key, PRESENCE_TTL_SECONDS)
+            pipe.execute()
+        return
+    members = {
+        member_id: seen
+        for member_id, seen in cache.get(_room_key(room), {}).items()
+        if now - seen < PRESENCE_TTL_SECONDS
+    }
+    members[user_id] = now
+    cache.set(_room_key(room), members, timeout=PRESENCE_TTL_SECONDS)
+
+
+def _leave_room(room, user_id):
+    redis = _redis()
+    if redis is not None:
+        redis.zrem(cache.make_key(_room_key(room)), user_id)
+        return
+    members = cache.get(_room_key(room), {})
+    if members.pop(user_id, None) is not None:
+        cache.set(_room_key(room), members, timeout=PRESENCE_TTL_SECONDS)
+
+
+def user_connected(user_id, room):
+    key = _user_key(user_id)
+    if not cache.add(key, 1, timeout=PRESENCE_TTL_SECONDS):
+        try:
+            cache.incr(key)
+            cache.touch(key, PRESENCE_TTL_SECONDS)
+        except ValueError:
+            # expired between add and incr
+            cache.add(key, 1, timeout=PRESENCE_TTL_SECONDS)
+    _touch_room(room, user_id)
+
+
+def heartbeat(user_id, room):
+    if not cache.touch(_user_key(user_id), PRESENCE_TTL_SECONDS):
+        cache.add(_user_key(user_id), 1, timeout=PRESENCE_TTL_SECONDS)
+    _touch_room(room, user_id)
+
+
+def user_disconnected(user_id, room):
+    key = _user_key(user_id)
+    try:
+        if cache.decr(key) <= 0:
+            cache.delete(key)
+    except ValueError:
+        # already expired
+        pass
+    _leave_room(room, user_id)
+
+
+def room_members(room):
+    """Return the ids of the users connected to ``room``."""
+    now = time.time()
+    redis = _redis()
+    if redis is not None:
+        key = cache.make_key(_room_key(room))
+        return {
+            int(member_id)
+            for member_id in redis.zrangebyscore(
+                key, now - PRESENCE_TTL_SECONDS, "+inf"
+            )
+        }
+    return {
+        member_id
+        for member_id, seen in cache.get(_room_key(room), {}).items()
+        if now - seen < PRESENCE_TTL_SECONDS
+    }
+
+
+def online_users(user_ids):
+    """Return the subset of ``user_ids`` that is online, in one cache round trip."""
+    keys = {_user_key(user_id): user_id for user_id in user_ids}
+    return {keys[key] for key in cache.get_many(keys)}
+
+
+def online_friends(user):
+    """Return the ids of the friends of ``user`` that are online."""
+    from profiles.friends import friend_ids
+
+    return online_users(friend_ids(user.id))
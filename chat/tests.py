@@ -3,7 +3,26 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .models import Message
+from .models import Message, conversation_key
+from .constants import CHAT_HISTORY_PAGE_SIZE
+from .persistence import MessageWriteQueue, message_queue
+from .benchmark import percentile
+from django.core.management import call_command
+from io import StringIO
+from .presence import online_users, room_members, user_connected, user_disconnected
+from profiles.models import UserProfile, UserFriends
+from profiles.constants import APPROVED
+from django.core.cache import cache
+import time
+from .routing import websocket_urlpatterns
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import DatabaseError
+from unittest import mock
+import asyncio
+from datetime import timedelta
+from django.utils import timezone
 
 
 class ChatViewTests(TestCase):
@@ -67,3 +86,303 @@ class ChatViewTests(TestCase):
             "chats:chat-with-user", kwargs={"recipient_id": self.user2.id}
         )
         self.assertRedirects(response, expected_redirect_url)
+
+
+class ChatConsumerTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, room="room1"):
+        communicator = WebsocketCommunicator(self.application, f"/ws/chat/{room}/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def payload(self, message):
+        return {
+            "message": message,
+            "sender_id": self.user1.id,
+            "recipient_id": self.user2.id,
+        }
+
+    async def test_message_is_broadcast_then_saved_on_disconnect(self):
+        sender = await self.connect()
+        receiver = await self.connect()
+        with mock.patch.object(message_queue, "interval_ms", 60000):
+            await sender.send_json_to(self.payload("Hello"))
+            self.assertEqual(await receiver.receive_json_from(), {"message": "Hello"})
+            # broadcast before it is written
+            self.assertEqual(await sync_to_async(Message.objects.count)(), 0)
+            await sender.disconnect()
+        message = await sync_to_async(Message.objects.get)()
+        self.assertEqual(message.content, "Hello")
+        self.assertEqual(message.sender_id, self.user1.id)
+        self.assertEqual(
+            message.conversation, conversation_key(self.user2.id, self.user1.id)
+        )
+        await receiver.disconnect()
+
+    async def test_queue_flushes_when_batch_is_full(self):
+        communicator = await self.connect()
+        with mock.patch.multiple(message_queue, batch_size=3, interval_ms=60000):
+            for i in range(3):
+                await communicator.send_json_to(self.payload(f"Message {i}"))
+                await communicator.receive_json_from()
+            self.assertEqual(await sync_to_async(Message.objects.count)(), 3)
+        await communicator.disconnect()
+
+    async def test_queue_flushes_after_interval(self):
+        communicator = await self.connect()
+        with mock.patch.object(message_queue, "interval_ms", 10):
+            await communicator.send_json_to(self.payload("Soon saved"))
+            await communicator.receive_json_from()
+            await asyncio.sleep(0.1)
+            self.assertEqual(await sync_to_async(Message.objects.count)(), 1)
+        await communicator.disconnect()
+
+    async def test_unknown_user_is_rejected(self):
+        communicator = await self.connect()
+        payload = self.payload("Nobody")
+        payload["recipient_id"] = 9999
+        await communicator.send_json_to(payload)
+        self.assertEqual(
+            await communicator.receive_json_from(), {"error": "Unknown user."}
+        )
+        await communicator.disconnect()
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 0)
+
+
+class MessageWriteQueueTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+
+    def message(self, content):
+        return Message(sender=self.user1, recipient=self.user2, content=content)
+
+    def test_failed_write_is_retried(self):
+        queue = MessageWriteQueue(batch_size=10, interval_ms=60000)
+        async_to_sync(queue.put)(self.message("Kept"))
+        with mock.patch.object(
+            Message.objects, "bulk_create", side_effect=DatabaseError
+        ):
+            with self.assertRaises(DatabaseError):
+                async_to_sync(queue.flush)()
+        self.assertEqual(len(queue), 1)
+        queue.flush_sync()
+        self.assertEqual(len(queue), 0)
+        self.assertTrue(Message.objects.filter(content="Kept").exists())
+
+    def test_rejected_row_is_dropped_and_the_rest_saved(self):
+        queue = MessageWriteQueue(batch_size=10, interval_ms=60000)
+        async_to_sync(queue.put)(self.message("Before"))
+        async_to_sync(queue.put)(self.message(None))
+        async_to_sync(queue.put)(self.message("After"))
+        with self.assertLogs("chat.persistence", "ERROR"):
+            queue.flush_sync()
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(
+            sorted(Message.objects.values_list("content", flat=True)),
+            ["After", "Before"],
+        )
+
+    def test_retries_are_capped(self):
+        queue = MessageWriteQueue(batch_size=10, interval_ms=60000, max_attempts=3)
+        async_to_sync(queue.put)(self.message("Lost"))
+        with mock.patch.object(
+            Message.objects, "bulk_create", side_effect=DatabaseError
+        ), self.assertLogs("chat.persistence", "ERROR"):
+            for _ in range(3):
+                with self.assertRaises(DatabaseError):
+                    queue.flush_sync()
+        self.assertEqual(len(queue), 0)
+
+    def test_failed_timed_flush_is_rescheduled(self):
+        # the timer fires several times while the database is down
+        queue = MessageWriteQueue(batch_size=10, interval_ms=10, max_attempts=100)
+
+        async def fail_then_recover():
+            with mock.patch.object(
+                Message.objects, "bulk_create", side_effect=DatabaseError
+            ):
+                await queue.put(self.message("Retried"))
+                await asyncio.sleep(0.05)
+            self.assertEqual(len(queue), 1)
+            self.assertTrue(queue._timer_running())
+            # the retries back off, 10 + 20 + 40 ms
+            await asyncio.sleep(0.2)
+
+        with self.assertLogs("chat.persistence", "ERROR"):
+            async_to_sync(fail_then_recover)()
+        self.assertEqual(len(queue), 0)
+        self.assertTrue(Message.objects.filter(content="Retried").exists())
+
+    def test_timestamp_is_the_time_of_receipt(self):
+        queue = MessageWriteQueue(batch_size=10, interval_ms=60000)
+        message = self.message("Queued a while")
+        message.timestamp = timezone.now() - timedelta(minutes=5)
+        async_to_sync(queue.put)(message)
+        queue.flush_sync()
+        self.assertEqual(
+            Message.objects.get(content="Queued a while").timestamp, message.timestamp
+        )
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        self.user3 = User.objects.create_user(username="user3", password="password3")
+        for i in range(CHAT_HISTORY_PAGE_SIZE + 5):
+            sender, recipient = (
+                (self.user1, self.user2) if i % 2 else (self.user2, self.user1)
+            )
+            Message.objects.create(
+                sender=sender, recipient=recipient, content=f"Message {i}"
+            )
+        # another conversation that must not leak in
+        Message.objects.create(
+            sender=self.user1, recipient=self.user3, content="Someone else"
+        )
+        self.client.login(username="user1", password="password1")
+
+    def test_conversation_key_is_symmetric(self):
+        self.assertEqual(
+            conversation_key(self.user1.id, self.user2.id),
+            conversation_key(self.user2.id, self.user1.id),
+        )
+
+    def test_chat_page_shows_most_recent_messages(self):
+        url = reverse("chats:chat-with-user", kwargs={"recipient_id": self.user2.id})
+        # session, user, recipient, one page of messages with their senders
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        messages = response.context["messages"]
+        self.assertEqual(len(messages), CHAT_HISTORY_PAGE_SIZE)
+        self.assertEqual(messages[0].content, "Message 5")
+        self.assertEqual(messages[-1].content, f"Message {CHAT_HISTORY_PAGE_SIZE + 4}")
+        self.assertIsNotNone(response.context["older_cursor"])
+        self.assertNotContains(response, "Someone else")
+
+    def test_load_older_messages(self):
+        page = self.client.get(
+            reverse("chats:chat-with-user", kwargs={"recipient_id": self.user2.id})
+        )
+        url = reverse("chats:older-messages", kwargs={"recipient_id": self.user2.id})
+        response = self.client.get(url, {"before": page.context["older_cursor"]})
+        data = response.json()
+        self.assertEqual(
+            [message["content"] for message in data["messages"]],
+            [f"Message {i}" for i in range(5)],
+        )
+        self.assertIsNone(data["older_cursor"])
+
+    def test_invalid_cursor(self):
+        url = reverse("chats:older-messages", kwargs={"recipient_id": self.user2.id})
+        response = self.client.get(url, {"before": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, user, room="room1"):
+        communicator = WebsocketCommunicator(self.application, f"/ws/chat/{room}/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_presence_and_typing(self):
+        first = await self.connect(self.user1)
+        self.assertEqual(await first.receive_json_from(), {"online": [self.user1.id]})
+        second = await self.connect(self.user2)
+        self.assertEqual(
+            await second.receive_json_from(),
+            {"online": [self.user1.id, self.user2.id]},
+        )
+        self.assertEqual(
+            await first.receive_json_from(),
+            {"presence": {"user_id": self.user2.id, "online": True}},
+        )
+
+        await second.send_json_to({"type": "typing", "typing": True})
+        self.assertEqual(
+            await first.receive_json_from(),
+            {"typing": {"user_id": self.user2.id, "typing": True}},
+        )
+        self.assertTrue(await second.receive_nothing())
+
+        await second.disconnect()
+        self.assertEqual(
+            await first.receive_json_from(),
+            {"presence": {"user_id": self.user2.id, "online": False}},
+        )
+        self.assertEqual(online_users([self.user1.id, self.user2.id]), {self.user1.id})
+        await first.disconnect()
+        self.assertEqual(room_members("room1"), set())
+
+    async def test_open_socket_sends_heartbeats(self):
+        with mock.patch("chat.consumers.PRESENCE_HEARTBEAT_SECONDS", 0.01), mock.patch(
+            "chat.presence.heartbeat"
+        ) as heartbeat:
+            communicator = await self.connect(self.user1)
+            await asyncio.sleep(0.1)
+            await communicator.disconnect()
+            calls = heartbeat.call_count
+            await asyncio.sleep(0.05)
+        self.assertGreater(calls, 0)
+        heartbeat.assert_called_with(self.user1.id, "room1")
+        # no more heartbeats once the socket is closed
+        self.assertEqual(heartbeat.call_count, calls)
+
+    def test_presence_expires_without_heartbeat(self):
+        user_connected(self.user1.id, "room1")
+        self.assertEqual(online_users([self.user1.id]), {self.user1.id})
+        with mock.patch("chat.presence.time.time", return_value=time.time() + 3600):
+            self.assertEqual(room_members("room1"), set())
+
+    def test_second_connection_keeps_user_online(self):
+        user_connected(self.user1.id, "room1")
+        user_connected(self.user1.id, "room2")
+        user_disconnected(self.user1.id, "room1")
+        self.assertEqual(online_users([self.user1.id]), {self.user1.id})
+        user_disconnected(self.user1.id, "room2")
+        self.assertEqual(online_users([self.user1.id]), set())
+
+    def test_online_friends_api(self):
+        profile1 = UserProfile.objects.get(user=self.user1)
+        UserFriends.objects.create(user=self.user2, friends=profile1, status=APPROVED)
+        user_connected(self.user2.id, "room1")
+        self.client.login(username="user1", password="password1")
+        response = self.client.get(reverse("chats:online-friends"))
+        self.assertEqual(response.json(), {"online": [self.user2.id]})
+        response = self.client.get(reverse("profiles:view_profile", args=[profile1.id]))
+        self.assertEqual(response.context["online_friend_ids"], {self.user2.id})
+
+
+class ChatBenchmarkTests(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            "chat_benchmark", "--rooms=2", "--clients=3", "--messages=4", stdout=out
+        )
+        output = out.getvalue()
+        # every client receives every message sent in its room
+        self.assertIn("6 connections, 24 messages, 72 deliveries", output)
+        self.assertIn("p99", output)
+        # nothing from the run is kept
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(User.objects.filter(username__startswith="chat-").exists())
@@ -3,6 +3,8 @@ from . import views
 
 app_name = "chats"
 urlpatterns = [
+    path("online-friends/", views.onlineFriends, name="online-friends"),
     path("<str:recipient_id>/", views.chatting, name="chat-with-user"),
+    path("<str:recipient_id>/older/", views.olderMessages, name="older-messages"),
     # Add other chat app URLs here
 ]
@@ -3,18 +3,17 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.http import JsonResponse, HttpResponseBadRequest
 from .models import Message
 from .forms import MessageForm
-from django.db.models import Q
+from .history import conversation_history, InvalidCursor
+from .presence import online_friends
 
 
 @login_required
 def chatting(request, recipient_id):
     recipient = get_object_or_404(User, id=recipient_id)
-    messages = Message.objects.filter(
-        (Q(sender=request.user) & Q(recipient=recipient))
-        | (Q(sender=recipient) & Q(recipient=request.user))
-    ).order_by("timestamp")
+    messages, older_cursor = conversation_history(request.user.id, recipient.id)
 
     if request.method == "POST":
         form = MessageForm(request.POST)
@@ -30,5 +29,41 @@ def chatting(request, recipient_id):
     return render(
         request,
         "chat/chat.html",
-        {"recipient": recipient, "messages": messages, "form": form},
+        {
+            "recipient": recipient,
+            "messages": messages,
+            "older_cursor": older_cursor,
+            "form": form,
+        },
+    )
+
+
+@login_required
+def onlineFriends(request):
+    return JsonResponse({"online": sorted(online_friends(request.user))})
+
+
+@login_required
+def olderMessages(request, recipient_id):
+    recipient = get_object_or_404(User, id=recipient_id)
+    try:
+        messages, older_cursor = conversation_history(
+            request.user.id, recipient.id, before=request.GET.get("before")
+        )
+    except InvalidCursor as error:
+        return HttpResponseBadRequest(str(error))
+    return JsonResponse(
+        {
+            "messages": [
+                {
+                    "id": message.id,
+                    "sender_id": message.sender_id,
+                    "sender": message.sender.username,
+                    "content": message.content,
+                    "timestamp": message.timestamp.isoformat(),
+                }
+                for message in messages
+            ],
+            "older_cursor": older_cursor,
+        }
     )
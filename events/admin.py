@@ -1,10 +1,18 @@
 # Register your models here.
 from django.contrib import admin
 
-from .models import Event, EventJoin, Comment, Reaction, FavoriteLocation
+from .models import (
+    Event,
+    EventJoin,
+    EventStats,
+    Comment,
+    Reaction,
+    FavoriteLocation,
+)
 
 admin.site.register(Event)
 admin.site.register(EventJoin)
+admin.site.register(EventStats)
 admin.site.register(Comment)
 admin.site.register(Reaction)
 admin.site.register(FavoriteLocation)
@@ -0,0 +1,240 @@
+"""Admission control of event joins.
+
+An event admits ``capacity - 1`` participants, the creator holds the last
+seat. A seat is taken with a single conditional UPDATE of the EventStats
+counters, ``approved_count = approved_count + 1 WHERE approved_count <
+capacity - 1``, which the database applies to one row at a time: however
+many approvals run concurrently, only as many succeed as there are seats.
+
+Pending joins form the event's waitlist, ordered by the ``position``
+EventJoin gets when it is requested (see join_waitlist). Creators admit
+the head of the waitlist with approve_next, and when removing a
+participant frees a seat of a full event the head takes it.
+
+approve_joins and reject_joins answer many requests at once, each with
+one locked UPDATE of the joins and one of the counters.
+
+Every transaction that changes a join locks the event's counters with
+``get_event_stats(event, lock=True)`` before it locks any of its joins,
+so two of them never wait on each other's locks.
+"""
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from profiles.friends import forget_attendees
+
+from .constants import APPROVED, PENDING, REJECTED
+from .models import EventJoin, EventStats
+from .recommendations import forget_recommendations
+from .stats import get_event_stats, reconcile_event_stats, record_join_change
+
+# outcomes of approve_join
+ADMITTED = "admitted"
+FULL = "full"
+SKIPPED = "skipped"
+
+
+def participant_seats(event):
+    return event.capacity - 1
+
+
+def seats_left(event, stats):
+    return max(participant_seats(event) - stats.approved_count, 0)
+
+
+def _take_seats(event, count):
+    """Move ``count`` pending joins to the approved counter if they fit."""
+    take = EventStats.objects.filter(
+        event_id=event.id, approved_count__lte=participant_seats(event) - count
+    )
+    counters = {
+        "approved_count": F("approved_count") + count,
+        "pending_count": F("pending_count") - count,
+    }
+    if take.update(**counters):
+        return True
+    if EventStats.objects.filter(event_id=event.id).exists():
+        return False
+    # the stats row is missing, count it from the joins and try again
+    reconcile_event_stats([event.id])
+    return bool(take.update(**counters))
+
+
+def approve_join(event, user_id):
+    """Approve the pending join of ``user_id`` if the event has a seat left.
+
+    Returns ADMITTED, FULL when every seat is taken, or SKIPPED when the
+    join is not pending. Raises EventJoin.DoesNotExist without a join.
+    """
+    with transaction.atomic():
+        get_event_stats(event, lock=True)
+        join = EventJoin.objects.select_for_update().get(
+            event_id=event.id, user_id=user_id
+        )
+        if join.status != PENDING:
+            return SKIPPED
+        if not _take_seats(event, 1):
+            return FULL
+        join.status = APPROVED
+        join.save(update_fields=["status"])
+    return ADMITTED
+
+
+def _forget(event_id, user_ids):
+    forget_attendees(event_id)
+    forget_recommendations(*user_ids)
+
+
+def join_waitlist(join):
+    """Put the pending ``join`` at the end of its event's waitlist."""
+    tail = (
+        EventJoin.objects.filter(event_id=OuterRef("event_id"))
+        .order_by()
+        .values("event_id")
+        .annotate(tail=Max("position"))
+        .values("tail")
+    )
+    # concurrent requests can share a position, the id orders them
+    EventJoin.objects.filter(id=join.id).update(
+        position=Coalesce(Subquery(tail), Value(0)) + 1
+    )
+
+
+def waitlist(event):
+    """Return the pending joins of ``event`` in waitlist order."""
+    return EventJoin.objects.filter(event_id=event.id, status=PENDING).order_by(
+        F("position").asc(nulls_last=True), "id"
+    )
+
+
+def waitlist_rank(join):
+    """Return the 1-based place of the pending ``join`` in the waitlist."""
+    ahead = EventJoin.objects.filter(event_id=join.event_id, status=PENDING)
+    if join.position is None:
+        ahead = ahead.filter(Q(position__isnull=False) | Q(id__lt=join.id))
+    else:
+        ahead = ahead.filter(
+            Q(position__lt=join.position) | Q(position=join.position, id__lt=join.id)
+        )
+    return ahead.count() + 1
+
+
+def _admit(event, joins):
+    """Approve the locked pending ``joins`` if they all fit, return whether
+    they did."""
+    if not joins or not _take_seats(event, len(joins)):
+        return False
+    EventJoin.objects.filter(id__in=[join.id for join in joins]).update(status=APPROVED)
+    for join in joins:
+        join.status = APPROVED
+    # update() sends no signals, drop what the EventJoin signals would have
+    user_ids = [join.user_id for join in joins]
+    transaction.on_commit(partial(_forget, event.id, user_ids))
+    return True
+
+
+def promote_waitlist(event, seats):
+    """Approve up to ``seats`` joins from the head of the waitlist and
+    return them. Call it inside a transaction."""
+    joins = list(
+        waitlist(event).select_for_update(of=("self",)).select_related("user")[:seats]
+    )
+    return joins if _admit(event, joins) else []
+
+
+def remove_participant(event, user_id, status):
+    """Move the approved join of ``user_id`` to ``status``, freeing its seat.
+
+    Returns (removed join or None, joins promoted into the freed seat).
+    Raises EventJoin.DoesNotExist without a join.
+    """
+    with transaction.atomic():
+        # counters before the join, the order every join change locks in
+        stats = get_event_stats(event, lock=True)
+        join = EventJoin.objects.select_for_update().get(
+            event_id=event.id, user_id=user_id
+        )
+        if join.status != APPROVED:
+            return None, []
+        was_full = seats_left(event, stats) == 0
+        join.status = status
+        join.save(update_fields=["status"])
+        record_join_change(event.id, APPROVED, status)
+        promoted = promote_waitlist(event, 1) if was_full else []
+    return join, promoted
+
+
+def approve_next(event, count):
+    """Approve the first ``count`` joins of the waitlist that fit in the
+    seats left, with one UPDATE, and return them."""
+    with transaction.atomic():
+        stats = get_event_stats(event, lock=True)
+        seats = min(count, seats_left(event, stats))
+        if seats <= 0:
+            return []
+        return promote_waitlist(event, seats)
+
+
+def _pending_joins(event, user_ids):
+    """Lock the pending joins of ``user_ids`` and return them in the order
+    of ``user_ids``."""
+    joins = {
+        join.user_id: join
+        for join in EventJoin.objects.select_for_update().filter(
+            event_id=event.id, user_id__in=user_ids, status=PENDING
+        )
+    }
+    return [joins[user_id] for user_id in user_ids if user_id in joins]
+
+
+def approve_joins(event, user_ids):
+    """Approve the pending joins of ``user_ids``, in that order, while there
+    are seats left.
+
+    Returns (approved joins, user ids without a pending join, user ids
+    left pending because the event is full).
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    with transaction.atomic():
+        stats = get_event_stats(event, lock=True)
+        joins = _pending_joins(event, user_ids)
+        seats = seats_left(event, stats)
+        approved = joins[:seats]
+        if not _admit(event, approved):
+            approved = []
+    pending = {join.user_id for join in joins}
+    approved_ids = {join.user_id for join in approved}
+    skipped = [user_id for user_id in user_ids if user_id not in pending]
+    over_capacity = [
+        user_id
+        for user_id in user_ids
+        if user_id in pending and user_id not in approved_ids
+    ]
+    return approved, skipped, over_capacity
+
+
+def reject_joins(event, user_ids):
+    """Reject the pending joins of ``user_ids``.
+
+    Returns (rejected joins, user ids without a pending join).
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    with transaction.atomic():
+        get_event_stats(event, lock=True)
+        joins = _pending_joins(event, user_ids)
+        if joins:
+            EventJoin.objects.filter(id__in=[join.id for join in joins]).update(
+                status=REJECTED
+            )
+            record_join_change(event.id, PENDING, REJECTED, count=len(joins))
+            for join in joins:
+                join.status = REJECTED
+            transaction.on_commit(
+                partial(_forget, event.id, [join.user_id for join in joins])
+            )
+    rejected = {join.user_id for join in joins}
+    return joins, [user_id for user_id in user_ids if user_id not in rejected]
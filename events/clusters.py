@@ -0,0 +1,170 @@
+"""Server-side marker clustering for the events map.
+
+The world is cut into 2^zoom x 2^zoom tiles and every tile into a
+CLUSTER_GRID_SIZE x CLUSTER_GRID_SIZE grid of cells. Each non-empty cell
+becomes one cluster with its location and active event counts, so a
+viewport never returns more than a fixed number of clusters however many
+locations there are. Clusters are cached per (zoom, tile), an event that
+ends drops out of them when the cache times out.
+"""
+
+import math
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Min, Value
+from django.db.models.functions import Floor
+from django.utils import timezone
+
+from .constants import (
+    CLUSTER_GRID_SIZE,
+    MAX_CLUSTER_TILES,
+    MAX_CLUSTER_ZOOM,
+    MAP_CLUSTER_CACHE_TIMEOUT,
+)
+
+VERSION_KEY = "map-clusters:version"
+
+
+class ClusterRequestError(ValueError):
+    pass
+
+
+def tile_size(zoom):
+    """Return the (height, width) of a tile in degrees."""
+    return 180.0 / 2**zoom, 360.0 / 2**zoom
+
+
+def tiles_for_bbox(south, west, north, east, zoom):
+    height, width = tile_size(zoom)
+    last = 2**zoom - 1
+    min_x = min(max(int((west + 180.0) // width), 0), last)
+    max_x = min(max(int((east + 180.0) // width), 0), last)
+    min_y = min(max(int((south + 90.0) // height), 0), last)
+    max_y = min(max(int((north + 90.0) // height), 0), last)
+    tiles = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+    if len(tiles) > MAX_CLUSTER_TILES:
+        raise ClusterRequestError("Bounding box is too large for this zoom level.")
+    return tiles
+
+
+def _version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def invalidate_clusters():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # the version key expired or was never set
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def _cache_key(version, zoom, tile):
+    return f"map-clusters:{version}:{zoom}:{tile[0]}:{tile[1]}"
+
+
+def _cell_annotations(zoom, prefix=""):
+    # global cell coordinates, the tile is cell // CLUSTER_GRID_SIZE
+    height, width = tile_size(zoom)
+    cell_height = height / CLUSTER_GRID_SIZE
+    cell_width = width / CLUSTER_GRID_SIZE
+    return {
+        "cell_x": Floor((F(f"{prefix}longitude") + 180.0) / Value(cell_width)),
+        "cell_y": Floor((F(f"{prefix}latitude") + 90.0) / Value(cell_height)),
+    }
+
+
+def _compute_tiles(zoom, tiles):
+    """Aggregate the clusters of ``tiles`` with one query for locations and
+    one for events covering their bounding box."""
+    from location.models import Location
+    from .models import Event
+
+    height, width = tile_size(zoom)
+    min_x = min(x for x, _ in tiles)
+    max_x = max(x for x, _ in tiles)
+    min_y = min(y for _, y in tiles)
+    max_y = max(y for _, y in tiles)
+    bounds = {
+        "latitude__gte": min_y * height - 90.0,
+        "latitude__lt": (max_y + 1) * height - 90.0,
+        "longitude__gte": min_x * width - 180.0,
+        "longitude__lt": (max_x + 1) * width - 180.0,
+    }
+
+    location_cells = (
+        Location.objects.filter(**bounds)
+        .annotate(**_cell_annotations(zoom))
+        .values("cell_x", "cell_y")
+        .annotate(
+            locations=Count("id"),
+            latitude=Avg("latitude"),
+            longitude=Avg("longitude"),
+            location_id=Min("id"),
+        )
+        .order_by()
+    )
+    event_cells = (
+        Event.objects.filter(
+            is_active=True,
+            end_time__gt=timezone.now(),
+            **{f"event_location__{lookup}": value for lookup, value in bounds.items()},
+        )
+        .annotate(**_cell_annotations(zoom, prefix="event_location__"))
+        .values("cell_x", "cell_y")
+        .annotate(events=Count("id"))
+        .order_by()
+    )
+    event_counts = {
+        (int(cell["cell_x"]), int(cell["cell_y"])): cell["events"]
+        for cell in event_cells
+    }
+
+    clusters = {tile: [] for tile in tiles}
+    for cell in location_cells:
+        key = (int(cell["cell_x"]), int(cell["cell_y"]))
+        tile = (key[0] // CLUSTER_GRID_SIZE, key[1] // CLUSTER_GRID_SIZE)
+        if tile not in clusters:
+            continue
+        cluster = {
+            "latitude": cell["latitude"],
+            "longitude": cell["longitude"],
+            "locations": cell["locations"],
+            "events": event_counts.get(key, 0),
+        }
+        # a single location can be drawn as a plain marker
+        if cell["locations"] == 1:
+            cluster["location_id"] = cell["location_id"]
+        clusters[tile].append(cluster)
+    for tile_clusters in clusters.values():
+        tile_clusters.sort(
+            key=lambda cluster: (cluster["latitude"], cluster["longitude"])
+        )
+    return clusters
+
+
+def clusters_for_bbox(south, west, north, east, zoom):
+    if not 0 <= zoom <= MAX_CLUSTER_ZOOM:
+        raise ClusterRequestError(f"Zoom must be between 0 and {MAX_CLUSTER_ZOOM}.")
+    if south > north or west > east:
+        raise ClusterRequestError("Bounding box must be south,west,north,east.")
+    if not all(math.isfinite(value) for value in (south, west, north, east)):
+        raise ClusterRequestError("Bounding box must be finite numbers.")
+    tiles = tiles_for_bbox(south, west, north, east, zoom)
+
+    version = _version()
+    keys = {tile: _cache_key(version, zoom, tile) for tile in tiles}
+    cached = cache.get_many(keys.values())
+    missing = [tile for tile in tiles if keys[tile] not in cached]
+    if missing:
+        computed = _compute_tiles(zoom, missing)
+        cache.set_many(
+            {keys[tile]: computed[tile] for tile in missing},
+            timeout=MAP_CLUSTER_CACHE_TIMEOUT,
+        )
+        cached.update({keys[tile]: computed[tile] for tile in missing})
+
+    clusters = []
+    for tile in tiles:
+        clusters.extend(cached[keys[tile]])
+    return clusters
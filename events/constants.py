@@ -32,6 +32,23 @@ SMALL_CAPACITY = 5
 MEDIUM_CAPACITY = 20
 LARGE_CAPACITY = 50
 
+# radius used by the "events near me" filter, roughly 2 miles
+NEAR_ME_RADIUS_KM = 3.2
+
+# number of events per page on the events listing
+EVENTS_PAGE_SIZE = 20
+
+# map clustering: every tile is split into a CLUSTER_GRID_SIZE^2 grid of cells
+CLUSTER_GRID_SIZE = 8
+MAX_CLUSTER_TILES = 64
+MAX_CLUSTER_ZOOM = 20
+MAP_CLUSTER_CACHE_TIMEOUT = 60 * 5
+
+# identical toggle notifications within this many seconds are sent once
+NOTIFICATION_DEDUPE_SECONDS = 60 * 5
+# cached per-user unread notification counts are recounted at least daily
+UNREAD_COUNT_CACHE_TIMEOUT = 60 * 60 * 24
+
 TAG_ICON_PATHS = [
     "static/events/images/boombox.svg",
     "static/events/images/cup-hot.svg",
@@ -40,3 +57,16 @@ TAG_ICON_PATHS = [
     "static/events/images/easel.svg",
     "static/events/images/book.svg",
 ]
+
+# recommendation scores: every signal an event matches adds its weight
+RECOMMEND_LOCATION_WEIGHT = 3
+RECOMMEND_FAVORITE_WEIGHT = 2
+RECOMMEND_FRIEND_WEIGHT = 4
+# multiplies the tag affinity, the cosine similarity (0 to 1) of the
+# candidate's tags and the tags of the user's events
+RECOMMEND_TAG_WEIGHT = 5
+RECOMMEND_EVENTS_PER_FRIEND = 2
+# most join requests a creator can approve or reject in one bulk request
+BULK_JOIN_UPDATE_LIMIT = 500
+# precomputed recommendations are rebuilt at least hourly
+RECOMMENDATION_CACHE_TIMEOUT = 60 * 60
@@ -0,0 +1,46 @@
+# consumers.py
+
+import json
+from channels.generic.websocket import AsyncWebsocketConsumer
+from asgiref.sync import sync_to_async
+
+
+def notification_group_name(user_id):
+    return f"notifications_{user_id}"
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Pushes the new notifications and unread count of the logged in user."""
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = notification_group_name(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        # catch up with whatever arrived since the page was rendered
+        unread_count = await self.get_unread_count(user.id)
+        await self.send(text_data=json.dumps({"unread_count": unread_count}))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    @sync_to_async
+    def get_unread_count(self, user_id):
+        from .notifications import get_unread_count
+
+        return get_unread_count(user_id)
+
+    # Receive a notification from the user's group
+    async def notification_message(self, event):
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "notification": event["notification"],
+                    "unread_count": event["unread_count"],
+                }
+            )
+        )
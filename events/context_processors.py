@@ -0,0 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
+from .notifications import get_unread_count
+
+
+def unread_notifications(request):
+    """Expose the cached unread notification count of the user to templates.
+
+    The count is only looked up if a template actually renders it.
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        "unread_notification_count": SimpleLazyObject(lambda: get_unread_count(user.id))
+    }
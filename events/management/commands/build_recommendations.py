@@ -0,0 +1,33 @@
+# events/management/commands/build_recommendations.py
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from events.recommendations import refresh_many_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the recommended events of users so their recommendation "
+        "page is served from the cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "user_ids",
+            nargs="*",
+            type=int,
+            help="Only build the recommendations of these users (default: all "
+            "active users)",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options["user_ids"] or list(
+            User.objects.filter(is_active=True)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        refresh_many_recommendations(user_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f"Built recommendations for {len(user_ids)} users")
+        )
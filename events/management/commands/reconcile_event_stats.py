@@ -0,0 +1,54 @@
+# events/management/commands/reconcile_event_stats.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from events.models import Event
+from events.stats import reconcile_event_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the join and reaction counters of events from the EventJoin "
+        "and Reaction rows and repair the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "event_ids",
+            nargs="*",
+            type=int,
+            help="Only reconcile these events (default: all events)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of events reconciled per transaction (default: 500)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the drifted events without repairing them",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        event_ids = options["event_ids"] or list(
+            Event.objects.order_by("id").values_list("id", flat=True)
+        )
+        repaired = []
+        for start in range(0, len(event_ids), batch_size):
+            end = start + batch_size
+            repaired += reconcile_event_stats(
+                event_ids[start:end], dry_run=options["dry_run"]
+            )
+
+        for event_id in repaired:
+            self.stdout.write(f"Event {event_id}: counters drifted")
+        prefix = "Dry run: would have repaired" if options["dry_run"] else "Repaired"
+        self.stdout.write(
+            self.style.SUCCESS(f"{prefix} {len(repaired)} of {len(event_ids)} events")
+        )
@@ -0,0 +1,147 @@
+# events/management/commands/tag_affinity_benchmark.py
+
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from events.affinity import affinity_rows, load_tag_matrices, tag_affinities
+from events.constants import APPROVED
+from events.models import Event, EventJoin
+from location.models import Location
+from tags.models import Tag
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the tag affinity scoring: create USERS users, EVENTS events "
+        "and their tags and joins, then score every event for every user the "
+        "way build_recommendations does, and for SAMPLE users the way a page "
+        "built on a cache miss does. Everything created is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--events", type=int, default=50_000)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--tags-per-event", type=int, default=3)
+        parser.add_argument("--joins", type=int, default=5, help="per user")
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=100,
+            help="Users scored one at a time, as on a cache miss",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        for name in ("users", "events", "tags", "tags_per_event", "sample"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+        if options["tags_per_event"] > options["tags"]:
+            raise CommandError("--tags-per-event cannot be more than --tags")
+
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                self.create_data(options)
+                self.stdout.write(
+                    f"created {options['users']} users and {options['events']} "
+                    f"events in {time.perf_counter() - started:.2f}s"
+                )
+                result = self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(
+            f"loaded {result['users']} x {result['tags']} user and "
+            f"{result['events']} x {result['tags']} event matrices in "
+            f"{result['load_s']:.2f}s"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"scored {result['events']} events for {result['users']} users "
+                f"in batches in {result['batch_s']:.2f}s "
+                f"({result['batch_s'] * 1000 / result['users']:.3f} ms per user)"
+            )
+        )
+        self.stdout.write(
+            f"scored {result['events']} events for {result['sample']} users "
+            f"one at a time in {result['single_s']:.2f}s "
+            f"({result['single_s'] * 1000 / max(result['sample'], 1):.3f} ms per user)"
+        )
+
+    def create_data(self, options):
+        rng = random.Random(options["seed"])
+        location = Location.objects.create(location_name="affinity-benchmark")
+        Tag.objects.bulk_create(
+            Tag(tag_name=f"affinity-benchmark-{i}") for i in range(options["tags"])
+        )
+        User.objects.bulk_create(
+            User(username=f"affinity-benchmark-{i}") for i in range(options["users"])
+        )
+        # bulk_create does not return ids on every backend
+        tags = list(Tag.objects.filter(tag_name__startswith="affinity-benchmark-"))
+        users = list(User.objects.filter(username__startswith="affinity-benchmark-"))
+        now = timezone.now()
+        Event.objects.bulk_create(
+            Event(
+                event_name=f"affinity-benchmark-{i}",
+                event_location=location,
+                start_time=now + timedelta(hours=1),
+                end_time=now + timedelta(hours=2),
+                capacity=10,
+                creator=rng.choice(users),
+            )
+            for i in range(options["events"])
+        )
+        events = list(
+            Event.objects.filter(event_location=location).values_list("id", flat=True)
+        )
+        Event.tags.through.objects.bulk_create(
+            Event.tags.through(event_id=event_id, tag_id=tag.id)
+            for event_id in events
+            for tag in rng.sample(tags, options["tags_per_event"])
+        )
+        EventJoin.objects.bulk_create(
+            EventJoin(user=user, event_id=event_id, status=APPROVED)
+            for user in users
+            for event_id in rng.sample(events, min(options["joins"], len(events)))
+        )
+
+    def run(self, options):
+        started = time.perf_counter()
+        matrices = load_tag_matrices()
+        loaded = time.perf_counter()
+        for _ in affinity_rows(matrices.user_tags, matrices.event_tags):
+            pass
+        batched = time.perf_counter()
+
+        # the inputs of tag_affinities, read back from the matrices
+        event_tags = matrices.event_tags.tolil().rows
+        candidate_tags = {
+            event_id: tags for event_id, tags in zip(matrices.event_ids, event_tags)
+        }
+        sample = matrices.user_tags[: options["sample"]].tolil()
+        single_started = time.perf_counter()
+        for tags, counts in zip(sample.rows, sample.data):
+            tag_affinities(dict(zip(tags, counts)), candidate_tags)
+        single = time.perf_counter()
+        return {
+            "users": len(matrices.user_ids),
+            "events": len(matrices.event_ids),
+            "tags": matrices.user_tags.shape[1],
+            "sample": sample.shape[0],
+            "load_s": loaded - started,
+            "batch_s": batched - loaded,
+            "single_s": single - single_started,
+        }
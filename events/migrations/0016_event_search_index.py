@@ -0,0 +1,37 @@
+# Generated by Django 4.1 on 2026-10-18 16:02
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+INDEX_NAME = "event_search_gin"
+
+
+def search_index():
+    return GinIndex(
+        SearchVector("event_name", "description", config="english"), name=INDEX_NAME
+    )
+
+
+def create_search_index(apps, schema_editor):
+    # GIN/tsvector indexes only exist on PostgreSQL, other backends use the
+    # in-memory fallback in events.search
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.add_index(apps.get_model("events", "Event"), search_index())
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.remove_index(apps.get_model("events", "Event"), search_index())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("events", "0015_alter_notification_is_read"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.1 on 2026-10-18 15:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# copied from events.models so later renames do not break this migration
+JOIN_COUNT_FIELDS = {"approved": "approved_count", "pending": "pending_count"}
+REACTION_COUNT_FIELDS = {
+    "🎉": "cheer_up_count",
+    "👍": "thumbs_up_count",
+    "❤️": "heart_count",
+    "👏": "clap_count",
+    "🙌": "high_five_count",
+}
+
+
+def backfill_event_stats(apps, schema_editor):
+    Event = apps.get_model("events", "Event")
+    EventJoin = apps.get_model("events", "EventJoin")
+    Reaction = apps.get_model("events", "Reaction")
+    EventStats = apps.get_model("events", "EventStats")
+
+    stats = {
+        event_id: EventStats(event_id=event_id)
+        for event_id in Event.objects.values_list("id", flat=True)
+    }
+    joins = (
+        EventJoin.objects.filter(status__in=JOIN_COUNT_FIELDS)
+        .values("event_id", "status")
+        .annotate(count=models.Count("id"))
+        .order_by()
+    )
+    for row in joins:
+        setattr(stats[row["event_id"]], JOIN_COUNT_FIELDS[row["status"]], row["count"])
+    reactions = (
+        Reaction.objects.filter(is_active=True, emoji__in=REACTION_COUNT_FIELDS)
+        .values("event_id", "emoji")
+        .annotate(count=models.Count("id"))
+        .order_by()
+    )
+    for row in reactions:
+        setattr(
+            stats[row["event_id"]], REACTION_COUNT_FIELDS[row["emoji"]], row["count"]
+        )
+    EventStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("events", "0017_event_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EventStats",
+            fields=[
+                (
+                    "event",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="events.event",
+                    ),
+                ),
+                ("approved_count", models.IntegerField(default=0)),
+                ("pending_count", models.IntegerField(default=0)),
+                ("cheer_up_count", models.IntegerField(default=0)),
+                ("thumbs_up_count", models.IntegerField(default=0)),
+                ("heart_count", models.IntegerField(default=0)),
+                ("clap_count", models.IntegerField(default=0)),
+                ("high_five_count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_event_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-18 16:37
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_position(apps, schema_editor):
+    EventJoin = apps.get_model("events", "EventJoin")
+    # ids grow with every request, so they keep the pending joins in order
+    EventJoin.objects.update(position=F("id"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("events", "0018_eventstats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="eventjoin",
+            name="position",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_position, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="eventjoin",
+            index=models.Index(
+                fields=["event", "status", "position"], name="events_join_waitlist_idx"
+            ),
+        ),
+    ]
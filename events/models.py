@@ -1,8 +1,23 @@
-from django.db import models
+from functools import partial
+
+from django.db import models, transaction
+from location.autocomplete import location_index
 from location.models import Location
 from django.contrib.auth.models import User
 from tags.models import Tag
-from .constants import STATUS_CHOICES, PENDING, EMOJI_CHOICES
+from .constants import (
+    STATUS_CHOICES,
+    PENDING,
+    APPROVED,
+    EMOJI_CHOICES,
+    CHEER_UP,
+    THUMBS_UP,
+    HEART,
+    CLAP,
+    HIGH_FIVE,
+)
+from .clusters import invalidate_clusters
+from .recommendations import forget_recommendations, invalidate_recommendations
 
 # Create your models here.
 
@@ -18,11 +33,44 @@ class Event(models.Model):
     creator = models.ForeignKey(User, on_delete=models.CASCADE, default=1)
     tags = models.ManyToManyField(Tag)
     image = models.ImageField(upload_to="event_images/", blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.event_name
 
 
+# counters of EventStats, keyed by the join status or emoji they count
+JOIN_COUNT_FIELDS = {APPROVED: "approved_count", PENDING: "pending_count"}
+REACTION_COUNT_FIELDS = {
+    CHEER_UP: "cheer_up_count",
+    THUMBS_UP: "thumbs_up_count",
+    HEART: "heart_count",
+    CLAP: "clap_count",
+    HIGH_FIVE: "high_five_count",
+}
+
+
+class EventStats(models.Model):
+    """Denormalized join and reaction counts of an event, see events.stats."""
+
+    event = models.OneToOneField(
+        Event, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    approved_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+    cheer_up_count = models.IntegerField(default=0)
+    thumbs_up_count = models.IntegerField(default=0)
+    heart_count = models.IntegerField(default=0)
+    clap_count = models.IntegerField(default=0)
+    high_five_count = models.IntegerField(default=0)
+
+    def reaction_count(self, emoji):
+        return getattr(self, REACTION_COUNT_FIELDS[emoji])
+
+    def __str__(self):
+        return f"Stats of {self.event_id}"
+
+
 class FavoriteLocation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
@@ -33,9 +81,17 @@ class EventJoin(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # place in the event's waitlist, pending joins are approved lowest first
+    position = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         unique_together = ("user", "event")
+        indexes = [
+            models.Index(
+                fields=["event", "status", "position"],
+                name="events_join_waitlist_idx",
+            )
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.event.event_name} - {self.get_status_display()}"
@@ -71,3 +127,80 @@ class Notification(models.Model):
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.IntegerField(default=0)
+
+
+def create_event_stats(sender, instance, created, **kwargs):
+    if created:
+        EventStats.objects.get_or_create(event=instance)
+
+
+def invalidate_map_clusters(sender, **kwargs):
+    invalidate_clusters()
+
+
+def invalidate_location_popularity(sender, **kwargs):
+    transaction.on_commit(location_index.invalidate_popularity)
+
+
+# event fields deciding which events are recommended and in what order,
+# the rest is read fresh when the page loads the events
+RECOMMENDATION_FIELDS = (
+    "event_location_id",
+    "creator_id",
+    "is_active",
+    "start_time",
+    "end_time",
+)
+
+
+def _recommendation_state(event):
+    # deferred fields are left out instead of loaded
+    return tuple(event.__dict__.get(field) for field in RECOMMENDATION_FIELDS)
+
+
+def remember_recommendation_state(sender, instance, **kwargs):
+    instance._recommendation_state = _recommendation_state(instance)
+
+
+def event_saved_recommendations(sender, instance, created, **kwargs):
+    state = _recommendation_state(instance)
+    if created or state != instance._recommendation_state:
+        # after commit, a rebuild before it would cache the old event
+        transaction.on_commit(invalidate_recommendations)
+    instance._recommendation_state = state
+
+
+def invalidate_event_recommendations(sender, action=None, **kwargs):
+    # m2m_changed also fires before every change, only react to the result
+    if action is None or action.startswith("post_"):
+        transaction.on_commit(invalidate_recommendations)
+
+
+def forget_user_recommendations(sender, instance, **kwargs):
+    transaction.on_commit(partial(forget_recommendations, instance.user_id))
+
+
+models.signals.post_save.connect(create_event_stats, sender=Event)
+
+# Cached map clusters are stale once an event or location changes
+models.signals.post_save.connect(invalidate_map_clusters, sender=Event)
+models.signals.post_delete.connect(invalidate_map_clusters, sender=Event)
+models.signals.post_save.connect(invalidate_map_clusters, sender=Location)
+models.signals.post_delete.connect(invalidate_map_clusters, sender=Location)
+
+# Autocomplete ranks locations by their number of upcoming events
+models.signals.post_save.connect(invalidate_location_popularity, sender=Event)
+models.signals.post_delete.connect(invalidate_location_popularity, sender=Event)
+
+# New or changed events can be recommended to anyone, joins and favorite
+# locations change the recommendations of their user
+models.signals.post_init.connect(remember_recommendation_state, sender=Event)
+models.signals.post_save.connect(event_saved_recommendations, sender=Event)
+models.signals.post_delete.connect(invalidate_event_recommendations, sender=Event)
+models.signals.m2m_changed.connect(
+    invalidate_event_recommendations, sender=Event.tags.through
+)
+models.signals.post_save.connect(forget_user_recommendations, sender=EventJoin)
+models.signals.post_delete.connect(forget_user_recommendations, sender=EventJoin)
+models.signals.post_save.connect(forget_user_recommendations, sender=FavoriteLocation)
+models.signals.post_delete.connect(forget_user_recommendations, sender=FavoriteLocation)
@@ -0,0 +1,182 @@
+"""Notification service used by the views instead of Notification.objects.create.
+
+``notify`` queues a notification for when the current transaction commits,
+so a rolled back view never notifies anyone and the write never holds the
+view's row locks. While NotificationMiddleware has a batch open, committed
+notifications are collected and written with one bulk_create when the
+view returns. Outside a request they are written as soon as they commit.
+
+Toggles (join requests, reactions, friend requests) pass ``dedupe=True``:
+a notification identical to one the same user got within
+NOTIFICATION_DEDUPE_SECONDS is dropped, so flipping a toggle back and forth
+does not flood the other user.
+
+Written notifications are pushed to the recipients' NotificationConsumer
+sockets together with their new unread count.
+
+Unread counts live in the cache: incremented when notifications are
+written, set when the notifications page marks them read, and counted
+from the database again after a miss.
+"""
+
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .constants import NOTIFICATION_DEDUPE_SECONDS, UNREAD_COUNT_CACHE_TIMEOUT
+from .consumers import notification_group_name
+
+logger = logging.getLogger(__name__)
+
+_batch = ContextVar("notification_batch", default=None)
+
+
+def notify(user=None, message="", dedupe=False, user_id=None):
+    """Send ``message`` to ``user`` (or ``user_id``) once the current
+    transaction commits."""
+    from .models import Notification
+
+    if user is not None:
+        user_id = user.id
+    notification = Notification(user_id=user_id, message=message)
+    transaction.on_commit(partial(_enqueue, notification, dedupe))
+
+
+def _enqueue(notification, dedupe):
+    batch = _batch.get()
+    if batch is None:
+        write_notifications([(notification, dedupe)])
+    else:
+        batch.append((notification, dedupe))
+
+
+def _unread_key(user_id):
+    return f"notifications:unread:{user_id}"
+
+
+def get_unread_count(user_id):
+    from .models import Notification
+
+    count = cache.get(_unread_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read__lte=0).count()
+        # add, not set: a concurrent increment already holds a fresher value
+        cache.add(_unread_key(user_id), count, timeout=UNREAD_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def set_unread_count(user_id, count):
+    cache.set(_unread_key(user_id), count, timeout=UNREAD_COUNT_CACHE_TIMEOUT)
+
+
+def forget_unread_count(user_id):
+    cache.delete(_unread_key(user_id))
+
+
+def increment_unread_count(user_id, delta=1):
+    """Add ``delta`` new unread notifications, return the new count."""
+    try:
+        return cache.incr(_unread_key(user_id), delta)
+    except ValueError:
+        # not cached, the rows are already written so a recount includes them
+        return get_unread_count(user_id)
+
+
+def write_notifications(entries):
+    """Bulk create [(notification, dedupe)] and return the created ones."""
+    from .models import Notification
+
+    if not entries:
+        return []
+    recent = set()
+    deduped_users = {notification.user_id for notification, dedupe in entries if dedupe}
+    if deduped_users:
+        cutoff = timezone.now() - timedelta(seconds=NOTIFICATION_DEDUPE_SECONDS)
+        recent = set(
+            Notification.objects.filter(
+                user_id__in=deduped_users, timestamp__gte=cutoff
+            ).values_list("user_id", "message")
+        )
+    notifications = []
+    for notification, dedupe in entries:
+        key = (notification.user_id, notification.message)
+        if dedupe and key in recent:
+            continue
+        recent.add(key)
+        notifications.append(notification)
+    notifications = Notification.objects.bulk_create(notifications)
+    push_notifications(notifications)
+    return notifications
+
+
+def _forget_unread_counts(user_ids):
+    try:
+        cache.delete_many([_unread_key(user_id) for user_id in user_ids])
+    except Exception:
+        logger.exception("Could not forget the unread notification counts")
+
+
+def push_notifications(notifications):
+    """Count new notifications as unread and send them to the recipients'
+    sockets with the new unread counts."""
+    added = Counter(notification.user_id for notification in notifications)
+    try:
+        unread_counts = {
+            user_id: increment_unread_count(user_id, count)
+            for user_id, count in added.items()
+        }
+    except Exception:
+        # the notifications are saved, they are counted again from the rows
+        logger.exception("Could not count the new notifications as unread")
+        _forget_unread_counts(added)
+        return
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        for notification in notifications:
+            async_to_sync(channel_layer.group_send)(
+                notification_group_name(notification.user_id),
+                {
+                    "type": "notification.message",
+                    "notification": {
+                        "id": notification.id,
+                        "message": notification.message,
+                        "timestamp": notification.timestamp.isoformat(),
+                    },
+                    "unread_count": unread_counts.get(notification.user_id, 0),
+                },
+            )
+    except Exception:
+        # the notifications are saved, a page load still shows them
+        logger.exception("Could not push notifications")
+
+
+@contextmanager
+def notification_batch():
+    """Collect the notifications committed inside the block, write them at exit."""
+    batch = []
+    token = _batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _batch.reset(token)
+        write_notifications(batch)
+
+
+class NotificationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with notification_batch():
+            return self.get_response(request)
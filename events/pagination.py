@@ -0,0 +1,78 @@
+"""Keyset (cursor) pagination for event listings.
+
+Pages are ordered by (start_time, id) descending and a cursor encodes the
+last row of the previous page, so fetching page 50 costs the same indexed
+range scan as page 1 instead of an ever growing OFFSET.
+
+Listings ranked by an annotation, the search ``rank`` or the near-me
+``distance``, put it in front of the key with ``leading`` and the cursor
+carries its value too.
+"""
+
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+from .constants import EVENTS_PAGE_SIZE
+
+# (field, descending, parse) of the columns pages are ordered by, the
+# last one is unique so a cursor names exactly one row
+START_TIME_KEY = (("start_time", True, datetime.fromisoformat), ("id", True, int))
+RANK_KEY = ("rank", True, float)
+DISTANCE_KEY = ("distance", False, float)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _format(value):
+    return value.isoformat() if isinstance(value, datetime) else repr(value)
+
+
+def encode_cursor(event, key=START_TIME_KEY):
+    raw = "|".join(_format(getattr(event, field)) for field, _, _ in key)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, key=START_TIME_KEY):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        values = raw.split("|")
+        if len(values) != len(key):
+            raise ValueError("wrong number of values")
+        return [parse(value) for (_, _, parse), value in zip(key, values)]
+    except (ValueError, UnicodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from error
+
+
+def after_cursor(key, values):
+    """Build a Q matching the rows that come after ``values`` in ``key`` order."""
+    query = Q()
+    equal = Q()
+    for (field, descending, _), value in zip(key, values):
+        lookup = "lt" if descending else "gt"
+        query |= equal & Q(**{f"{field}__{lookup}": value})
+        equal &= Q(**{field: value})
+    return query
+
+
+def paginate_events(queryset, cursor=None, page_size=EVENTS_PAGE_SIZE, leading=()):
+    """Return (events, next_cursor) for the page that follows ``cursor``.
+
+    ``leading`` keys order the page before the start time.
+    """
+    key = (*leading, *START_TIME_KEY)
+    queryset = queryset.order_by(
+        *(f"-{field}" if descending else field for field, descending, _ in key)
+    )
+    if cursor:
+        queryset = queryset.filter(after_cursor(key, decode_cursor(cursor, key)))
+    # fetch one extra row to know whether another page exists
+    events = list(queryset[: page_size + 1])
+    next_cursor = None
+    if len(events) > page_size:
+        events = events[:page_size]
+        next_cursor = encode_cursor(events[-1], key)
+    return events, next_cursor
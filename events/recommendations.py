@@ -0,0 +1,271 @@
+"""Precomputed event recommendations.
+
+``build_recommendations`` scores every upcoming event a user neither
+created nor joined by the signals the recommendation page shows: events
+at locations of the user's own events, at their favorite locations,
+created by their friends, and sharing tags with their own events (see
+affinity.py). The ranked candidates and the page sections are cached per user, so the page
+itself is one cache lookup and one query loading the events.
+
+Cached lists are versioned twice. A user's version is bumped when their
+joins, favorite locations or friends change, and the global version when
+any event or its tags change, since that can add candidates for everyone.
+A list built while its version is bumped is stored under the old version
+and never read.
+"""
+
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .affinity import AffinityRow, affinity_rows, load_tag_matrices, tag_affinities
+from .constants import (
+    APPROVED,
+    PENDING,
+    RECOMMEND_EVENTS_PER_FRIEND,
+    RECOMMEND_FAVORITE_WEIGHT,
+    RECOMMEND_FRIEND_WEIGHT,
+    RECOMMEND_LOCATION_WEIGHT,
+    RECOMMEND_TAG_WEIGHT,
+    RECOMMENDATION_CACHE_TIMEOUT,
+)
+
+VERSION_KEY = "recommendations:version"
+
+
+def _user_version_key(user_id):
+    return f"recommendations:user:{user_id}:version"
+
+
+def _cache_key(version, user_version, user_id):
+    return f"recommendations:{version}:{user_version}:{user_id}"
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the version key expired or was never set
+        cache.set(key, 1, timeout=None)
+
+
+def invalidate_recommendations():
+    """Rebuild the recommendations of every user on their next visit."""
+    _bump(VERSION_KEY)
+
+
+def forget_recommendations(*user_ids):
+    """Rebuild the recommendations of ``user_ids`` on their next visit."""
+    for user_id in user_ids:
+        _bump(_user_version_key(user_id))
+
+
+def _versions(user_id):
+    keys = [VERSION_KEY, _user_version_key(user_id)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, 1, timeout=None)
+            versions[key] = cache.get(key, 1)
+    return [versions[key] for key in keys]
+
+
+def build_recommendations(user_id, affinities=None):
+    """Return the ranked recommendations of ``user_id`` as event ids.
+
+    ``ranked`` holds every candidate, best first; the sections hold the
+    candidates the page shows under each heading in the same order.
+    ``affinities`` maps event ids to the user's tag affinity when it was
+    scored in bulk, see refresh_many_recommendations.
+    """
+    from profiles.friends import friend_ids as load_friend_ids
+
+    from .models import Event, FavoriteLocation
+
+    own_events = (
+        Event.objects.filter(
+            Q(creator_id=user_id)
+            | Q(eventjoin__user_id=user_id, eventjoin__status__in=[APPROVED, PENDING])
+        )
+        .values_list("id", "event_location_id")
+        .distinct()
+    )
+    own_event_ids = set()
+    location_ids = set()
+    for event_id, location_id in own_events:
+        own_event_ids.add(event_id)
+        location_ids.add(location_id)
+
+    # number of the user's events carrying each tag, most used first
+    tag_counts = {}
+    tag_names = {}
+    if own_event_ids:
+        tag_rows = (
+            Event.tags.through.objects.filter(event_id__in=own_event_ids)
+            .values("tag_id", "tag__tag_name")
+            .annotate(count=Count("event_id"))
+            .order_by("-count", "tag__tag_name")
+        )
+        for row in tag_rows:
+            tag_counts[row["tag_id"]] = row["count"]
+            tag_names[row["tag_id"]] = row["tag__tag_name"]
+
+    favorite_ids = set(
+        FavoriteLocation.objects.filter(user_id=user_id).values_list(
+            "location_id", flat=True
+        )
+    )
+    friend_ids = load_friend_ids(user_id)
+
+    recommendations = {
+        "ranked": [],
+        "by_location": [],
+        "favorites": [],
+        "by_tag": [],
+        "by_friend": [],
+    }
+    if not (location_ids or favorite_ids or friend_ids or tag_counts):
+        return recommendations
+
+    candidates = list(
+        Event.objects.exclude(id__in=own_event_ids)
+        .filter(is_active=True, end_time__gt=timezone.now())
+        .filter(
+            Q(event_location_id__in=location_ids | favorite_ids)
+            | Q(creator_id__in=friend_ids)
+            | Q(tags__in=list(tag_counts))
+        )
+        .values_list("id", "event_location_id", "creator_id", "start_time")
+        .distinct()
+    )
+    candidate_tags = defaultdict(list)
+    if tag_counts and candidates:
+        for event_id, tag_id in Event.tags.through.objects.filter(
+            event_id__in=[candidate[0] for candidate in candidates]
+        ).values_list("event_id", "tag_id"):
+            candidate_tags[event_id].append(tag_id)
+    if affinities is None:
+        affinities = tag_affinities(tag_counts, candidate_tags)
+
+    scores = {}
+    for event_id, location_id, creator_id, start_time in candidates:
+        score = RECOMMEND_TAG_WEIGHT * affinities.get(event_id, 0)
+        if location_id in location_ids:
+            score += RECOMMEND_LOCATION_WEIGHT
+        if location_id in favorite_ids:
+            score += RECOMMEND_FAVORITE_WEIGHT
+        if creator_id in friend_ids:
+            score += RECOMMEND_FRIEND_WEIGHT
+        # ties go to the event happening first
+        scores[event_id] = (-score, start_time, event_id)
+    ranked = sorted(candidates, key=lambda candidate: scores[candidate[0]])
+
+    friend_events = defaultdict(int)
+    for event_id, location_id, creator_id, start_time in ranked:
+        recommendations["ranked"].append(event_id)
+        if location_id in location_ids:
+            recommendations["by_location"].append(event_id)
+        elif location_id in favorite_ids:
+            recommendations["favorites"].append(event_id)
+        if (
+            creator_id in friend_ids
+            and friend_events[creator_id] < RECOMMEND_EVENTS_PER_FRIEND
+        ):
+            friend_events[creator_id] += 1
+            recommendations["by_friend"].append(event_id)
+    for tag_id in tag_counts:
+        tagged = [
+            event_id
+            for event_id in recommendations["ranked"]
+            if tag_id in candidate_tags[event_id]
+        ]
+        if tagged:
+            recommendations["by_tag"].append((tag_names[tag_id], tagged))
+    return recommendations
+
+
+def refresh_recommendations(user_id, affinities=None):
+    """Build the recommendations of ``user_id`` and cache them."""
+    # read the versions first, a change during the build then discards it
+    key = _cache_key(*_versions(user_id), user_id)
+    recommendations = build_recommendations(user_id, affinities)
+    cache.set(key, recommendations, timeout=RECOMMENDATION_CACHE_TIMEOUT)
+    return recommendations
+
+
+def refresh_many_recommendations(user_ids):
+    """Build and cache the recommendations of ``user_ids``.
+
+    The tag affinities of all of them are scored with batched matrix
+    products (see affinity.affinity_rows) instead of one product per user.
+    """
+    matrices = load_tag_matrices()
+    rows = {user_id: row for row, user_id in enumerate(matrices.user_ids)}
+    positions = {
+        event_id: position for position, event_id in enumerate(matrices.event_ids)
+    }
+    tagged = [user_id for user_id in user_ids if user_id in rows]
+    if tagged:
+        scores = affinity_rows(
+            matrices.user_tags[[rows[user_id] for user_id in tagged]],
+            matrices.event_tags,
+        )
+        for user_id, row in zip(tagged, scores):
+            refresh_recommendations(user_id, AffinityRow(positions, row))
+    # users without tagged events have no tag affinity
+    for user_id in user_ids:
+        if user_id not in rows:
+            refresh_recommendations(user_id, {})
+
+
+def get_recommendations(user_id):
+    """Return the cached recommendations of ``user_id``, building them on a miss."""
+    recommendations = cache.get(_cache_key(*_versions(user_id), user_id))
+    if recommendations is None:
+        recommendations = refresh_recommendations(user_id)
+    return recommendations
+
+
+def recommended_events(user_id):
+    """Return the page sections of ``user_id`` with their events loaded and
+    the number of the user's friends going to each as ``friends_going``.
+
+    Events that ended or were deactivated since the list was built are
+    left out.
+    """
+    from profiles.friends import friends_attending_many
+
+    from .models import Event
+
+    recommendations = get_recommendations(user_id)
+    events = (
+        Event.objects.select_related("event_location")
+        .filter(
+            id__in=recommendations["ranked"],
+            is_active=True,
+            end_time__gt=timezone.now(),
+        )
+        .in_bulk()
+        if recommendations["ranked"]
+        else {}
+    )
+
+    for event_id, friends in friends_attending_many(user_id, list(events)).items():
+        events[event_id].friends_going = len(friends)
+
+    def load(event_ids):
+        return [events[event_id] for event_id in event_ids if event_id in events]
+
+    by_tag = []
+    for tag_name, event_ids in recommendations["by_tag"]:
+        tagged = load(event_ids)
+        if tagged:
+            by_tag.append((tag_name, tagged))
+    return {
+        "by_location": load(recommendations["by_location"]),
+        "favorites": load(recommendations["favorites"]),
+        "by_tag": by_tag,
+        "by_friend": load(recommendations["by_friend"]),
+    }
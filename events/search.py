@@ -0,0 +1,63 @@
+"""Full-text search over events, see location.search for the backends."""
+
+from django.contrib.postgres.search import SearchRank, SearchVector
+from django.db.models import FloatField, Q
+from django.db.models.functions import Cast
+
+from location.search import (
+    SEARCH_CONFIG,
+    InvertedIndex,
+    prefix_search_query,
+    rank_by_ids,
+    search_locations,
+    tokenize,
+    use_postgres_search,
+)
+
+# the GIN index is built on exactly this expression, keep them in sync
+EVENT_SEARCH_VECTOR = SearchVector("event_name", "description", config=SEARCH_CONFIG)
+
+
+def search_events(queryset, query):
+    """Narrow ``queryset`` to events matching ``query``, annotated with ``rank``.
+
+    An event matches on its own name and description or on the name and
+    address of its location.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+    if use_postgres_search():
+        search_query = prefix_search_query(terms)
+        matching_locations = search_locations(query).values("id")
+        location_vector = SearchVector(
+            "event_location__location_name",
+            "event_location__address",
+            config=SEARCH_CONFIG,
+        )
+        return (
+            queryset.annotate(search=EVENT_SEARCH_VECTOR)
+            .filter(Q(search=search_query) | Q(event_location__in=matching_locations))
+            .annotate(
+                # ts_rank is a float4, a double survives the round trip
+                # through the page cursor unchanged
+                rank=Cast(
+                    SearchRank(EVENT_SEARCH_VECTOR, search_query)
+                    + SearchRank(location_vector, search_query, weights=[0.1] * 4),
+                    FloatField(),
+                )
+            )
+        )
+    index = InvertedIndex()
+    for event_id, name, description, location_name, address in queryset.values_list(
+        "id",
+        "event_name",
+        "description",
+        "event_location__location_name",
+        "event_location__address",
+    ):
+        index.add(event_id, name, weight=1.0)
+        index.add(event_id, description, weight=0.4)
+        index.add(event_id, location_name, weight=0.2)
+        index.add(event_id, address, weight=0.1)
+    return rank_by_ids(queryset, index.search(query))
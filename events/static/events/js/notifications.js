@@ -0,0 +1,26 @@
+// keeps the notification badge up to date over a websocket
+(function () {
+  const badge = document.getElementById('notification-badge');
+  if (!badge || !window.WebSocket) {
+    return;
+  }
+  const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+
+  function connect(delay) {
+    const socket = new WebSocket(scheme + window.location.host + '/ws/notifications/');
+    socket.onopen = function () {
+      delay = 1000;
+    };
+    socket.onmessage = function (e) {
+      const data = JSON.parse(e.data);
+      badge.textContent = data.unread_count;
+      badge.style.display = data.unread_count > 0 ? '' : 'none';
+    };
+    socket.onclose = function () {
+      // back off up to a minute when the server goes away
+      setTimeout(function () { connect(Math.min(delay * 2, 60000)); }, delay);
+    };
+  }
+
+  connect(1000);
+})();
@@ -1,77 +1,108 @@
+// draws the server-side clusters of the visible part of the map, see
+// events/clusters.py; a location's events are fetched when its marker opens
+const MAX_CLUSTER_ZOOM = 20;
+let clusterMarkers = [];
+let clusterRequest = null;
+
 async function initMap() {
-    map = new google.maps.Map(document.getElementById("map"), {
-      center: { lat: 40.71159438471519, lng: -73.97424027294727 },
-      zoom: 12,
-      mapId: '9a7e26117f10196d'
-    });
-        const responseEvent = await fetch('events/');
-        const responseLocation = await fetch('locations/');
+  map = new google.maps.Map(document.getElementById("map"), {
+    center: { lat: 40.71159438471519, lng: -73.97424027294727 },
+    zoom: 12,
+    mapId: '9a7e26117f10196d'
+  });
+  const infoWindow = new google.maps.InfoWindow();
+  // idle fires once panning or zooming settles
+  map.addListener("idle", () => loadClusters(infoWindow));
+}
 
-        const eventHtml = document.getElementsByClassName('event-name');
-        let eventIds = [];
-        for(let i =0; i<eventHtml.length;i++){
-          eventIds[i]= Number(eventHtml[i].getAttribute('id'));
-        }       
-        const event_data = await responseEvent.json();
-        console.log(event_data);
-        const location_objects = await responseLocation.json();
-        const location_data = event_data.location_data;
-        const locations = location_objects.locations;
-        const locationmap = new Map();
-        for(let i =0; i<locations.length;i++){
-            locationmap.set(locations[i].pk,[locations[i].fields.latitude,locations[i].fields.longitude])
-        }
-        let duplicateLocationsMap = {};
-        for(let i=0; i<location_data.length;i++){
-            let loc = location_data[i].fields;
-            if(eventIds.includes(event_data.location_data[i].pk)){
-            if(!duplicateLocationsMap[loc.event_location]){
-                    duplicateLocationsMap[loc.event_location] = [];
-                }
-                duplicateLocationsMap[loc.event_location].push({name:loc.event_name,id:event_data.location_data[i].pk});
-        }
-      }
-        for(let i =0; i<location_data.length;i++){
-          if(eventIds.includes(event_data.location_data[i].pk)){
-                let lat = -1, lng = -1;
-                if(locationmap.get(location_data[i].fields.event_location)!=null){
-                    lat = locationmap.get(location_data[i].fields.event_location)[0];
-                    lng = locationmap.get(location_data[i].fields.event_location)[1];
-                }
-            const marker = new google.maps.Marker({
-                position: {lat: lat, lng:lng},
-                map,
-                title: location_data[i].fields.event_name,
-                icon: {
-                    url: "https://www.svgviewer.dev/static-svgs/490211/marker.svg",
-                    scaledSize: new google.maps.Size(30,35)
-                },
-                animation: google.maps.Animation.DROP
-              });
-              const popupContent = document.createElement('div');
-            const locEvents = duplicateLocationsMap[location_data[i].fields.event_location];
-            locEvents.forEach((locEvent) => { 
-                var eventNameDiv = document.createElement('div');
-                eventNameDiv.className = "eventnameDiv";
-                eventNameDiv.addEventListener("click", function(e){
-                    window.location.href = window.location.origin+"/events/"+`${locEvent.id}`;
-                });
-                eventNameDiv.innerHTML = `${locEvent.name}`+"\n";
-                
-                popupContent.appendChild(eventNameDiv);
-                
-            }); 
-              
-            const infoWindow = new google.maps.InfoWindow({
-            content: popupContent,
-            });
-                
-              marker.addListener("click", () => {
-                infoWindow.open(map, marker);
-              }); 
+async function loadClusters(infoWindow) {
+  const bounds = map.getBounds();
+  if (!bounds) {
+    return;
+  }
+  const south = bounds.getSouthWest().lat();
+  const north = bounds.getNorthEast().lat();
+  let west = bounds.getSouthWest().lng();
+  let east = bounds.getNorthEast().lng();
+  if (west > east) {
+    // the view crosses the antimeridian
+    west = -180;
+    east = 180;
+  }
+  const zoom = Math.min(Math.max(Math.round(map.getZoom()), 0), MAX_CLUSTER_ZOOM);
+
+  // only the latest view matters
+  if (clusterRequest) {
+    clusterRequest.abort();
+  }
+  clusterRequest = new AbortController();
+  let data;
+  try {
+    const response = await fetch(
+      `map-clusters/?bbox=${south},${west},${north},${east}&zoom=${zoom}`,
+      { signal: clusterRequest.signal }
+    );
+    if (!response.ok) {
+      return;
     }
+    data = await response.json();
+  } catch (error) {
+    return;
   }
-    
+
+  clusterMarkers.forEach((marker) => marker.setMap(null));
+  clusterMarkers = data.clusters
+    .filter((cluster) => cluster.events > 0)
+    .map((cluster) => clusterMarker(cluster, infoWindow));
+}
+
+function clusterMarker(cluster, infoWindow) {
+  const position = { lat: cluster.latitude, lng: cluster.longitude };
+  if (cluster.location_id === undefined) {
+    // several locations: show the event count, zoom in on click
+    const marker = new google.maps.Marker({
+      position,
+      map,
+      label: { text: String(cluster.events), color: "white" },
+      title: `${cluster.events} events`
+    });
+    marker.addListener("click", () => {
+      map.setCenter(position);
+      map.setZoom(Math.min(map.getZoom() + 2, MAX_CLUSTER_ZOOM));
+    });
+    return marker;
   }
+  const marker = new google.maps.Marker({
+    position,
+    map,
+    icon: {
+      url: "https://www.svgviewer.dev/static-svgs/490211/marker.svg",
+      scaledSize: new google.maps.Size(30, 35)
+    }
+  });
+  marker.addListener("click", async () => {
+    infoWindow.setContent(await locationEvents(cluster.location_id));
+    infoWindow.open(map, marker);
+  });
+  return marker;
+}
+
+async function locationEvents(locationId) {
+  const response = await fetch(`map-data/?location=${locationId}`);
+  // compact payload: {fields: [...], rows: [[...], ...]}
+  const mapData = await response.json();
+  const column = {};
+  mapData.fields.forEach((field, index) => { column[field] = index; });
 
- 
\ No newline at end of file
+  const popupContent = document.createElement('div');
+  mapData.rows.forEach((row) => {
+    const eventNameDiv = document.createElement('div');
+    eventNameDiv.className = "eventnameDiv";
+    eventNameDiv.addEventListener("click", function () {
+      window.location.href = window.location.origin + "/events/" + `${row[column.id]}`;
+    });
+    eventNameDiv.textContent = row[column.event_name];
+    popupContent.appendChild(eventNameDiv);
+  });
+  return popupContent;
+}
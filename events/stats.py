@@ -0,0 +1,128 @@
+"""Denormalized join and reaction counters of events.
+
+Views that change a join status or a reaction adjust the matching
+EventStats counters with F() expressions inside the same transaction, so
+showing the counts is a primary key lookup instead of a recount. Rows
+written outside those views (the admin, fixtures, shell scripts) make the
+counters drift; ``reconcile_event_stats`` recounts them from the source
+rows and is run by the reconcile_event_stats management command.
+"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import (
+    Event,
+    EventJoin,
+    EventStats,
+    Reaction,
+    JOIN_COUNT_FIELDS,
+    REACTION_COUNT_FIELDS,
+)
+
+COUNT_FIELDS = list(JOIN_COUNT_FIELDS.values()) + list(REACTION_COUNT_FIELDS.values())
+
+
+def _apply(event_id, deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = EventStats.objects.filter(event_id=event_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    if not updated:
+        # the stats row is missing, counting from scratch includes this change
+        reconcile_event_stats([event_id])
+
+
+def record_join_change(event_id, old_status, new_status, count=1):
+    """Move ``count`` joins from the ``old_status`` counter to the
+    ``new_status`` one.
+
+    ``old_status`` is None for a new join. Call it after saving the join,
+    in the same transaction.
+    """
+    deltas = defaultdict(int)
+    if old_status in JOIN_COUNT_FIELDS:
+        deltas[JOIN_COUNT_FIELDS[old_status]] -= count
+    if new_status in JOIN_COUNT_FIELDS:
+        deltas[JOIN_COUNT_FIELDS[new_status]] += count
+    _apply(event_id, deltas)
+
+
+def record_reaction_change(event_id, emoji, delta):
+    if emoji in REACTION_COUNT_FIELDS:
+        _apply(event_id, {REACTION_COUNT_FIELDS[emoji]: delta})
+
+
+def get_event_stats(event, lock=False):
+    """Return the EventStats of ``event``, locked for update if ``lock``."""
+    queryset = EventStats.objects.select_for_update() if lock else EventStats.objects
+    try:
+        return queryset.get(event_id=event.id)
+    except EventStats.DoesNotExist:
+        reconcile_event_stats([event.id])
+        return queryset.get(event_id=event.id)
+
+
+def count_event_stats(event_ids):
+    """Recount the counters of ``event_ids`` from the join and reaction rows."""
+    counts = {event_id: dict.fromkeys(COUNT_FIELDS, 0) for event_id in event_ids}
+    joins = (
+        EventJoin.objects.filter(event_id__in=event_ids, status__in=JOIN_COUNT_FIELDS)
+        .values("event_id", "status")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for row in joins:
+        counts[row["event_id"]][JOIN_COUNT_FIELDS[row["status"]]] = row["count"]
+    reactions = (
+        Reaction.objects.filter(
+            event_id__in=event_ids, is_active=True, emoji__in=REACTION_COUNT_FIELDS
+        )
+        .values("event_id", "emoji")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for row in reactions:
+        counts[row["event_id"]][REACTION_COUNT_FIELDS[row["emoji"]]] = row["count"]
+    return counts
+
+
+def reconcile_event_stats(event_ids, dry_run=False):
+    """Repair the counters of ``event_ids`` that drifted from the source rows.
+
+    Returns the ids of the events whose stats were missing or wrong.
+    """
+    event_ids = list(event_ids)
+    with transaction.atomic():
+        # lock the counters before counting, a concurrent view then either
+        # committed its change already or applies its delta after ours
+        existing = {
+            stats.event_id: stats
+            for stats in EventStats.objects.select_for_update().filter(
+                event_id__in=event_ids
+            )
+        }
+        event_ids = list(
+            Event.objects.filter(id__in=event_ids).values_list("id", flat=True)
+        )
+        counts = count_event_stats(event_ids)
+        to_create = []
+        to_update = []
+        for event_id, event_counts in counts.items():
+            stats = existing.get(event_id)
+            if stats is None:
+                to_create.append(EventStats(event_id=event_id, **event_counts))
+            elif any(
+                getattr(stats, field) != count for field, count in event_counts.items()
+            ):
+                for field, count in event_counts.items():
+                    setattr(stats, field, count)
+                to_update.append(stats)
+        if not dry_run:
+            EventStats.objects.bulk_create(to_create, ignore_conflicts=True)
+            EventStats.objects.bulk_update(to_update, COUNT_FIELDS)
+    return sorted(stats.event_id for stats in to_create + to_update)
@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
 from django.urls import reverse
 from .models import (
     Event,
@@ -8,14 +8,20 @@ from .models import (
     Notification,
     Reaction,
     FavoriteLocation,
+    EventStats,
 )
 from profiles.models import UserFriends, UserProfile
+from location.geo import filter_within_radius
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from datetime import datetime
 import json
 import pytz
+import random
+import threading
+import time
+from unittest import mock
 from .constants import (
     PENDING,
     APPROVED,
@@ -27,10 +33,45 @@ from .constants import (
     SMALL_CAPACITY,
     MEDIUM_CAPACITY,
     LARGE_CAPACITY,
+    EVENTS_PAGE_SIZE,
 )
 
 from tags.models import Tag
 from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from .notifications import (
+    notify,
+    notification_batch,
+    write_notifications,
+    get_unread_count,
+    set_unread_count,
+)
+from .consumers import NotificationConsumer
+from .recommendations import (
+    build_recommendations,
+    get_recommendations,
+    refresh_many_recommendations,
+)
+from .affinity import AffinityRow, affinity_rows, load_tag_matrices, tag_affinities
+from .admission import (
+    ADMITTED,
+    FULL,
+    SKIPPED,
+    approve_join,
+    approve_next,
+    reject_joins,
+    remove_participant,
+    waitlist,
+    waitlist_rank,
+)
+from .stats import count_event_stats, get_event_stats, reconcile_event_stats
+from channels.testing import WebsocketCommunicator
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from io import StringIO
 
 
 class EventIndexViewCapacityFilterTest(TestCase):
@@ -164,6 +205,274 @@ class EventIndexViewFilterNegativeTest(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class EventIndexViewNearMeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.near_location = Location.objects.create(
+            location_name="Washington Square Park", latitude=40.7308, longitude=-73.9973
+        )
+        self.far_location = Location.objects.create(
+            location_name="Prospect Park", latitude=40.6602, longitude=-73.9690
+        )
+        self.near_event = Event.objects.create(
+            event_name="Near Event",
+            start_time=timezone.now() + timedelta(days=1),
+            end_time=timezone.now() + timedelta(days=1, hours=2),
+            capacity=10,
+            event_location=self.near_location,
+            creator=self.user,
+        )
+        self.far_event = Event.objects.create(
+            event_name="Far Event",
+            start_time=timezone.now() + timedelta(days=1),
+            end_time=timezone.now() + timedelta(days=1, hours=2),
+            capacity=10,
+            event_location=self.far_location,
+            creator=self.user,
+        )
+
+    def test_events_near_me_filters_by_distance(self):
+        response = self.client.get(
+            reverse("events:index"),
+            {"events_near_me": "true", "lat": "40.7300", "lon": "-73.9980"},
+        )
+        events = list(response.context["events"])
+        self.assertEqual(events, [self.near_event])
+        self.assertLess(events[0].distance, 1)
+
+    def test_events_near_me_are_nearest_first(self):
+        union_square = Location.objects.create(
+            location_name="Union Square", latitude=40.7359, longitude=-73.9911
+        )
+        # starts later than the near event, ordering by time would put it first
+        union_square_event = Event.objects.create(
+            event_name="Union Square Event",
+            start_time=timezone.now() + timedelta(days=2),
+            end_time=timezone.now() + timedelta(days=2, hours=2),
+            capacity=10,
+            event_location=union_square,
+            creator=self.user,
+        )
+        params = {"events_near_me": "true", "lat": "40.7308", "lon": "-73.9973"}
+        response = self.client.get(reverse("events:index"), params)
+        self.assertEqual(
+            list(response.context["events"]), [self.near_event, union_square_event]
+        )
+
+    def test_near_me_pages_follow_the_cursor(self):
+        from .pagination import DISTANCE_KEY, paginate_events
+
+        events = filter_within_radius(
+            Event.objects.all(), 40.7300, -73.9980, 20, prefix="event_location__"
+        )
+        first, cursor = paginate_events(events, page_size=1, leading=[DISTANCE_KEY])
+        second, last_cursor = paginate_events(
+            events, cursor, page_size=1, leading=[DISTANCE_KEY]
+        )
+        self.assertEqual(first + second, [self.near_event, self.far_event])
+        self.assertIsNone(last_cursor)
+
+    def test_events_near_me_without_coordinates_shows_all_events(self):
+        response = self.client.get(reverse("events:index"), {"events_near_me": "true"})
+        self.assertIn(self.near_event, response.context["events"])
+        self.assertIn(self.far_event, response.context["events"])
+
+
+class EventIndexQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.tag = Tag.objects.create(tag_name="Sports")
+        self.locations = [
+            Location.objects.create(location_name=f"Park {i}") for i in range(5)
+        ]
+        self.events = []
+        for i in range(20):
+            event = Event.objects.create(
+                event_name=f"Event {i}",
+                start_time=timezone.now() + timedelta(days=1, hours=i),
+                end_time=timezone.now() + timedelta(days=1, hours=i + 2),
+                capacity=10,
+                event_location=self.locations[i % 5],
+                creator=self.user,
+            )
+            event.tags.add(self.tag)
+            self.events.append(event)
+        FavoriteLocation.objects.create(user=self.user, location=self.locations[1])
+
+    def test_index_query_count_does_not_grow_with_events(self):
+        # events + prefetched tags + tag choices rendered by the filter form
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("events:index"))
+        self.assertEqual(len(response.context["events"]), 20)
+
+    def test_search_query_count_does_not_grow_with_events(self):
+        # on PostgreSQL the search is part of the events query, the SQLite
+        # fallback reads the candidate rows once more to build its index
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("events:index"), {"search": "Park 3"})
+        self.assertEqual(
+            set(response.context["events"]),
+            {
+                event
+                for event in self.events
+                if event.event_location_id == self.locations[3].id
+            },
+        )
+
+    def test_favorite_location_filter_uses_location_ids(self):
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(
+            reverse("events:index"), {"favorite_location_events": "on"}
+        )
+        self.assertEqual(
+            set(response.context["events"]),
+            {
+                event
+                for event in self.events
+                if event.event_location_id == self.locations[1].id
+            },
+        )
+
+
+class EventSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.park = Location.objects.create(
+            location_name="Central Park", address="5th Ave"
+        )
+        self.museum = Location.objects.create(
+            location_name="Brooklyn Museum", address="200 Eastern Pkwy"
+        )
+        self.run_event = Event.objects.create(
+            event_name="Morning Run",
+            description="An easy jog around the reservoir",
+            start_time=timezone.now() + timedelta(days=1),
+            end_time=timezone.now() + timedelta(days=1, hours=2),
+            capacity=10,
+            event_location=self.park,
+            creator=self.user,
+        )
+        self.art_event = Event.objects.create(
+            event_name="Sketching Afternoon",
+            description="Bring a pencil and run wild",
+            start_time=timezone.now() + timedelta(days=2),
+            end_time=timezone.now() + timedelta(days=2, hours=2),
+            capacity=10,
+            event_location=self.museum,
+            creator=self.user,
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse("events:index"), {"search": query})
+        return list(response.context["events"])
+
+    def test_search_matches_word_prefixes(self):
+        self.assertEqual(self.search("morn"), [self.run_event])
+
+    def test_search_matches_description(self):
+        self.assertEqual(self.search("reservoir"), [self.run_event])
+
+    def test_search_matches_location_name(self):
+        self.assertEqual(self.search("brooklyn"), [self.art_event])
+
+    def test_search_requires_every_term(self):
+        self.assertEqual(self.search("sketch museum"), [self.art_event])
+        self.assertEqual(self.search("sketch park"), [])
+
+    def test_search_ranks_name_matches_first(self):
+        from .search import search_events
+
+        results = list(search_events(Event.objects.all(), "run").order_by("-rank"))
+        self.assertEqual(results, [self.run_event, self.art_event])
+
+    def test_index_lists_matches_by_relevance(self):
+        # the later event would come first by start time
+        self.assertEqual(self.search("run"), [self.run_event, self.art_event])
+
+    def test_ranked_pages_follow_the_cursor(self):
+        from .pagination import RANK_KEY, paginate_events
+        from .search import search_events
+
+        matches = search_events(Event.objects.all(), "run")
+        first, cursor = paginate_events(matches, page_size=1, leading=[RANK_KEY])
+        second, last_cursor = paginate_events(
+            matches, cursor, page_size=1, leading=[RANK_KEY]
+        )
+        self.assertEqual(first + second, [self.run_event, self.art_event])
+        self.assertIsNone(last_cursor)
+
+
+class EventIndexPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.location = Location.objects.create(location_name="Test Location")
+        start_time = timezone.now() + timedelta(days=1)
+        # pairs of events share a start time so the id tie-breaker is exercised
+        self.events = [
+            Event.objects.create(
+                event_name=f"Event {i}",
+                start_time=start_time + timedelta(hours=i // 2),
+                end_time=start_time + timedelta(hours=i // 2 + 2),
+                capacity=10,
+                event_location=self.location,
+                creator=self.user,
+            )
+            for i in range(EVENTS_PAGE_SIZE + 5)
+        ]
+        self.expected_order = sorted(
+            self.events, key=lambda event: (event.start_time, event.id), reverse=True
+        )
+
+    def test_first_page_is_limited(self):
+        response = self.client.get(reverse("events:index"))
+        self.assertEqual(
+            list(response.context["events"]), self.expected_order[:EVENTS_PAGE_SIZE]
+        )
+        self.assertIsNotNone(response.context["next_cursor"])
+        self.assertContains(response, "More events")
+
+    def test_next_page_follows_cursor(self):
+        first_page = self.client.get(reverse("events:index"))
+        response = self.client.get(
+            reverse("events:index"), {"cursor": first_page.context["next_cursor"]}
+        )
+        self.assertEqual(
+            list(response.context["events"]), self.expected_order[EVENTS_PAGE_SIZE:]
+        )
+        self.assertIsNone(response.context["next_cursor"])
+        self.assertNotContains(response, "More events")
+
+    def test_deep_page_query_count_matches_first_page(self):
+        first_page = self.client.get(reverse("events:index"))
+        with self.assertNumQueries(3):
+            self.client.get(
+                reverse("events:index"), {"cursor": first_page.context["next_cursor"]}
+            )
+
+    def test_json_variant_walks_every_page(self):
+        seen = []
+        params = {"format": "json"}
+        while True:
+            data = self.client.get(reverse("events:index"), params).json()
+            seen.extend(event["id"] for event in data["events"])
+            if not data["next_cursor"]:
+                break
+            params["cursor"] = data["next_cursor"]
+        self.assertEqual(seen, [event.id for event in self.expected_order])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("events:index"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+
 class UpdateEventViewTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -392,49 +701,209 @@ class MapGetDataTest(TestCase):
         )
         self.location1 = Location.objects.create(location_name="Test Location 1")
         self.location2 = Location.objects.create(location_name="Test Location 2")
+        self.start = timezone.now() + timedelta(days=1)
+        self.end = self.start + timedelta(hours=2)
         self.event1 = Event.objects.create(
             event_name="Test Event",
-            start_time="2023-11-01T12:00",
-            end_time="2023-11-01T14:00",
+            start_time=self.start,
+            end_time=self.end,
             capacity=100,
             is_active=True,
             event_location=self.location1,
             creator=self.user,
         )
-        self.event1 = Event.objects.create(
+        self.inactive_event = Event.objects.create(
             event_name="Test Event 2",
-            start_time="2023-11-01T12:00",
-            end_time="2023-11-01T14:00",
+            start_time=self.start,
+            end_time=self.end,
             capacity=100,
             is_active=False,
             event_location=self.location2,
             creator=self.user,
         )
 
-    def test_get_events_view(self):
-        response = self.client.get(reverse("events:events"))
+    def get_map_data(self, params=None, **headers):
+        response = self.client.get(reverse("events:map-data"), params, **headers)
+        if response.status_code != 200:
+            return response, None
+        return response, json.loads(b"".join(response.streaming_content))
+
+    def test_map_data_lists_active_events_with_coordinates(self):
+        response, data = self.get_map_data()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            data["fields"],
+            ["id", "event_name", "location_id", "latitude", "longitude"],
+        )
+        self.assertEqual(
+            data["rows"],
+            [
+                [
+                    self.event1.id,
+                    "Test Event",
+                    self.location1.id,
+                    self.location1.latitude,
+                    self.location1.longitude,
+                ]
+            ],
+        )
+
+    def test_map_data_of_one_location(self):
+        Event.objects.create(
+            event_name="Elsewhere",
+            start_time=self.start,
+            end_time=self.end,
+            capacity=100,
+            event_location=self.location2,
+            creator=self.user,
+        )
+        _, data = self.get_map_data({"location": self.location1.id})
+        self.assertEqual([row[0] for row in data["rows"]], [self.event1.id])
+        response, _ = self.get_map_data({"location": "park"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_map_data_leaves_out_ended_events(self):
+        Event.objects.create(
+            event_name="Ended",
+            start_time=timezone.now() - timedelta(hours=3),
+            end_time=timezone.now() - timedelta(hours=1),
+            capacity=100,
+            event_location=self.location1,
+            creator=self.user,
+        )
+        _, data = self.get_map_data()
+        self.assertEqual([row[0] for row in data["rows"]], [self.event1.id])
+
+    def test_map_data_etag_changes_when_an_event_ends(self):
+        response, _ = self.get_map_data()
+        etag = response["ETag"]
+        with mock.patch(
+            "events.views.timezone.now", return_value=self.end + timedelta(minutes=1)
+        ):
+            response, data = self.get_map_data(HTTP_IF_NONE_MATCH=etag)
         self.assertEqual(response.status_code, 200)
-        data = response.json()
-        self.assertIn("location_data", data)
+        self.assertEqual(data["rows"], [])
 
-        # Check the content of the location_data
-        location_data = data["location_data"]
-        self.assertEqual(len(location_data), 1)
+    def test_map_data_revalidates_with_etag(self):
+        response, _ = self.get_map_data()
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertTrue(response.has_header("Last-Modified"))
+        etag = response["ETag"]
 
-    def test_get_location_view(self):
-        response = self.client.get(
-            reverse("events:locations")
-        )  # Replace "get_locations" with your actual URL name
+        response, _ = self.get_map_data(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
 
+        self.event1.event_name = "Renamed Event"
+        self.event1.save()
+        response, data = self.get_map_data(HTTP_IF_NONE_MATCH=etag)
         self.assertEqual(response.status_code, 200)
-        data = response.json()
+        self.assertEqual(data["rows"][0][1], "Renamed Event")
+
+    def test_map_data_streams_in_batches(self):
+        for i in range(3):
+            Event.objects.create(
+                event_name=f"Extra Event {i}",
+                start_time=self.start,
+                end_time=self.end,
+                capacity=100,
+                event_location=self.location2,
+                creator=self.user,
+            )
+        with mock.patch("events.views.MAP_DATA_BATCH_SIZE", 2):
+            response = self.client.get(reverse("events:map-data"))
+            chunks = list(response.streaming_content)
+        # opening, two batches of two rows, closing
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(len(json.loads(b"".join(chunks))["rows"]), 4)
+
+
+class MapClustersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        # two locations close together in Manhattan, one in Brooklyn
+        self.washington_square = Location.objects.create(
+            location_name="Washington Square Park", latitude=40.7308, longitude=-73.9973
+        )
+        self.union_square = Location.objects.create(
+            location_name="Union Square", latitude=40.7359, longitude=-73.9911
+        )
+        self.prospect_park = Location.objects.create(
+            location_name="Prospect Park", latitude=40.6602, longitude=-73.9690
+        )
+        for location in (self.washington_square, self.union_square):
+            Event.objects.create(
+                event_name=f"Event at {location}",
+                start_time=timezone.now() + timedelta(days=1),
+                end_time=timezone.now() + timedelta(days=1, hours=2),
+                capacity=10,
+                event_location=location,
+                creator=self.user,
+            )
+        self.params = {"bbox": "40.55,-74.10,40.85,-73.85", "zoom": 11}
+
+    def get_clusters(self, params):
+        return self.client.get(reverse("events:map-clusters"), params)
+
+    def test_clusters_group_nearby_locations(self):
+        clusters = self.get_clusters(self.params).json()["clusters"]
+        self.assertEqual(len(clusters), 2)
+        by_size = sorted(clusters, key=lambda cluster: cluster["locations"])
+        self.assertEqual(by_size[0]["location_id"], self.prospect_park.id)
+        self.assertEqual(by_size[0]["events"], 0)
+        self.assertEqual(by_size[1]["locations"], 2)
+        self.assertEqual(by_size[1]["events"], 2)
+        self.assertNotIn("location_id", by_size[1])
+
+    def test_clusters_count_only_events_that_have_not_ended(self):
+        Event.objects.create(
+            event_name="Ended",
+            start_time=timezone.now() - timedelta(hours=3),
+            end_time=timezone.now() - timedelta(hours=1),
+            capacity=10,
+            event_location=self.prospect_park,
+            creator=self.user,
+        )
+        clusters = self.get_clusters(self.params).json()["clusters"]
+        prospect_park = next(
+            cluster
+            for cluster in clusters
+            if cluster.get("location_id") == self.prospect_park.id
+        )
+        self.assertEqual(prospect_park["events"], 0)
+
+    def test_high_zoom_splits_clusters(self):
+        params = {"bbox": "40.72,-74.01,40.74,-73.98", "zoom": 16}
+        clusters = self.get_clusters(params).json()["clusters"]
+        self.assertEqual(
+            {cluster["location_id"] for cluster in clusters},
+            {self.washington_square.id, self.union_square.id},
+        )
+
+    def test_clusters_are_cached_per_tile(self):
+        self.get_clusters(self.params)
+        with self.assertNumQueries(0):
+            self.get_clusters(self.params)
 
-        # Check the JSON response structure
-        self.assertIn("locations", data)
+    def test_saving_a_location_invalidates_clusters(self):
+        self.get_clusters(self.params)
+        Location.objects.create(
+            location_name="Brooklyn Museum", latitude=40.6712, longitude=-73.9636
+        )
+        clusters = self.get_clusters(self.params).json()["clusters"]
+        self.assertEqual(sum(cluster["locations"] for cluster in clusters), 4)
 
-        # Check the content of the locations
-        locations = data["locations"]
-        self.assertEqual(len(locations), 2)
+    def test_invalid_requests(self):
+        for params in (
+            {"bbox": "40.85,-74.10,40.55,-73.85", "zoom": 11},
+            {"bbox": "40.55,-74.10,40.85", "zoom": 11},
+            {"bbox": "40.55,-74.10,40.85,inf", "zoom": 11},
+            {"bbox": "-90,-180,90,180", "zoom": 10},
+            {"bbox": "40.55,-74.10,40.85,-73.85", "zoom": "far"},
+        ):
+            self.assertEqual(self.get_clusters(params).status_code, 400)
 
 
 class EventJoinRequestTest(TestCase):
@@ -465,13 +934,15 @@ class EventJoinRequestTest(TestCase):
         self.client.login(username="testuser", password="testpassword")
         url = reverse("events:toggle-join-request", args=[self.event.id])
         # Initially, the user has not joined the event
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         # Check that the EventJoin was created with the status 'pending'
         join = EventJoin.objects.get(user=self.user, event=self.event)
         self.assertEqual(join.status, PENDING)
         self.assertEqual(Notification.objects.count(), 1)
         # Make the POST request again to toggle the status to 'withdrawn'
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         # Fetch the updated join object and check its status
         join.refresh_from_db()
         self.assertEqual(join.status, WITHDRAWN)
@@ -532,7 +1003,8 @@ class EventCreatorManageRequestTest(TestCase):
     def test_approve_join_request(self):
         self.client.login(username="testcreator", password="testpassword")
         url = reverse("events:approve-request", args=[self.event.id, self.user.id])
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         self.join_request.refresh_from_db()
         self.assertEqual(response.status_code, 302)
         self.assertEqual(Notification.objects.count(), 1)
@@ -541,7 +1013,8 @@ class EventCreatorManageRequestTest(TestCase):
     def test_reject_join_request(self):
         self.client.login(username="testcreator", password="testpassword")
         url = reverse("events:reject-request", args=[self.event.id, self.user.id])
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         self.join_request.refresh_from_db()
         self.assertEqual(response.status_code, 302)
         self.assertEqual(Notification.objects.count(), 1)
@@ -643,7 +1116,8 @@ class EventCreatorRemoveApprovedRequestTest(TestCase):
         url = reverse(
             "events:remove-approved-request", args=[self.event.id, self.user.id]
         )
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         self.join_request.refresh_from_db()
         self.assertEqual(response.status_code, 302)
         self.assertEqual(Notification.objects.count(), 1)
@@ -980,7 +1454,8 @@ class CommentTestCase(TestCase):
     def test_create_comment(self):
         self.client.login(username="testuser", password="testpassword")
         url = reverse("events:add-comment", args=[self.event.id])
-        response = self.client.post(url, {"content": "Test comment"})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"content": "Test comment"})
         # Check that the Comment was created
         self.assertEqual(Comment.objects.count(), 1)
         self.assertEqual(Notification.objects.count(), 1)
@@ -1103,12 +1578,13 @@ class ReplyTestCase(TestCase):
         self.client.logout()
         self.client.login(username="testuser", password="testpassword")
         reply_content = "This is a reply"
-        response = self.client.post(
-            reverse("events:add-reply", args=[self.event.id, self.parent.id]),
-            {
-                "content": reply_content,
-            },
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("events:add-reply", args=[self.event.id, self.parent.id]),
+                {
+                    "content": reply_content,
+                },
+            )
 
         self.assertEqual(
             response.status_code, 302
@@ -1361,12 +1837,14 @@ class ReactionTestCase(TestCase):
         self.client.login(username="testuser", password="testpassword")
         url = reverse("events:toggle-reaction", args=[self.event.id, self.emoji])
         # Initially, the user has not reacted to the event
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         reaction = Reaction.objects.get(user=self.user, event=self.event)
         self.assertEqual(reaction.emoji, CHEER_UP)
         self.assertTrue(reaction.is_active)
         # Make the POST request again to withdraw the reaction
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         reaction.refresh_from_db()
         self.assertEqual(Notification.objects.count(), 2)
         self.assertFalse(reaction.is_active)
@@ -2249,6 +2727,7 @@ class ReplyProfanityTestCase(TestCase):
 
 class RecommendEventTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(
             username="testuser1", password="testpassword"
         )
@@ -2332,27 +2811,29 @@ class RecommendEventTestCase(TestCase):
         self.assertContains(response, "Test Event 1")
         self.assertContains(response, "Test Event 2")
         self.assertNotContains(response, "Test Event 3")
-        event4 = Event.objects.create(
-            event_name="Test Event 4",
-            event_location=self.location1,
-            start_time=self.current_time_ny + timedelta(hours=9),
-            end_time=self.current_time_ny + timedelta(hours=10),
-            capacity=8,
-            is_active=True,
-            creator=self.creator,
-        )
-        event4.tags.set([self.tag3])
-        event5 = Event.objects.create(
-            event_name="Test Event 5",
-            event_location=self.location1,
-            start_time=self.current_time_ny + timedelta(hours=15),
-            end_time=self.current_time_ny + timedelta(hours=30),
-            capacity=2,
-            is_active=True,
-            creator=self.creator,
-        )
-        event5.tags.set([self.tag3])
-        EventJoin.objects.create(user=self.user2, event=event5)
+        # the recommendations are invalidated once the changes commit
+        with self.captureOnCommitCallbacks(execute=True):
+            event4 = Event.objects.create(
+                event_name="Test Event 4",
+                event_location=self.location1,
+                start_time=self.current_time_ny + timedelta(hours=9),
+                end_time=self.current_time_ny + timedelta(hours=10),
+                capacity=8,
+                is_active=True,
+                creator=self.creator,
+            )
+            event4.tags.set([self.tag3])
+            event5 = Event.objects.create(
+                event_name="Test Event 5",
+                event_location=self.location1,
+                start_time=self.current_time_ny + timedelta(hours=15),
+                end_time=self.current_time_ny + timedelta(hours=30),
+                capacity=2,
+                is_active=True,
+                creator=self.creator,
+            )
+            event5.tags.set([self.tag3])
+            EventJoin.objects.create(user=self.user2, event=event5)
         response = self.client.get(reverse("events:recommend-event"))
         self.assertContains(response, "Test Event 1")
         self.assertContains(response, "Test Event 2")
@@ -2376,12 +2857,13 @@ class RecommendEventTestCase(TestCase):
         self.assertNotContains(response, "Test Event 4")
         user2_userprofile = UserProfile.objects.get(user=self.user2)
         user1_userprofile = UserProfile.objects.get(user=self.user1)
-        UserFriends.objects.create(
-            user=self.user2, friends=user1_userprofile, status=APPROVED
-        )
-        UserFriends.objects.create(
-            user=self.user1, friends=user2_userprofile, status=APPROVED
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFriends.objects.create(
+                user=self.user2, friends=user1_userprofile, status=APPROVED
+            )
+            UserFriends.objects.create(
+                user=self.user1, friends=user2_userprofile, status=APPROVED
+            )
         response = self.client.get(reverse("events:recommend-event"))
         self.assertContains(response, "Test Event 4")
 
@@ -2437,3 +2919,909 @@ class AddToFavoritesTestCase(TestCase):
             str(response.content, encoding="utf8"),
             {"success": "Location is already a favorite"},
         )
+
+
+class EventStatsTest(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.location = Location.objects.create(location_name="Test Location")
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name="Test Event",
+            event_location=self.location,
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=10,
+            creator=self.creator,
+        )
+
+    def stats(self):
+        return EventStats.objects.get(event=self.event)
+
+    def test_stats_created_with_event(self):
+        stats = self.stats()
+        self.assertEqual(stats.approved_count, 0)
+        self.assertEqual(stats.pending_count, 0)
+
+    def test_join_counters_follow_status_changes(self):
+        self.client.login(username="testuser", password="testpassword")
+        toggle_url = reverse("events:toggle-join-request", args=[self.event.id])
+        self.client.post(toggle_url)
+        self.assertEqual(self.stats().pending_count, 1)
+        self.client.post(toggle_url)
+        self.assertEqual(self.stats().pending_count, 0)
+        self.client.post(toggle_url)
+
+        self.client.login(username="testcreator", password="testpassword")
+        self.client.post(
+            reverse("events:approve-request", args=[self.event.id, self.user.id])
+        )
+        stats = self.stats()
+        self.assertEqual((stats.pending_count, stats.approved_count), (0, 1))
+        self.client.post(
+            reverse(
+                "events:remove-approved-request", args=[self.event.id, self.user.id]
+            )
+        )
+        stats = self.stats()
+        self.assertEqual((stats.pending_count, stats.approved_count), (0, 0))
+
+    def test_reject_decrements_pending(self):
+        EventJoin.objects.create(user=self.user, event=self.event, status=PENDING)
+        EventStats.objects.filter(event=self.event).update(pending_count=1)
+        self.client.login(username="testcreator", password="testpassword")
+        self.client.post(
+            reverse("events:reject-request", args=[self.event.id, self.user.id])
+        )
+        self.assertEqual(self.stats().pending_count, 0)
+
+    def test_reaction_counters(self):
+        self.client.login(username="testuser", password="testpassword")
+        url = reverse("events:toggle-reaction", args=[self.event.id, HEART])
+        self.client.post(url)
+        self.assertEqual(self.stats().heart_count, 1)
+        response = self.client.get(reverse("events:event-detail", args=[self.event.id]))
+        self.assertIn((HEART, 1, []), response.context["emoji_data_list"])
+        self.client.post(url)
+        self.assertEqual(self.stats().heart_count, 0)
+
+    def test_missing_stats_are_rebuilt(self):
+        EventJoin.objects.create(user=self.user, event=self.event, status=APPROVED)
+        EventStats.objects.filter(event=self.event).delete()
+        response = self.client.get(reverse("events:event-detail", args=[self.event.id]))
+        self.assertEqual(response.context["approved_join_count"], 1)
+
+    def test_reconcile_command_repairs_drift(self):
+        # rows created outside the views do not touch the counters
+        EventJoin.objects.create(user=self.user, event=self.event, status=APPROVED)
+        Reaction.objects.create(user=self.user, event=self.event, emoji=CHEER_UP)
+        out = StringIO()
+        call_command("reconcile_event_stats", "--dry-run", stdout=out)
+        self.assertIn("would have repaired 1 of 1 events", out.getvalue())
+        self.assertEqual(self.stats().approved_count, 0)
+
+        out = StringIO()
+        call_command("reconcile_event_stats", stdout=out)
+        self.assertIn("Repaired 1 of 1 events", out.getvalue())
+        stats = self.stats()
+        self.assertEqual(stats.approved_count, 1)
+        self.assertEqual(stats.cheer_up_count, 1)
+
+        out = StringIO()
+        call_command("reconcile_event_stats", str(self.event.id), stdout=out)
+        self.assertIn("Repaired 0 of 1 events", out.getvalue())
+
+
+class EventDetailCommentQueryCountTest(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="testpassword")
+            for i in range(5)
+        ]
+        self.location = Location.objects.create(location_name="Test Location")
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name="Test Event",
+            event_location=self.location,
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=10,
+            creator=self.creator,
+        )
+        self.url = reverse("events:event-detail", args=[self.event.id])
+
+    def create_comments(self, count):
+        # half of them top-level comments, the other half replies to them
+        comments = Comment.objects.bulk_create(
+            Comment(
+                event=self.event,
+                user=self.users[i % len(self.users)],
+                content=f"Comment {i}",
+                is_private=i % 3 == 0,
+            )
+            for i in range(count // 2)
+        )
+        Comment.objects.bulk_create(
+            Comment(
+                event=self.event,
+                user=self.users[(i + 1) % len(self.users)],
+                parent=comment,
+                content=f"Reply {i}",
+                is_private=i % 4 == 0,
+            )
+            for i, comment in enumerate(comments)
+        )
+
+    def test_query_count_does_not_grow_with_comments(self):
+        self.client.login(username="user0", password="testpassword")
+        self.create_comments(10)
+        with self.assertNumQueries(13):
+            self.client.get(self.url)
+        self.create_comments(490)
+        with self.assertNumQueries(13):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["comments_with_replies"]), 250)
+
+    def test_private_replies_are_filtered_per_viewer(self):
+        comment = Comment.objects.create(
+            event=self.event, user=self.users[0], content="Public comment"
+        )
+        Comment.objects.create(
+            event=self.event,
+            user=self.users[1],
+            parent=comment,
+            content="Private reply",
+            is_private=True,
+        )
+        Comment.objects.create(
+            event=self.event,
+            user=self.users[1],
+            parent=comment,
+            content="Deleted reply",
+            is_active=False,
+        )
+
+        self.client.login(username="user2", password="testpassword")
+        response = self.client.get(self.url)
+        ((shown, replies),) = response.context["comments_with_replies"]
+        self.assertEqual(replies, [])
+        self.assertTrue(shown.has_replies)
+
+        self.client.login(username="user0", password="testpassword")
+        response = self.client.get(self.url)
+        ((_, replies),) = response.context["comments_with_replies"]
+        self.assertEqual([reply.content for reply in replies], ["Private reply"])
+
+
+class NotificationServiceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+
+    def test_batch_is_written_with_one_query(self):
+        # the insert, then the unread counts pushed to the sockets
+        with self.assertNumQueries(2):
+            with notification_batch():
+                with self.captureOnCommitCallbacks(execute=True):
+                    notify(self.user, "First")
+                    notify(self.user, "Second")
+        self.assertEqual(
+            sorted(Notification.objects.values_list("message", flat=True)),
+            ["First", "Second"],
+        )
+
+    def test_rolled_back_notification_is_not_sent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    notify(self.user, "Never sent")
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(Notification.objects.exists())
+
+    def test_repeated_toggles_are_deduplicated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.user, "Toggled", dedupe=True)
+            notify(self.user, "Toggled", dedupe=True)
+            notify(self.user, "Not a toggle")
+            notify(self.user, "Not a toggle")
+        self.assertEqual(Notification.objects.filter(message="Toggled").count(), 1)
+        self.assertEqual(Notification.objects.filter(message="Not a toggle").count(), 2)
+
+        # outside the window the same notification is sent again
+        Notification.objects.update(timestamp=timezone.now() - timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.user, "Toggled", dedupe=True)
+        self.assertEqual(Notification.objects.filter(message="Toggled").count(), 2)
+
+    def test_failing_unread_count_does_not_fail_the_write(self):
+        set_unread_count(self.user.id, 5)
+        with mock.patch(
+            "events.notifications.increment_unread_count",
+            side_effect=ConnectionError,
+        ), self.assertLogs("events.notifications", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                notify(self.user, "Still saved")
+        self.assertTrue(Notification.objects.filter(message="Still saved").exists())
+        # the stale count is dropped and recounted from the rows
+        self.assertEqual(get_unread_count(self.user.id), 1)
+
+
+class NotificationConsumerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.other_user = User.objects.create_user(
+            username="otheruser", password="testpassword"
+        )
+        Notification.objects.create(user=self.user, message="Before connecting")
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(), "/ws/notifications/"
+        )
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_anonymous_user_is_rejected(self):
+        communicator, connected = await self.connect(AnonymousUser())
+        self.assertFalse(connected)
+
+    async def test_new_notifications_are_pushed(self):
+        communicator, connected = await self.connect(self.user)
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {"unread_count": 1})
+
+        await sync_to_async(write_notifications)(
+            [
+                (Notification(user=self.user, message="Hello"), False),
+                (Notification(user=self.other_user, message="Not yours"), False),
+            ]
+        )
+        data = await communicator.receive_json_from()
+        self.assertEqual(data["notification"]["message"], "Hello")
+        self.assertEqual(data["unread_count"], 2)
+        # only the recipient's socket gets it
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class UnreadNotificationCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.user_profile = UserProfile.objects.get(user=self.user)
+        Notification.objects.create(user=self.user, message="Existing")
+
+    def test_count_is_rebuilt_then_served_from_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unread_count(self.user.id), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.user.id), 1)
+
+    def test_new_notifications_increment_the_count(self):
+        get_unread_count(self.user.id)
+        write_notifications(
+            [
+                (Notification(user=self.user, message=f"New {i}"), False)
+                for i in range(3)
+            ]
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.user.id), 4)
+
+    def test_reading_notifications_resets_the_count(self):
+        get_unread_count(self.user.id)
+        self.client.login(username="testuser", password="testpassword")
+        self.client.get(reverse("profiles:display_notifications"))
+        self.assertEqual(get_unread_count(self.user.id), 0)
+
+    def test_context_processor_renders_the_badge(self):
+        self.client.login(username="testuser", password="testpassword")
+        url = reverse("profiles:view_profile", args=[self.user_profile.id])
+        response = self.client.get(url)
+        self.assertEqual(response.context["unread_notification_count"], 1)
+        self.assertContains(response, 'id="notification-badge"')
+
+
+class RecommendationCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.friend = User.objects.create_user(
+            username="testfriend", password="testpassword"
+        )
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        self.park = Location.objects.create(location_name="Park")
+        self.museum = Location.objects.create(location_name="Museum")
+        self.music = Tag.objects.create(tag_name="Music")
+        now = timezone.now()
+        self.joined = Event.objects.create(
+            event_name="Joined Event",
+            event_location=self.park,
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=10,
+            creator=self.creator,
+        )
+        self.joined.tags.set([self.music])
+        EventJoin.objects.create(user=self.user, event=self.joined, status=APPROVED)
+        self.park_concert = Event.objects.create(
+            event_name="Park Concert",
+            event_location=self.park,
+            start_time=now + timedelta(hours=5),
+            end_time=now + timedelta(hours=6),
+            capacity=10,
+            creator=self.creator,
+        )
+        self.park_concert.tags.set([self.music])
+        self.museum_talk = Event.objects.create(
+            event_name="Museum Talk",
+            event_location=self.museum,
+            start_time=now + timedelta(hours=3),
+            end_time=now + timedelta(hours=4),
+            capacity=10,
+            creator=self.friend,
+        )
+
+    def test_candidates_are_ranked_by_score(self):
+        recommendations = get_recommendations(self.user.id)
+        self.assertEqual(recommendations["ranked"], [self.park_concert.id])
+        self.assertEqual(recommendations["by_location"], [self.park_concert.id])
+        self.assertEqual(recommendations["by_tag"], [("Music", [self.park_concert.id])])
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteLocation.objects.create(user=self.user, location=self.museum)
+        recommendations = get_recommendations(self.user.id)
+        # location and tag beat the favorite location
+        self.assertEqual(
+            recommendations["ranked"], [self.park_concert.id, self.museum_talk.id]
+        )
+        self.assertEqual(recommendations["favorites"], [self.museum_talk.id])
+
+    def test_page_is_served_from_the_cache(self):
+        self.client.login(username="testuser", password="testpassword")
+        self.client.get(reverse("events:recommend-event"))
+        # session, user, the recommended events and the navbar profile link
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("events:recommend-event"))
+        self.assertContains(response, "Park Concert")
+
+    def test_friend_changes_rebuild_the_list(self):
+        self.assertNotIn(
+            self.museum_talk.id, get_recommendations(self.user.id)["ranked"]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFriends.objects.create(
+                user=self.friend, friends=self.user.userprofile, status=APPROVED
+            )
+        self.assertEqual(
+            get_recommendations(self.user.id)["by_friend"], [self.museum_talk.id]
+        )
+
+    def test_joining_removes_the_event(self):
+        self.assertIn(self.park_concert.id, get_recommendations(self.user.id)["ranked"])
+        with self.captureOnCommitCallbacks(execute=True):
+            EventJoin.objects.create(user=self.user, event=self.park_concert)
+        self.assertNotIn(
+            self.park_concert.id, get_recommendations(self.user.id)["ranked"]
+        )
+
+    def test_new_events_are_recommended(self):
+        get_recommendations(self.user.id)
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            event = Event.objects.create(
+                event_name="Park Picnic",
+                event_location=self.park,
+                start_time=now + timedelta(hours=7),
+                end_time=now + timedelta(hours=8),
+                capacity=10,
+                creator=self.creator,
+            )
+        self.assertIn(event.id, get_recommendations(self.user.id)["ranked"])
+
+    def test_only_candidate_changes_rebuild_every_list(self):
+        get_recommendations(self.user.id)
+        event = Event.objects.get(id=self.park_concert.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            event.event_name = "Park Jazz"
+            event.capacity = 20
+            event.save()
+        with self.assertNumQueries(0):
+            get_recommendations(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            event.event_location = self.museum
+            event.save()
+        self.assertNotIn(
+            self.park_concert.id, get_recommendations(self.user.id)["by_location"]
+        )
+
+    def test_build_command_warms_the_cache(self):
+        out = StringIO()
+        call_command("build_recommendations", self.user.id, stdout=out)
+        self.assertIn("Built recommendations for 1 users", out.getvalue())
+        with self.assertNumQueries(0):
+            get_recommendations(self.user.id)
+
+
+class TagAffinityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        self.location = Location.objects.create(location_name="Park")
+        self.music = Tag.objects.create(tag_name="Music")
+        self.art = Tag.objects.create(tag_name="Art")
+        self.food = Tag.objects.create(tag_name="Food")
+        self.joined = self.create_event("Joined", [self.music])
+        EventJoin.objects.create(user=self.user, event=self.joined, status=APPROVED)
+        self.created = self.create_event("Created", [self.music, self.art], self.user)
+        self.concert = self.create_event("Concert", [self.music])
+        self.festival = self.create_event("Festival", [self.music, self.food])
+        self.gallery = self.create_event("Gallery", [self.art])
+        self.market = self.create_event("Market", [self.food])
+
+    def create_event(self, name, tags, creator=None):
+        now = timezone.now()
+        event = Event.objects.create(
+            event_name=name,
+            event_location=self.location,
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=10,
+            creator=creator or self.creator,
+        )
+        event.tags.set(tags)
+        return event
+
+    def test_tag_affinities_are_cosine_similarities(self):
+        # the user has two music events and one art event
+        affinities = tag_affinities(
+            {self.music.id: 2, self.art.id: 1},
+            {
+                self.concert.id: [self.music.id],
+                self.festival.id: [self.music.id, self.food.id],
+                self.market.id: [self.food.id],
+            },
+        )
+        self.assertAlmostEqual(affinities[self.concert.id], 2 / 5**0.5)
+        self.assertAlmostEqual(affinities[self.festival.id], 2 / 10**0.5)
+        self.assertEqual(affinities[self.market.id], 0)
+
+    def test_batched_affinities_match_single_user_scoring(self):
+        matrices = load_tag_matrices()
+        positions = {
+            event_id: position for position, event_id in enumerate(matrices.event_ids)
+        }
+        row = matrices.user_ids.index(self.user.id)
+        scores = AffinityRow(
+            positions, list(affinity_rows(matrices.user_tags, matrices.event_tags))[row]
+        )
+        single = tag_affinities(
+            {self.music.id: 2, self.art.id: 1},
+            {
+                event.id: list(event.tags.values_list("id", flat=True))
+                for event in (self.concert, self.festival, self.gallery, self.market)
+            },
+        )
+        for event_id, affinity in single.items():
+            self.assertAlmostEqual(scores.get(event_id), affinity, places=6)
+
+    def test_bulk_build_matches_the_page_build(self):
+        cache.clear()
+        refresh_many_recommendations([self.user.id, self.creator.id])
+        for user in (self.user, self.creator):
+            self.assertEqual(
+                get_recommendations(user.id), build_recommendations(user.id)
+            )
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            "tag_affinity_benchmark",
+            "--users=20",
+            "--events=50",
+            "--tags=5",
+            stdout=out,
+        )
+        self.assertIn("in batches", out.getvalue())
+        self.assertIn("one at a time", out.getvalue())
+        # nothing from the run is kept
+        self.assertFalse(
+            User.objects.filter(username__startswith="affinity-benchmark").exists()
+        )
+        self.assertEqual(Event.objects.count(), 6)
+
+
+class EventAdmissionTest(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name="Small Event",
+            event_location=Location.objects.create(location_name="Park"),
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=3,
+            creator=self.creator,
+        )
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="testpassword")
+            for i in range(4)
+        ]
+        for user in self.users:
+            EventJoin.objects.create(user=user, event=self.event)
+        # the joins were created directly, count them
+        reconcile_event_stats([self.event.id])
+
+    def status(self, user):
+        return EventJoin.objects.get(event=self.event, user=user).status
+
+    def test_approvals_stop_at_capacity(self):
+        results = [approve_join(self.event, user.id) for user in self.users]
+        # the creator holds the last seat
+        self.assertEqual(results, [ADMITTED, ADMITTED, FULL, FULL])
+        self.assertEqual(approve_join(self.event, self.users[0].id), SKIPPED)
+        stats = get_event_stats(self.event)
+        self.assertEqual((stats.approved_count, stats.pending_count), (2, 2))
+
+    def test_freed_seat_goes_to_the_oldest_pending_join(self):
+        approve_join(self.event, self.users[0].id)
+        approve_join(self.event, self.users[1].id)
+        join, promoted = remove_participant(self.event, self.users[0].id, REMOVED)
+        self.assertEqual(join.status, REMOVED)
+        self.assertEqual([join.user for join in promoted], [self.users[2]])
+        self.assertEqual(self.status(self.users[2]), APPROVED)
+        self.assertEqual(self.status(self.users[3]), PENDING)
+        self.assertEqual(
+            count_event_stats([self.event.id])[self.event.id]["approved_count"], 2
+        )
+        self.assertEqual(get_event_stats(self.event).approved_count, 2)
+
+    def test_no_promotion_below_capacity(self):
+        approve_join(self.event, self.users[0].id)
+        join, promoted = remove_participant(self.event, self.users[0].id, REMOVED)
+        self.assertEqual(promoted, [])
+        self.assertEqual(self.status(self.users[1]), PENDING)
+
+    def assertCountersLockedFirst(self, change):
+        # SQLite drops FOR UPDATE, so check the order the rows are read in
+        with CaptureQueriesContext(connection) as queries:
+            change()
+        tables = [
+            table
+            for query in queries.captured_queries
+            for table in ("events_eventstats", "events_eventjoin")
+            if f'"{table}"' in query["sql"]
+        ]
+        self.assertEqual(tables[0], "events_eventstats")
+
+    def test_join_changes_lock_the_counters_first(self):
+        self.assertCountersLockedFirst(
+            lambda: approve_join(self.event, self.users[0].id)
+        )
+        self.assertCountersLockedFirst(
+            lambda: remove_participant(self.event, self.users[0].id, REMOVED)
+        )
+        self.assertCountersLockedFirst(lambda: approve_next(self.event, 1))
+        self.assertCountersLockedFirst(
+            lambda: reject_joins(self.event, [self.users[2].id])
+        )
+
+    def test_remove_view_notifies_the_promoted_participant(self):
+        approve_join(self.event, self.users[0].id)
+        approve_join(self.event, self.users[1].id)
+        self.client.login(username="testcreator", password="testpassword")
+        url = reverse(
+            "events:remove-approved-request", args=[self.event.id, self.users[0].id]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
+        self.assertEqual(self.status(self.users[2]), APPROVED)
+        self.assertTrue(
+            Notification.objects.filter(
+                user=self.users[2], message__contains="A seat opened up"
+            ).exists()
+        )
+
+
+class EventWaitlistTest(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name="Small Event",
+            event_location=Location.objects.create(location_name="Park"),
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=3,
+            creator=self.creator,
+        )
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="testpassword")
+            for i in range(4)
+        ]
+        for user in self.users:
+            self.toggle(user)
+
+    def toggle(self, user):
+        self.client.login(username=user.username, password="testpassword")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("events:toggle-join-request", args=[self.event.id])
+            )
+
+    def join(self, user):
+        return EventJoin.objects.get(event=self.event, user=user)
+
+    def test_waitlist_is_in_request_order(self):
+        self.assertEqual([join.user for join in waitlist(self.event)], self.users)
+        self.assertEqual(
+            [waitlist_rank(self.join(user)) for user in self.users], [1, 2, 3, 4]
+        )
+
+    def test_repeated_request_goes_to_the_end(self):
+        self.toggle(self.users[0])  # withdraw
+        self.toggle(self.users[0])  # request again
+        self.assertEqual(
+            [join.user for join in waitlist(self.event)],
+            self.users[1:] + self.users[:1],
+        )
+        self.assertEqual(waitlist_rank(self.join(self.users[0])), 4)
+
+    def test_approve_next_takes_the_head_up_to_the_seats_left(self):
+        promoted = approve_next(self.event, 3)
+        # the creator holds the last seat
+        self.assertEqual([join.user for join in promoted], self.users[:2])
+        self.assertEqual(self.join(self.users[2]).status, PENDING)
+        self.assertEqual(approve_next(self.event, 1), [])
+        stats = get_event_stats(self.event)
+        self.assertEqual((stats.approved_count, stats.pending_count), (2, 2))
+        self.assertEqual(waitlist_rank(self.join(self.users[3])), 2)
+
+    def test_approve_next_view_notifies_the_approved(self):
+        self.client.login(username="testcreator", password="testpassword")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("events:approve-next", args=[self.event.id]), {"count": 1}
+            )
+        self.assertEqual(self.join(self.users[0]).status, APPROVED)
+        self.assertEqual(self.join(self.users[1]).status, PENDING)
+        self.assertTrue(
+            Notification.objects.filter(
+                user=self.users[0], message__contains="has been approved"
+            ).exists()
+        )
+
+    def test_approve_next_view_is_for_the_creator(self):
+        self.client.login(username="user3", password="testpassword")
+        self.client.post(
+            reverse("events:approve-next", args=[self.event.id]), {"count": 2}
+        )
+        self.assertEqual(self.join(self.users[0]).status, PENDING)
+
+    def test_detail_shows_waitlist_position(self):
+        self.client.login(username="user1", password="testpassword")
+        response = self.client.get(reverse("events:event-detail", args=[self.event.id]))
+        self.assertContains(response, "You are #2 on the waitlist")
+
+
+class EventBulkUpdateRequestsTest(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user(
+            username="testcreator", password="testpassword"
+        )
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name="Popular Event",
+            event_location=Location.objects.create(location_name="Park"),
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=4,
+            creator=self.creator,
+        )
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="testpassword")
+            for i in range(5)
+        ]
+        EventJoin.objects.bulk_create(
+            EventJoin(user=user, event=self.event) for user in self.users
+        )
+        reconcile_event_stats([self.event.id])
+        self.url = reverse("events:bulk-update-requests", args=[self.event.id])
+        self.client.login(username="testcreator", password="testpassword")
+
+    def post(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                self.url, json.dumps(data), content_type="application/json"
+            )
+
+    def ids(self, users):
+        return [user.id for user in users]
+
+    def test_approve_stops_at_capacity(self):
+        stranger = User.objects.create_user(username="stranger")
+        response = self.post(
+            {"action": "approve", "user_ids": self.ids(self.users) + [stranger.id]}
+        )
+        self.assertEqual(response.status_code, 200)
+        # the creator holds the last seat
+        self.assertEqual(
+            response.json(),
+            {
+                "applied": self.ids(self.users[:3]),
+                "skipped": [stranger.id],
+                "over_capacity": self.ids(self.users[3:]),
+            },
+        )
+        stats = get_event_stats(self.event)
+        self.assertEqual((stats.approved_count, stats.pending_count), (3, 2))
+        self.assertEqual(
+            Notification.objects.filter(message__contains="approved").count(), 3
+        )
+
+    def test_repeated_approve_skips_the_approved(self):
+        self.post({"action": "approve", "user_ids": self.ids(self.users[:2])})
+        response = self.post({"action": "approve", "user_ids": self.ids(self.users)})
+        self.assertEqual(
+            response.json(),
+            {
+                "applied": [self.users[2].id],
+                "skipped": self.ids(self.users[:2]),
+                "over_capacity": self.ids(self.users[3:]),
+            },
+        )
+
+    def test_reject(self):
+        response = self.post({"action": "reject", "user_ids": self.ids(self.users[:2])})
+        self.assertEqual(response.json()["applied"], self.ids(self.users[:2]))
+        self.assertEqual(
+            EventJoin.objects.filter(event=self.event, status=REJECTED).count(), 2
+        )
+        stats = get_event_stats(self.event)
+        self.assertEqual(stats.pending_count, 3)
+        self.assertEqual(
+            count_event_stats([self.event.id])[self.event.id]["pending_count"], 3
+        )
+        self.assertEqual(
+            Notification.objects.filter(message__contains="rejected").count(), 2
+        )
+
+    def test_query_count_does_not_grow_with_the_requests(self):
+        with self.assertNumQueries(13):
+            self.post({"action": "approve", "user_ids": self.ids(self.users)})
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post({"action": "approve"}).status_code, 400)
+        self.assertEqual(
+            self.post({"action": "ignore", "user_ids": []}).status_code, 400
+        )
+        for user_ids in ("123", {"id": 1}, [True], [1.5], ["1"], [None]):
+            response = self.post({"action": "approve", "user_ids": user_ids})
+            self.assertEqual(response.status_code, 400, user_ids)
+        self.client.login(username="user0", password="testpassword")
+        response = self.post({"action": "approve", "user_ids": self.ids(self.users)})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(get_event_stats(self.event).approved_count, 0)
+
+
+class EventAdmissionStressTest(TransactionTestCase):
+    """Approve and remove from many threads at once.
+
+    The test database is SQLite, which serializes writers with database
+    locks instead of row locks: a thread that finds the database locked
+    retries its whole transaction, the way it would wait on PostgreSQL.
+    SQLite also ignores select_for_update, so this cannot catch a lock
+    order inversion between the counters and the joins; the order is
+    checked by EventAdmissionTest.test_join_changes_lock_the_counters_first.
+    """
+
+    threads = 24
+
+    def setUp(self):
+        creator = User.objects.create_user(username="testcreator")
+        now = timezone.now()
+        self.event = Event.objects.create(
+            event_name="Popular Event",
+            event_location=Location.objects.create(location_name="Park"),
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=6,
+            creator=creator,
+        )
+        self.users = [
+            User.objects.create_user(username=f"user{i}") for i in range(self.threads)
+        ]
+        EventJoin.objects.bulk_create(
+            EventJoin(user=user, event=self.event) for user in self.users
+        )
+        reconcile_event_stats([self.event.id])
+
+    def run_concurrently(self, function, arguments):
+        barrier = threading.Barrier(len(arguments))
+        results = []
+        errors = []
+
+        def work(argument):
+            try:
+                barrier.wait()
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    try:
+                        results.append(function(argument))
+                        return
+                    except OperationalError as error:
+                        if "locked" not in str(error):
+                            raise
+                        # jitter, or the same threads keep colliding
+                        time.sleep(random.uniform(0.001, 0.01))
+                raise AssertionError("database stayed locked")
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=work, args=(argument,)) for argument in arguments
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def assertCountersMatchJoins(self):
+        stats = get_event_stats(self.event)
+        counts = count_event_stats([self.event.id])[self.event.id]
+        self.assertEqual(stats.approved_count, counts["approved_count"])
+        self.assertEqual(stats.pending_count, counts["pending_count"])
+        return counts["approved_count"]
+
+    def test_concurrent_approvals_never_overbook(self):
+        results = self.run_concurrently(
+            lambda user: approve_join(self.event, user.id), self.users
+        )
+        self.assertEqual(results.count(ADMITTED), self.event.capacity - 1)
+        self.assertEqual(results.count(FULL), self.threads - self.event.capacity + 1)
+        self.assertEqual(self.assertCountersMatchJoins(), self.event.capacity - 1)
+
+    def test_concurrent_removals_promote_the_waitlist(self):
+        seated = self.users[: self.event.capacity - 1]
+        for user in seated:
+            approve_join(self.event, user.id)
+        results = self.run_concurrently(
+            lambda user: remove_participant(self.event, user.id, REMOVED), seated[:3]
+        )
+        promoted = [join.user_id for _, joins in results for join in joins]
+        self.assertEqual(len(promoted), 3)
+        self.assertEqual(len(set(promoted)), 3)
+        self.assertEqual(self.assertCountersMatchJoins(), self.event.capacity - 1)
@@ -10,8 +10,8 @@ urlpatterns = [
     path("delete/<int:event_id>/", views.deleteEvent, name="delete-event"),
     path("update/<int:event_id>/", views.updateEvent, name="update-event"),
     path("<int:event_id>/", views.eventDetail, name="event-detail"),
-    path("events/", views.get_data, name="events"),
-    path("locations/", views.get_locations, name="locations"),
+    path("map-data/", views.map_data, name="map-data"),
+    path("map-clusters/", views.map_clusters, name="map-clusters"),
     path(
         "event/<int:event_id>/delete-image/",
         views.deleteEventImage,
@@ -27,6 +27,16 @@ urlpatterns = [
         views.creatorApproveRequest,
         name="approve-request",
     ),
+    path(
+        "<int:event_id>/approve-next/",
+        views.creatorApproveNext,
+        name="approve-next",
+    ),
+    path(
+        "<int:event_id>/bulk-requests/",
+        views.creatorBulkUpdateRequests,
+        name="bulk-update-requests",
+    ),
     path(
         "<int:event_id>/reject/<int:user_id>/",
         views.creatorRejectRequest,
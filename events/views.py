@@ -4,6 +4,7 @@ from django.http import (
     Http404,
     JsonResponse,
     HttpResponseBadRequest,
+    StreamingHttpResponse,
 )
 from .forms import EventsForm, CommentForm
 from django.urls import reverse
@@ -12,16 +13,35 @@ from .models import (
     Location,
     EventJoin,
     Comment,
-    Notification,
     Reaction,
     FavoriteLocation,
 )
 from tags.models import Tag
 from profiles.models import UserFriends
+from location.geo import filter_within_radius
+from .search import search_events
+from .pagination import paginate_events, InvalidCursor, DISTANCE_KEY, RANK_KEY
+from .clusters import clusters_for_bbox, ClusterRequestError
+from .notifications import notify
+from .recommendations import recommended_events
+from .stats import get_event_stats, record_join_change, record_reaction_change
+from .admission import (
+    ADMITTED,
+    FULL,
+    approve_join,
+    approve_joins,
+    approve_next,
+    join_waitlist,
+    reject_joins,
+    remove_participant,
+    waitlist,
+    waitlist_rank,
+)
 from django.contrib.auth.decorators import login_required
-from django.core.serializers import serialize
+import hashlib
 import json
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.utils.cache import patch_cache_control
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db import transaction
@@ -36,12 +56,14 @@ from .constants import (
     MEDIUM_CAPACITY,
     LARGE_CAPACITY,
     TAG_ICON_PATHS,
+    NEAR_ME_RADIUS_KM,
+    BULK_JOIN_UPDATE_LIMIT,
 )
 from django.utils import timezone
 from .forms import EventFilterForm
 from datetime import datetime, timedelta
 import pytz
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Max, Prefetch
 from better_profanity import profanity
 from django.core.files.storage import FileSystemStorage
 
@@ -94,14 +116,12 @@ def index(request):
     search_query = request.GET.get(
         "search", ""
     )  # Get the search query from the URL parameter
-    locations = Location.objects.filter(location_name__icontains=search_query)
-    location_ids = [location.id for location in locations]
-    events = Event.objects.filter(
-        Q(event_name__icontains=search_query) | Q(event_location__in=location_ids)
-    )
-    events = events.filter(end_time__gt=current_time_ny, is_active=True).order_by(
-        "-start_time"
-    )
+    # Every filter below is folded into a single query on Event, joining the
+    # location instead of materializing id lists in Python
+    events = Event.objects.filter(end_time__gt=current_time_ny, is_active=True)
+    events = search_events(events, search_query)
+    # matches are listed by relevance, everything else by start time
+    leading = [RANK_KEY] if "rank" in events.query.annotations else []
 
     # Initialize the form with request.GET or None
     form = EventFilterForm(request.GET or None)
@@ -118,29 +138,26 @@ def index(request):
             ):
                 user_latitude = float(request.GET.get("lat", ""))
                 user_longitude = float(request.GET.get("lon", ""))
-                # Filter nearby locations based on user's location
-                nearby_locations = Location.objects.filter(
-                    latitude__range=(
-                        user_latitude - 0.036,
-                        user_latitude + 0.036,
-                    ),  # Approx. 2 miles in latitude
-                    longitude__range=(
-                        user_longitude - 0.036,
-                        user_longitude + 0.036,
-                    ),  # Approx. 2 miles in longitude
+                # Filter events at nearby locations using the geohash index
+                events = filter_within_radius(
+                    events,
+                    user_latitude,
+                    user_longitude,
+                    NEAR_ME_RADIUS_KM,
+                    prefix="event_location__",
                 )
-                nearby_location_ids = [location.id for location in nearby_locations]
-                events = events.filter(event_location__in=nearby_location_ids)
+                # nearest first, then by relevance or start time
+                leading.insert(0, DISTANCE_KEY)
         if (
             form.cleaned_data["favorite_location_events"]
             and request.user.is_authenticated
         ):
             favorite_location_events = form.cleaned_data["favorite_location_events"]
             if favorite_location_events:
-                # Return an error message if start time is in the past
-                favorite_locations = FavoriteLocation.objects.filter(user=request.user)
-                favorite_location_ids = [location.id for location in favorite_locations]
-                events = events.filter(event_location__in=favorite_location_ids)
+                favorite_locations = FavoriteLocation.objects.filter(
+                    user=request.user
+                ).values("location")
+                events = events.filter(event_location__in=favorite_locations)
 
         # Start Time filter
         if form.cleaned_data["start_time"]:
@@ -205,11 +222,48 @@ def index(request):
     else:
         form = EventFilterForm()
     # Filter events that are active and end time is greater than current time in NY
+    events = events.select_related("event_location", "creator").prefetch_related("tags")
+    try:
+        events, next_cursor = paginate_events(
+            events, request.GET.get("cursor"), leading=leading
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+
+    next_page_query = None
+    if next_cursor:
+        next_page_params = request.GET.copy()
+        next_page_params["cursor"] = next_cursor
+        next_page_params.pop("format", None)
+        next_page_query = next_page_params.urlencode()
+
+    # JSON variant used for infinite scroll
+    if request.GET.get("format") == "json":
+        return JsonResponse(
+            {
+                "events": [
+                    {
+                        "id": event.id,
+                        "event_name": event.event_name,
+                        "start_time": event.start_time,
+                        "end_time": event.end_time,
+                        "capacity": event.capacity,
+                        "location": event.event_location.location_name,
+                        "image": event.image.url if event.image else None,
+                        "url": reverse("events:event-detail", args=[event.id]),
+                    }
+                    for event in events
+                ],
+                "next_cursor": next_cursor,
+            }
+        )
 
     # Prepare the context with events and form
     context = {
         "events": events,
         "form": form,
+        "next_cursor": next_cursor,
+        "next_page_query": next_page_query,
     }
 
     # If there are no events after filtering, add a message to the context
@@ -355,9 +409,7 @@ def updateEvent(request, event_id):
             elif event.image:
                 event.image.delete()
 
-        Notification.objects.create(
-            user=request.user, message=f"Event '{event_name}' updated."
-        )
+        notify(user=request.user, message=f"Event '{event_name}' updated.")
         location_object = Location.objects.get(id=event_location_id)
         event.event_location = location_object
         event.event_name = event_name
@@ -465,9 +517,7 @@ def saveEvent(request):
                 reverse("events:index") + f"?error_message={error_message}"
             )
         # All validations passed; create the event
-        Notification.objects.create(
-            user=request.user, message=f"Event '{event_name}' created."
-        )
+        notify(user=request.user, message=f"Event '{event_name}' created.")
         event = Event(
             event_name=event_name,
             event_location=location_object,
@@ -517,9 +567,7 @@ def deleteEvent(request, event_id):
     if request.method == "POST":
         if request.POST.get("action") == "delete":
             # Set is_active to False instead of deleting
-            Notification.objects.create(
-                user=request.user, message=f"Event '{event.event_name}' deleted."
-            )
+            notify(user=request.user, message=f"Event '{event.event_name}' deleted.")
             event.is_active = False
             event.save()
             return redirect("events:index")
@@ -542,52 +590,68 @@ def eventDetail(request, event_id):
         if "filter_tag" in request.GET:
             tag_label = request.GET.get("filter_tag", "")
             return filter_event_tag_label(tag_label)
-    event = get_object_or_404(Event, pk=event_id)
+    event = get_object_or_404(
+        Event.objects.select_related("event_location", "creator"), pk=event_id
+    )
     if not event.is_active:
         messages.warning(request, "The event is deleted. Try some other events!")
         return redirect("events:index")
     location = event.event_location
     join_status = None
+    waitlist_position = None
     # attempt to see if the user has logged in
     if request.user.is_authenticated:
         try:
             join = EventJoin.objects.get(user=request.user, event=event)
             join_status = join.status
+            if join.status == PENDING:
+                waitlist_position = waitlist_rank(join)
         except EventJoin.DoesNotExist:
             # if the user has no join record
             pass
+    stats = get_event_stats(event)
     approved_join = event.eventjoin_set.filter(status=APPROVED)
+    approved_join_count = stats.approved_count
     # prevent unauthoraized user looking at the pending list
     pending_join = approved_join
+    pending_join_count = approved_join_count
     if request.user == event.creator:
-        pending_join = event.eventjoin_set.filter(status=PENDING)
-    approved_join_count = approved_join.count()
-    pending_join_count = pending_join.count()
+        pending_join = waitlist(event)
+        pending_join_count = stats.pending_count
 
     comment_form = CommentForm()
     creator_comments_only = request.GET.get("creator_comments_only") == "true"
 
+    comments = event.comments.filter(parent__isnull=True).filter(is_active=True)
     if creator_comments_only:
-        comments = (
-            event.comments.filter(parent__isnull=True)
-            .filter(is_active=True)
-            .filter(user=event.creator)
+        comments = comments.filter(user=event.creator)
+    # the whole tree in two queries, inactive replies are loaded as well
+    # because they still prevent deleting their comment
+    comments = comments.select_related("user").prefetch_related(
+        Prefetch(
+            "replies",
+            queryset=Comment.objects.select_related("user").order_by("id"),
+            to_attr="all_replies",
         )
-    else:
-        comments = event.comments.filter(parent__isnull=True).filter(is_active=True)
+    )
     comments_with_replies = []
     for comment in comments:
-        if request.user == event.creator or request.user == comment.user:
-            replies = comment.replies.filter(is_active=True)
-        else:
-            replies = comment.replies.filter(is_active=True).filter(is_private=False)
+        comment.has_replies = bool(comment.all_replies)
+        can_see_private = request.user == event.creator or request.user == comment.user
+        replies = [
+            reply
+            for reply in comment.all_replies
+            if reply.is_active and (can_see_private or not reply.is_private)
+        ]
         comments_with_replies.append((comment, replies))
 
-    reactions = event.reaction_set.filter(is_active=True)
-    emoji_data = {emoji: {"count": 0, "users": []} for emoji, _ in EMOJI_CHOICES}
-    for reaction in reactions:
-        emoji_data[reaction.emoji]["count"] += 1
-        if request.user == event.creator:  # prevent unauthorized peeking at the list
+    emoji_data = {
+        emoji: {"count": stats.reaction_count(emoji), "users": []}
+        for emoji, _ in EMOJI_CHOICES
+    }
+    if request.user == event.creator:  # prevent unauthorized peeking at the list
+        reactions = event.reaction_set.filter(is_active=True).select_related("user")
+        for reaction in reactions:
             emoji_data[reaction.emoji]["users"].append(reaction.user)
     emoji_data_list = [
         (emoji, data["count"], data["users"]) for emoji, data in emoji_data.items()
@@ -611,6 +675,7 @@ def eventDetail(request, event_id):
     context = {
         "event": event,
         "join_status": join_status,
+        "waitlist_position": waitlist_position,
         "pending_join": pending_join,
         "approved_join": approved_join,
         "approved_join_count": approved_join_count,
@@ -645,28 +710,42 @@ def toggleJoinRequest(request, event_id):
             request, "As the creator of the event, you cannot join it as a participant."
         )
         return redirect("events:event-detail", event_id=event.id)
-    join, created = EventJoin.objects.get_or_create(user=request.user, event=event)
-    # If a request was just created, it's already in 'pending' state
-    # If it exists, toggle between 'pending' and 'withdrawn'
-    if not created:
-        if join.status == PENDING:
-            join.status = WITHDRAWN
-            Notification.objects.create(
-                user=event.creator,
-                message=f"'{request.user}' Withdrew request to join event '{event.event_name}'.",
-            )
+    with transaction.atomic():
+        # counters before the join, see events/admission.py
+        get_event_stats(event, lock=True)
+        join, created = EventJoin.objects.get_or_create(user=request.user, event=event)
+        # If a request was just created, it's already in 'pending' state
+        # If it exists, toggle between 'pending' and 'withdrawn'
+        if not created:
+            join = EventJoin.objects.select_for_update().get(pk=join.pk)
+            old_status = join.status
+            if join.status == PENDING:
+                join.status = WITHDRAWN
+                notify(
+                    user=event.creator,
+                    message=f"'{request.user}' Withdrew request to join event '{event.event_name}'.",
+                    dedupe=True,
+                )
+            else:
+                join.status = PENDING
+                notify(
+                    user=event.creator,
+                    message=f"'{request.user}' Requested to join event '{event.event_name}'.",
+                    dedupe=True,
+                )
+            join.save()
+            record_join_change(event.id, old_status, join.status)
+            if join.status == PENDING:
+                # a repeated request goes to the end of the waitlist
+                join_waitlist(join)
         else:
-            join.status = PENDING
-            Notification.objects.create(
+            record_join_change(event.id, None, join.status)
+            join_waitlist(join)
+            notify(
                 user=event.creator,
                 message=f"'{request.user}' Requested to join event '{event.event_name}'.",
+                dedupe=True,
             )
-        join.save()
-    else:
-        Notification.objects.create(
-            user=event.creator,
-            message=f"'{request.user}' Requested to join event '{event.event_name}'.",
-        )
 
     return redirect("events:event-detail", event_id=event.id)
 
@@ -674,36 +753,113 @@ def toggleJoinRequest(request, event_id):
 @login_required
 @require_POST
 def creatorApproveRequest(request, event_id, user_id):
-    with transaction.atomic():
-        event = get_object_or_404(Event, id=event_id)
-        if not event.is_active:
-            messages.warning(request, "The event is deleted. Try some other events!")
-            return redirect("events:index")
-        if request.user != event.creator:
-            # handle the error when the user is not the creator of the event
-            return redirect("events:event-detail", event_id=event.id)
-        try:
-            # Lock the participant row for updating
-            join = EventJoin.objects.select_for_update().get(
-                event_id=event_id, user_id=user_id
-            )
-        except EventJoin.DoesNotExist:
-            raise Http404("Participant not found.")
-        approved_join_count = EventJoin.objects.filter(
-            event=event, status=APPROVED
-        ).count()
-        if approved_join_count + 1 >= event.capacity:
-            messages.warning(request, "The event has reached its capacity.")
-        else:
-            if join.status == PENDING:
-                join.status = APPROVED
-                join.save()
-                Notification.objects.create(
-                    user=join.user,
-                    message=f"Request to join event '{event.event_name}' has been approved.",
-                )
-                messages.success(request, "Request approved")
+    event = get_object_or_404(Event, id=event_id)
+    if not event.is_active:
+        messages.warning(request, "The event is deleted. Try some other events!")
+        return redirect("events:index")
+    if request.user != event.creator:
+        # handle the error when the user is not the creator of the event
+        return redirect("events:event-detail", event_id=event.id)
+    try:
+        result = approve_join(event, user_id)
+    except EventJoin.DoesNotExist:
+        raise Http404("Participant not found.")
+    if result == FULL:
+        messages.warning(
+            request,
+            "The event has reached its capacity, the request stays on the waitlist.",
+        )
+    elif result == ADMITTED:
+        notify(
+            user_id=user_id,
+            message=f"Request to join event '{event.event_name}' has been approved.",
+        )
+        messages.success(request, "Request approved")
+    return redirect("events:event-detail", event_id=event.id)
+
+
+@login_required
+@require_POST
+def creatorApproveNext(request, event_id):
+    event = get_object_or_404(Event, id=event_id)
+    if not event.is_active:
+        messages.warning(request, "The event is deleted. Try some other events!")
+        return redirect("events:index")
+    if request.user != event.creator:
+        # handle the error when the user is not the creator of the event
+        return redirect("events:event-detail", event_id=event.id)
+    try:
+        count = int(request.POST.get("count", 1))
+    except ValueError:
+        count = 0
+    if count < 1:
+        messages.warning(request, "Enter how many requests to approve.")
         return redirect("events:event-detail", event_id=event.id)
+    promoted = approve_next(event, count)
+    for join in promoted:
+        notify(
+            user=join.user,
+            message=f"Request to join event '{event.event_name}' has been approved.",
+        )
+    if promoted:
+        messages.success(
+            request, f"Approved {len(promoted)} request(s) from the waitlist"
+        )
+    else:
+        messages.warning(
+            request, "The event has reached its capacity or the waitlist is empty."
+        )
+    return redirect("events:event-detail", event_id=event.id)
+
+
+@login_required
+@require_POST
+def creatorBulkUpdateRequests(request, event_id):
+    """Approve or reject many join requests in one JSON POST of
+    ``{"action": "approve" | "reject", "user_ids": [...]}``."""
+    event = get_object_or_404(Event, id=event_id)
+    if not event.is_active:
+        return JsonResponse({"error": "The event is deleted."}, status=404)
+    if request.user != event.creator:
+        return JsonResponse(
+            {"error": "Only the creator can answer join requests."}, status=403
+        )
+    try:
+        data = json.loads(request.body)
+        action = data["action"]
+        user_ids = data["user_ids"]
+        # bool is an int subclass, check the exact type
+        if not isinstance(user_ids, list) or not all(
+            type(user_id) is int for user_id in user_ids
+        ):
+            raise ValueError("user_ids must be a list of integers")
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"error": "Invalid request data."}, status=400)
+    if action not in ("approve", "reject"):
+        return JsonResponse({"error": "Unknown action."}, status=400)
+    if len(user_ids) > BULK_JOIN_UPDATE_LIMIT:
+        return JsonResponse(
+            {"error": f"At most {BULK_JOIN_UPDATE_LIMIT} requests at once."},
+            status=400,
+        )
+
+    over_capacity = []
+    if action == "approve":
+        joins, skipped, over_capacity = approve_joins(event, user_ids)
+        message = f"Request to join event '{event.event_name}' has been approved."
+    else:
+        joins, skipped = reject_joins(event, user_ids)
+        message = f"Request to join event '{event.event_name}' has been rejected."
+    # NotificationMiddleware writes these with one bulk_create
+    for join in joins:
+        notify(user_id=join.user_id, message=message)
+    return JsonResponse(
+        {
+            "applied": [join.user_id for join in joins],
+            "skipped": skipped,
+            "over_capacity": over_capacity,
+        }
+    )
 
 
 @login_required
@@ -717,14 +873,20 @@ def creatorRejectRequest(request, event_id, user_id):
     if request.user != event.creator:
         # handle the error when the user is not the creator of the event
         return redirect("events:event-detail", event_id=event.id)
-    join = get_object_or_404(EventJoin, event=event, user=user)
-    if join.status == PENDING:
-        join.status = REJECTED
-        join.save()
-        Notification.objects.create(
-            user=join.user,
-            message=f"Request to join event '{event.event_name}' has been rejected.",
+    with transaction.atomic():
+        # counters before the join, see events/admission.py
+        get_event_stats(event, lock=True)
+        join = get_object_or_404(
+            EventJoin.objects.select_for_update(), event=event, user=user
         )
+        if join.status == PENDING:
+            join.status = REJECTED
+            join.save()
+            record_join_change(event.id, PENDING, REJECTED)
+            notify(
+                user=join.user,
+                message=f"Request to join event '{event.event_name}' has been rejected.",
+            )
     return redirect("events:event-detail", event_id=event.id)
 
 
@@ -739,32 +901,130 @@ def creatorRemoveApprovedRequest(request, event_id, user_id):
     if request.user != event.creator:
         # handle the error when the user is not the creator of the event
         return redirect("events:event-detail", event_id=event.id)
-    join = get_object_or_404(EventJoin, event=event, user=user)
-    if join.status == APPROVED:
-        join.status = REMOVED
-        join.save()
-        Notification.objects.create(
-            user=join.user,
+    try:
+        join, promoted = remove_participant(event, user.id, REMOVED)
+    except EventJoin.DoesNotExist:
+        raise Http404("Participant not found.")
+    if join is not None:
+        notify(
+            user=user,
             message=f"You have been removed from the event '{event.event_name}'.",
         )
+    for promoted_join in promoted:
+        notify(
+            user=promoted_join.user,
+            message=f"A seat opened up, your request to join event '{event.event_name}' has been approved.",
+        )
     return redirect("events:event-detail", event_id=event.id)
 
 
 # Map Code
 
+# rows are encoded in batches so the response streams without building the
+# whole payload in memory
+MAP_DATA_BATCH_SIZE = 500
+MAP_DATA_FIELDS = ["id", "event_name", "location_id", "latitude", "longitude"]
+
+
+def _map_data_version(request):
+    # ETag and Last-Modified are computed separately by @condition, share the
+    # aggregates between them
+    if not hasattr(request, "_map_data_version"):
+        event_stats = Event.objects.aggregate(
+            # counts the events still on the map, the ETag changes as one ends
+            count=Count("id", filter=Q(is_active=True, end_time__gt=timezone.now())),
+            max_id=Max("id"),
+            last_modified=Max("updated_at"),
+        )
+        location_stats = Location.objects.aggregate(
+            count=Count("id"), last_modified=Max("updated_at")
+        )
+        request._map_data_version = (event_stats, location_stats)
+    return request._map_data_version
+
+
+def map_data_etag(request):
+    event_stats, location_stats = _map_data_version(request)
+    version = (
+        event_stats["count"],
+        event_stats["max_id"],
+        event_stats["last_modified"],
+        location_stats["count"],
+        location_stats["last_modified"],
+    )
+    return hashlib.md5(repr(version).encode()).hexdigest()
+
 
-def get_data(request):
-    location_data = Event.objects.filter(is_active=True)
-    serialized_data = serialize("json", location_data)
-    serialized_data = json.loads(serialized_data)
-    return JsonResponse({"location_data": serialized_data})
+def map_data_last_modified(request):
+    event_stats, location_stats = _map_data_version(request)
+    timestamps = [
+        stats["last_modified"]
+        for stats in (event_stats, location_stats)
+        if stats["last_modified"]
+    ]
+    return max(timestamps) if timestamps else None
+
+
+def stream_map_rows(rows):
+    yield '{"fields":%s,"rows":[' % json.dumps(MAP_DATA_FIELDS)
+    batch = []
+    separator = ""
+    for row in rows:
+        batch.append(json.dumps(row))
+        if len(batch) == MAP_DATA_BATCH_SIZE:
+            yield separator + ",".join(batch)
+            separator = ","
+            batch = []
+    if batch:
+        yield separator + ",".join(batch)
+    yield "]}"
+
+
+@condition(etag_func=map_data_etag, last_modified_func=map_data_last_modified)
+def map_data(request):
+    # one row per active event that has not ended, with the coordinates of
+    # its location
+    events = Event.objects.filter(is_active=True, end_time__gt=timezone.now())
+    # the map asks for the events of one location when its marker is opened
+    location_id = request.GET.get("location")
+    if location_id:
+        try:
+            events = events.filter(event_location_id=int(location_id))
+        except ValueError:
+            return HttpResponseBadRequest("location must be an integer.")
+    rows = (
+        events.values_list(
+            "id",
+            "event_name",
+            "event_location_id",
+            "event_location__latitude",
+            "event_location__longitude",
+        )
+        .order_by("id")
+        .iterator(chunk_size=MAP_DATA_BATCH_SIZE)
+    )
+    response = StreamingHttpResponse(
+        stream_map_rows(rows), content_type="application/json"
+    )
+    # always revalidate, a matching ETag makes that a cheap 304
+    patch_cache_control(response, no_cache=True)
+    return response
 
 
-def get_locations(request):
-    locations = Location.objects.all()
-    serialized_data = serialize("json", locations)
-    serialized_data = json.loads(serialized_data)
-    return JsonResponse({"locations": serialized_data})
+def map_clusters(request):
+    # bbox is "south,west,north,east" of the visible map
+    try:
+        south, west, north, east = (
+            float(value) for value in request.GET.get("bbox", "").split(",")
+        )
+        zoom = int(request.GET.get("zoom", ""))
+        clusters = clusters_for_bbox(south, west, north, east, zoom)
+    except ValueError as error:
+        message = str(error) if isinstance(error, ClusterRequestError) else None
+        return HttpResponseBadRequest(
+            message or "bbox must be south,west,north,east and zoom an integer."
+        )
+    return JsonResponse({"zoom": zoom, "clusters": clusters})
 
 
 # Comment related views
@@ -789,7 +1049,7 @@ def addComment(request, event_id):
         comment.event = event
         comment.save()
         if request.user != event.creator:
-            Notification.objects.create(
+            notify(
                 user=event.creator,
                 message=f"Comment added by user '{request.user}' to event '{event.event_name}'.",
             )
@@ -832,7 +1092,7 @@ def addReply(request, event_id, comment_id):
             # handle the case when it's a reply of a reply
             return HttpResponseBadRequest("Cantnot reply to a nested comment")
         if request.user != event.creator:
-            Notification.objects.create(
+            notify(
                 user=event.creator,
                 message=f"Reply added by user '{request.user}' to event '{event.event_name}'.",
             )
@@ -864,7 +1124,7 @@ def deleteComment(request, comment_id):
         if not comment.replies.exists():
             comment.is_active = False
             comment.save()
-            Notification.objects.create(
+            notify(
                 user=comment.event.creator,
                 message=f"Comment by user '{request.user}' has been removed from '{comment.event.event_name}'.",
             )
@@ -901,27 +1161,34 @@ def toggleReaction(request, event_id, emoji):
             f"You have already reacted with {existing_reaction.emoji}. You can only react with one emoji per event.",
         )
         return redirect("events:event-detail", event_id=event.id)
-    reaction, created = Reaction.objects.get_or_create(
-        user=request.user, event=event, emoji=emoji
-    )
-    if not created:
-        reaction.is_active = not reaction.is_active
-        if reaction.is_active:
-            Notification.objects.create(
-                user=event.creator,
-                message=f"User '{request.user}' has reacted to event '{event.event_name}'.",
-            )
+    with transaction.atomic():
+        reaction, created = Reaction.objects.get_or_create(
+            user=request.user, event=event, emoji=emoji
+        )
+        if not created:
+            reaction = Reaction.objects.select_for_update().get(pk=reaction.pk)
+            reaction.is_active = not reaction.is_active
+            if reaction.is_active:
+                notify(
+                    user=event.creator,
+                    message=f"User '{request.user}' has reacted to event '{event.event_name}'.",
+                    dedupe=True,
+                )
+            else:
+                notify(
+                    user=event.creator,
+                    message=f"User '{request.user}' has removed reaction from event '{event.event_name}'.",
+                    dedupe=True,
+                )
+            reaction.save()
+            record_reaction_change(event.id, emoji, 1 if reaction.is_active else -1)
         else:
-            Notification.objects.create(
+            record_reaction_change(event.id, emoji, 1)
+            notify(
                 user=event.creator,
-                message=f"User '{request.user}' has removed reaction from event '{event.event_name}'.",
+                message=f"User '{request.user}' has reacted to event '{event.event_name}'.",
+                dedupe=True,
             )
-        reaction.save()
-    else:
-        Notification.objects.create(
-            user=event.creator,
-            message=f"User '{request.user}' has reacted to event '{event.event_name}'.",
-        )
 
     return redirect("events:event-detail", event_id=event.id)
 
@@ -1000,81 +1267,17 @@ def filter_event_capacity_label(capacity_label):
 # recommend event page
 @login_required
 def recommendEvent(request):
-    favorite_locations = FavoriteLocation.objects.filter(user=request.user)
-    favorite_location_ids = [location.id for location in favorite_locations]
-    favorite_events = Event.objects.filter(event_location__in=favorite_location_ids)
-    ny_timezone = pytz.timezone("America/New_York")
-    current_time_ny = timezone.now().astimezone(ny_timezone)
-    event_joins = EventJoin.objects.filter(
-        Q(user=request.user) & (Q(status=APPROVED) | Q(status=PENDING))
-    )
-    event_ids = event_joins.values_list("event_id", flat=True)
-    user_events = Event.objects.filter((Q(creator=request.user) | Q(id__in=event_ids)))
-    user_event_locations = Location.objects.filter(event__in=user_events).distinct()
-    user_event_tag_data = (
-        Tag.objects.filter(event__in=user_events)
-        .distinct()
-        .values("tag_name")
-        .annotate(tag_count=Count("event"))
-        .order_by("-tag_count")
-    )
-    user_events_tag_names = user_event_tag_data.values_list("tag_name", flat=True)
-    recommended_events = Event.objects.exclude(Q(id__in=user_events))
-    recommended_events = recommended_events.filter(
-        Q(is_active=True) & Q(end_time__gt=current_time_ny)
-    )
-    recommended_events_by_location = recommended_events.filter(
-        event_location__in=user_event_locations
-    )
-    # Extract event IDs from recommended_events_by_location and favorite_events
-    recommended_event_ids = {event.id for event in recommended_events_by_location}
-    favorite_event_ids = {event.id for event in favorite_events}
-
-    # Find the event IDs that are in favorite_events but not in recommended_events_by_location
-    events_to_keep = favorite_event_ids - recommended_event_ids
-
-    # Filter favorite_events to keep only the events not present in recommended_events_by_location
-    filtered_favorite_events = [
-        event for event in favorite_events if event.id in events_to_keep
-    ]
-    recommended_events_by_tag = []
-    for user_events_tag in user_events_tag_names:
-        tag_id = Tag.objects.get(tag_name=user_events_tag)
-        events = recommended_events.filter(tags=tag_id)
-        recommended_events_by_tag.append(events)
-
-    recommended_events_by_tag_with_tag = zip(
-        user_events_tag_names, recommended_events_by_tag
-    )
-
-    user_friends = UserFriends.objects.filter(
-        friends=request.user.userprofile, status=APPROVED
-    )
-    friends_ids = user_friends.values_list("user_id", flat=True)
-    user_friends_by_user = User.objects.filter(id__in=friends_ids)
-    recommended_events_by_friend = []
-    for user_friend_by_user in user_friends_by_user:
-        events_created_by_current_friend = recommended_events.filter(
-            creator=user_friend_by_user
-        )[:2]
-        recommended_events_by_friend.extend(list(events_created_by_current_friend))
-
-    if (
-        not recommended_events_by_location
-        and recommended_events_by_tag == []
-        and filtered_favorite_events == []
-        and recommended_events_by_friend == []
-    ):
+    recommendations = recommended_events(request.user.id)
+    if not any(recommendations.values()):
         messages.warning(
             request, "Sorry we haven't found any match! See all the events here!"
         )
         return redirect("events:index")
 
     context = {
-        "favorite_events": filtered_favorite_events,
-        "recommended_events_by_location": recommended_events_by_location,
-        "recommended_events_by_tag_with_tag": recommended_events_by_tag_with_tag,
-        "recommended_events_by_friend": recommended_events_by_friend,
-        "user_friends_by_user": user_friends_by_user,
+        "favorite_events": recommendations["favorites"],
+        "recommended_events_by_location": recommendations["by_location"],
+        "recommended_events_by_tag_with_tag": recommendations["by_tag"],
+        "recommended_events_by_friend": recommendations["by_friend"],
     }
     return render(request, "events/recommend-event.html", context)
@@ -0,0 +1,146 @@
+"""In-process prefix index behind the location autocomplete endpoint.
+
+Every word suffix of every location name ("prospect park", "park") is kept
+in one sorted array, so a keystroke is a binary search plus a short scan
+instead of a database round trip. The index is built lazily on first use
+and dropped whenever a Location is saved or deleted (see location.models).
+Other workers learn about the change from a version number in the shared
+cache, which every lookup compares with the one its index was built at.
+
+Popularity, the number of upcoming active events at a location, is
+counted separately: one aggregate query, redone when an event is saved or
+deleted (see events.models) and at least every POPULARITY_TIMEOUT seconds,
+as events end.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+AUTOCOMPLETE_LIMIT = 10
+POPULARITY_TIMEOUT = 60 * 5
+VERSION_KEY = "location-index:version"
+
+
+def _version():
+    # a fresh key starts at the current time, never at a version a worker
+    # may still hold from before the key was evicted
+    return cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+
+def normalize(text):
+    return " ".join((text or "").lower().split())
+
+
+class LocationIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._snapshot = None
+        self._popularity_generation = 0
+        self._popularity = None
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # the version key was evicted or never set
+            _version()
+
+    def invalidate_popularity(self):
+        with self._lock:
+            self._popularity_generation += 1
+            self._popularity = None
+
+    def _build(self):
+        from .models import Location
+
+        entries = []
+        names = {}
+        for location_id, name in Location.objects.values_list("id", "location_name"):
+            names[location_id] = name
+            words = normalize(name).split()
+            for position in range(len(words)):
+                entries.append((" ".join(words[position:]), position, location_id))
+        entries.sort()
+        keys = [key for key, _, _ in entries]
+        return keys, entries, names
+
+    def _count_popularity(self):
+        from .models import Location
+
+        locations = (
+            Location.objects.filter(
+                event__is_active=True, event__end_time__gt=timezone.now()
+            )
+            .annotate(popularity=Count("event"))
+            .values_list("id", "popularity")
+        )
+        return time.monotonic() + POPULARITY_TIMEOUT, dict(locations)
+
+    def _get_snapshot(self):
+        version = _version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1]
+        generation = self._generation
+        snapshot = (version, self._build())
+        with self._lock:
+            # a save that happened while we were building makes it stale
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot[1]
+
+    def _get_popularity(self):
+        popularity = self._popularity
+        if popularity is not None and popularity[0] > time.monotonic():
+            return popularity[1]
+        generation = self._popularity_generation
+        popularity = self._count_popularity()
+        with self._lock:
+            if generation == self._popularity_generation:
+                self._popularity = popularity
+        return popularity[1]
+
+    def suggest(self, term, limit=AUTOCOMPLETE_LIMIT):
+        """Return up to ``limit`` (id, name) pairs whose words start with term.
+
+        Names that start with the term come first, then the locations with
+        the most upcoming active events, then alphabetical order.
+        """
+        prefix = normalize(term)
+        if not prefix:
+            return []
+        keys, entries, names = self._get_snapshot()
+        best_position = {}
+        for index in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[index].startswith(prefix):
+                break
+            _, position, location_id = entries[index]
+            if position < best_position.get(location_id, position + 1):
+                best_position[location_id] = position
+        if not best_position:
+            return []
+        popularity = self._get_popularity()
+        ranked = heapq.nsmallest(
+            limit,
+            best_position,
+            key=lambda location_id: (
+                best_position[location_id] > 0,
+                -popularity.get(location_id, 0),
+                names[location_id].lower(),
+                location_id,
+            ),
+        )
+        return [(location_id, names[location_id]) for location_id in ranked]
+
+
+location_index = LocationIndex()
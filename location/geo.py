@@ -0,0 +1,158 @@
+"""Geohash spatial index helpers for Location lookups.
+
+Every Location stores the geohash of its coordinates in an indexed column.
+A radius query first narrows the table to the 3x3 block of geohash cells
+around the search point (a handful of indexed prefix scans) and then
+applies the exact haversine distance to what is left.
+"""
+
+import math
+from functools import lru_cache
+
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+# precision 7 cells are roughly 150m x 150m, fine enough for any radius we use
+GEOHASH_PRECISION = 7
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {char: index for index, char in enumerate(_BASE32)}
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def decode(geohash):
+    """Return the (latitude, longitude) centre of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if bits >> shift & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def cell_size(precision):
+    """Return the (height, width) of a geohash cell in degrees."""
+    total_bits = 5 * precision
+    lat_bits = total_bits // 2
+    lon_bits = total_bits - lat_bits
+    return 180.0 / 2**lat_bits, 360.0 / 2**lon_bits
+
+
+@lru_cache(maxsize=4096)
+def neighbourhood(geohash):
+    """Return the cell itself plus its eight neighbours."""
+    latitude, longitude = decode(geohash)
+    height, width = cell_size(len(geohash))
+    cells = set()
+    for d_lat in (-1, 0, 1):
+        for d_lon in (-1, 0, 1):
+            lat = max(-90.0, min(90.0, latitude + d_lat * height))
+            lon = (longitude + d_lon * width + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, len(geohash)))
+    return tuple(sorted(cells))
+
+
+def precision_for_radius(latitude, radius_km):
+    """Pick the finest precision whose cells are still at least radius_km wide.
+
+    With cells that size, the 3x3 neighbourhood of the centre cell always
+    covers the whole search circle.
+    """
+    lon_scale = max(math.cos(math.radians(latitude)), 0.01)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        min_side_km = min(height, width * lon_scale) * KM_PER_DEGREE
+        if min_side_km >= radius_km:
+            return precision
+    return 1
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (
+        math.sin(d_lat / 2) ** 2
+        + math.cos(math.radians(lat1))
+        * math.cos(math.radians(lat2))
+        * math.sin(d_lon / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cells_query(latitude, longitude, radius_km, prefix=""):
+    """Build a Q that matches the geohash cells covering the search circle."""
+    precision = precision_for_radius(latitude, radius_km)
+    query = Q()
+    for cell in neighbourhood(encode(latitude, longitude, precision)):
+        query |= Q(**{f"{prefix}geohash__startswith": cell})
+    return query
+
+
+def distance_expression(latitude, longitude, prefix=""):
+    """Haversine distance in km from a point to each row, computed in SQL."""
+    lat = Radians(f"{prefix}latitude")
+    lon = Radians(f"{prefix}longitude")
+    origin_lat = Value(math.radians(latitude), output_field=FloatField())
+    origin_lon = Value(math.radians(longitude), output_field=FloatField())
+    a = Power(Sin((lat - origin_lat) / 2), 2) + Cos(origin_lat) * Cos(lat) * Power(
+        Sin((lon - origin_lon) / 2), 2
+    )
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(
+        Least(Sqrt(a), Value(1.0, output_field=FloatField()))
+    )
+
+
+def filter_within_radius(queryset, latitude, longitude, radius_km, prefix=""):
+    """Narrow a queryset to rows within radius_km and annotate ``distance``.
+
+    ``prefix`` points at the Location relation, e.g. ``"event_location__"``
+    when filtering events.
+    """
+    return (
+        queryset.filter(cells_query(latitude, longitude, radius_km, prefix))
+        .annotate(distance=distance_expression(latitude, longitude, prefix))
+        .filter(distance__lte=radius_km)
+    )
+
+
+def nearby_locations(latitude, longitude, radius_km):
+    from .models import Location
+
+    return filter_within_radius(
+        Location.objects.all(), latitude, longitude, radius_km
+    ).order_by("distance")
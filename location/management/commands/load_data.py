@@ -1,26 +1,163 @@
-# myapp/management/commands/load_data.py
+# location/management/commands/load_data.py
 
 import csv
-from location.models import Location as locat
-from django.core.management.base import BaseCommand
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from events.clusters import invalidate_clusters
+from location import geo
+from location.autocomplete import location_index
+from location.models import Location
+
+# columns of exported_data.csv, the first one is the id in the source database
+CSV_FIELDS = [
+    "location_name",
+    "latitude",
+    "longitude",
+    "zipcode",
+    "address",
+    "url",
+    "category",
+]
+UPDATE_FIELDS = [
+    field for field in CSV_FIELDS if field not in ("location_name", "address")
+] + ["geohash", "updated_at"]
 
 
 class Command(BaseCommand):
-    help = "Load data from a CSV file into the database"
+    help = (
+        "Load locations from a CSV file (or stdin) into the database. "
+        "Rows are matched on name and address, so re-running the same file "
+        "updates locations instead of duplicating them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "csv_file",
+            nargs="?",
+            default="-",
+            help="Path to the CSV file, '-' or nothing to read from stdin",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of rows written per bulk query (default: 500)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Parse and match the rows without writing anything",
+        )
 
     def handle(self, *args, **options):
-        csv_file = r"C:\Users\dhire\OneDrive\Desktop\NYU\SE\Project\CheerUp\exported_data.csv"  # Provide the path to your CSV file
-
-        with open(csv_file, "r", encoding="utf-8") as file:
-            csv_reader = csv.reader(file)
-            for row in csv_reader:
-                locat.objects.create(
-                    location_name=row[1],
-                    latitude=row[2],
-                    longitude=row[3],
-                    zipcode=row[4],
-                    address=row[5],
-                    url=row[6],
-                    category=row[7],
-                )
-        self.stdout.write(self.style.SUCCESS("Data loaded successfully"))
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        self.dry_run = options["dry_run"]
+
+        # natural key -> id of the locations already in the database
+        self.existing = {
+            (name, address): location_id
+            for location_id, name, address in Location.objects.values_list(
+                "id", "location_name", "address"
+            )
+        }
+        self.seen = set()
+        self.counts = {"created": 0, "updated": 0, "skipped": 0}
+        self.started = time.monotonic()
+
+        csv_file = options["csv_file"]
+        if csv_file == "-":
+            self.load(sys.stdin, batch_size)
+        else:
+            try:
+                with open(csv_file, "r", encoding="utf-8", newline="") as file:
+                    self.load(file, batch_size)
+            except OSError as error:
+                raise CommandError(f"Cannot read {csv_file}: {error}")
+
+        if not self.dry_run and (self.counts["created"] or self.counts["updated"]):
+            # bulk writes skip the post_save signals that normally do this
+            location_index.invalidate()
+            invalidate_clusters()
+
+        prefix = "Dry run: would have " if self.dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}created {self.counts['created']}, "
+                f"updated {self.counts['updated']}, "
+                f"skipped {self.counts['skipped']} locations "
+                f"in {time.monotonic() - self.started:.2f}s"
+            )
+        )
+
+    def load(self, file, batch_size):
+        to_create = []
+        to_update = []
+        processed = 0
+        for line_number, row in enumerate(csv.reader(file), start=1):
+            location = self.parse_row(line_number, row)
+            processed += 1
+            if location is None:
+                continue
+            key = (location.location_name, location.address)
+            if key in self.seen:
+                self.skip(line_number, "duplicate of an earlier row")
+                continue
+            self.seen.add(key)
+            if key in self.existing:
+                location.id = self.existing[key]
+                to_update.append(location)
+            else:
+                to_create.append(location)
+            if len(to_create) + len(to_update) >= batch_size:
+                self.write_batch(to_create, to_update, batch_size)
+                self.report_progress(processed)
+                to_create = []
+                to_update = []
+        self.write_batch(to_create, to_update, batch_size)
+        self.report_progress(processed)
+
+    def parse_row(self, line_number, row):
+        if len(row) != len(CSV_FIELDS) + 1:
+            self.skip(line_number, f"expected {len(CSV_FIELDS) + 1} columns")
+            return None
+        values = dict(zip(CSV_FIELDS, (value.strip() for value in row[1:])))
+        try:
+            values["latitude"] = float(values["latitude"])
+            values["longitude"] = float(values["longitude"])
+            values["zipcode"] = int(values["zipcode"] or 0)
+        except ValueError:
+            self.skip(line_number, "latitude, longitude and zipcode must be numbers")
+            return None
+        location = Location(**values)
+        # bulk_create and bulk_update bypass Location.save
+        location.geohash = geo.encode(location.latitude, location.longitude)
+        location.updated_at = timezone.now()
+        return location
+
+    def skip(self, line_number, reason):
+        self.counts["skipped"] += 1
+        self.stderr.write(f"Skipping line {line_number}: {reason}")
+
+    def write_batch(self, to_create, to_update, batch_size):
+        if not self.dry_run:
+            with transaction.atomic():
+                if to_create:
+                    Location.objects.bulk_create(to_create, batch_size=batch_size)
+                if to_update:
+                    Location.objects.bulk_update(
+                        to_update, UPDATE_FIELDS, batch_size=batch_size
+                    )
+        self.counts["created"] += len(to_create)
+        self.counts["updated"] += len(to_update)
+
+    def report_progress(self, processed):
+        elapsed = time.monotonic() - self.started
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(f"{processed} rows processed ({rate:.0f} rows/s)")
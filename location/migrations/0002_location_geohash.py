@@ -0,0 +1,28 @@
+# Generated by Django 4.1 on 2026-10-18 15:28
+
+from django.db import migrations, models
+
+from location.geo import encode
+
+
+def backfill_geohash(apps, schema_editor):
+    Location = apps.get_model("location", "Location")
+    locations = list(Location.objects.only("id", "latitude", "longitude"))
+    for location in locations:
+        location.geohash = encode(location.latitude, location.longitude)
+    Location.objects.bulk_update(locations, ["geohash"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("location", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="geohash",
+            field=models.CharField(blank=True, db_index=True, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
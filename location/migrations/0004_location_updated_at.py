@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("location", "0003_location_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from . import geo
+from .autocomplete import location_index
 
 
 # Create your models here.
@@ -10,6 +12,22 @@ class Location(models.Model):
     address = models.CharField(max_length=400, default="Prospect Road")
     url = models.CharField(max_length=400, default="https://example.com")
     category = models.CharField(max_length=100, default="park")
+    # spatial index key, kept in sync with latitude/longitude on save
+    geohash = models.CharField(max_length=12, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(float(self.latitude), float(self.longitude))
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.location_name
+
+
+def invalidate_location_index(sender, **kwargs):
+    location_index.invalidate()
+
+
+# Drop the autocomplete index whenever the set of locations changes
+models.signals.post_save.connect(invalidate_location_index, sender=Location)
+models.signals.post_delete.connect(invalidate_location_index, sender=Location)
@@ -0,0 +1,132 @@
+"""Full-text search over locations.
+
+On PostgreSQL this uses a tsvector match backed by a GIN expression index
+(see migration 0003) with prefix matching on every term. Other databases,
+such as the SQLite test database, fall back to a small in-memory inverted
+index so results and ranking behave the same way.
+"""
+
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = "english"
+
+# the GIN index is built on exactly this expression, keep them in sync
+LOCATION_SEARCH_VECTOR = SearchVector("location_name", "address", config=SEARCH_CONFIG)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def use_postgres_search():
+    return connection.vendor == "postgresql"
+
+
+def prefix_search_query(terms):
+    """Build a tsquery that requires every term, each one as a prefix."""
+    # terms only ever contain [a-z0-9], so the raw query cannot be malformed
+    raw_query = " & ".join(f"{term}:*" for term in terms)
+    return SearchQuery(raw_query, search_type="raw", config=SEARCH_CONFIG)
+
+
+class InvertedIndex:
+    """Token -> document postings with prefix lookups and weighted scoring."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self._tokens = None
+
+    def add(self, doc_id, text, weight=1.0):
+        for token in tokenize(text):
+            postings = self.postings[token]
+            postings[doc_id] = postings.get(doc_id, 0.0) + weight
+        self._tokens = None
+
+    def _matching_tokens(self, prefix):
+        if self._tokens is None:
+            self._tokens = sorted(self.postings)
+        start = bisect_left(self._tokens, prefix)
+        for token in self._tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def search(self, query):
+        """Return [(doc_id, score)] for documents matching every query term."""
+        scores = None
+        for term in tokenize(query):
+            term_scores = defaultdict(float)
+            for token in self._matching_tokens(term):
+                # whole-word matches rank above prefix matches
+                boost = 1.0 if token == term else 0.5
+                for doc_id, weight in self.postings[token].items():
+                    term_scores[doc_id] += weight * boost
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    doc_id: score + term_scores[doc_id]
+                    for doc_id, score in scores.items()
+                    if doc_id in term_scores
+                }
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def no_results(queryset):
+    return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def rank_by_ids(queryset, ranked):
+    """Restrict a queryset to ranked ids and annotate the Python-side rank."""
+    if not ranked:
+        return no_results(queryset)
+    return queryset.filter(id__in=[doc_id for doc_id, _ in ranked]).annotate(
+        rank=Case(
+            *[When(id=doc_id, then=Value(score)) for doc_id, score in ranked],
+            output_field=FloatField(),
+        )
+    )
+
+
+def search_locations(query, queryset=None):
+    """Return locations matching ``query``, annotated with ``rank``."""
+    from .models import Location
+
+    if queryset is None:
+        queryset = Location.objects.all()
+    terms = tokenize(query)
+    if not terms:
+        return no_results(queryset)
+    if use_postgres_search():
+        search_query = prefix_search_query(terms)
+        return (
+            queryset.annotate(search=LOCATION_SEARCH_VECTOR)
+            .filter(search=search_query)
+            .annotate(
+                # ts_rank is a float4, as a double it compares equal to
+                # the value read back in Python
+                rank=Cast(
+                    SearchRank(LOCATION_SEARCH_VECTOR, search_query), FloatField()
+                )
+            )
+        )
+    index = InvertedIndex()
+    for location_id, name, address in queryset.values_list(
+        "id", "location_name", "address"
+    ):
+        index.add(location_id, name, weight=1.0)
+        index.add(location_id, address, weight=0.4)
+    return rank_by_ids(queryset, index.search(query))
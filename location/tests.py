@@ -0,0 +1,247 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from .models import Location
+from . import geo
+from .search import InvertedIndex
+from .autocomplete import AUTOCOMPLETE_LIMIT, LocationIndex, location_index
+from events.models import Event
+
+
+class GeohashTest(TestCase):
+    def test_encode_known_value(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def test_decode_round_trip(self):
+        latitude, longitude = geo.decode(geo.encode(40.7128, -74.0060))
+        self.assertAlmostEqual(latitude, 40.7128, places=2)
+        self.assertAlmostEqual(longitude, -74.0060, places=2)
+
+    def test_neighbourhood_has_nine_cells(self):
+        cells = geo.neighbourhood(geo.encode(40.7128, -74.0060, 5))
+        self.assertEqual(len(cells), 9)
+        self.assertIn(geo.encode(40.7128, -74.0060, 5), cells)
+
+    def test_haversine_distance(self):
+        # Washington Square Park to Prospect Park is about 8.2 km
+        distance = geo.haversine_km(40.7308, -73.9973, 40.6602, -73.9690)
+        self.assertAlmostEqual(distance, 8.2, delta=0.3)
+
+    def test_location_save_sets_geohash(self):
+        location = Location.objects.create(
+            location_name="Washington Square Park", latitude=40.7308, longitude=-73.9973
+        )
+        self.assertEqual(location.geohash, geo.encode(40.7308, -73.9973))
+
+
+class NearbyLocationsTest(TestCase):
+    def setUp(self):
+        self.washington_square = Location.objects.create(
+            location_name="Washington Square Park", latitude=40.7308, longitude=-73.9973
+        )
+        self.union_square = Location.objects.create(
+            location_name="Union Square", latitude=40.7359, longitude=-73.9911
+        )
+        self.prospect_park = Location.objects.create(
+            location_name="Prospect Park", latitude=40.6602, longitude=-73.9690
+        )
+
+    def test_nearby_locations_sorted_by_distance(self):
+        results = list(geo.nearby_locations(40.7300, -73.9980, 3.2))
+        self.assertEqual(results, [self.washington_square, self.union_square])
+        self.assertLess(results[0].distance, results[1].distance)
+        self.assertAlmostEqual(
+            results[1].distance,
+            geo.haversine_km(40.7300, -73.9980, 40.7359, -73.9911),
+            places=3,
+        )
+
+    def test_nearby_locations_across_cell_boundary(self):
+        # a point just across a cell edge must still see locations in the next cell
+        precision = geo.precision_for_radius(40.7308, 3.2)
+        _, width = geo.cell_size(precision)
+        _, cell_longitude = geo.decode(geo.encode(40.7308, -73.9973, precision))
+        edge_longitude = cell_longitude - width / 2 - 1e-6
+        self.assertNotEqual(
+            geo.encode(40.7308, edge_longitude, precision),
+            geo.encode(40.7308, -73.9973, precision),
+        )
+        results = list(geo.nearby_locations(40.7308, edge_longitude, 3.2))
+        self.assertIn(self.washington_square, results)
+
+
+class InvertedIndexTest(TestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, "Prospect Park")
+        self.index.add(2, "Park Slope Library")
+        self.index.add(3, "Parkside Deli")
+
+    def test_prefix_match(self):
+        self.assertEqual({doc_id for doc_id, _ in self.index.search("par")}, {1, 2, 3})
+
+    def test_whole_word_ranks_above_prefix(self):
+        ranked = [doc_id for doc_id, _ in self.index.search("park")]
+        self.assertEqual(ranked[-1], 3)
+
+    def test_every_term_required(self):
+        self.assertEqual(self.index.search("park lib"), [(2, 1.5)])
+        self.assertEqual(self.index.search("park museum"), [])
+
+
+class LocationAutocompleteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.prospect_park = Location.objects.create(location_name="Prospect Park")
+        self.park_slope = Location.objects.create(location_name="Park Slope Library")
+        self.museum = Location.objects.create(location_name="Brooklyn Museum")
+        # counted by earlier tests, whose events were rolled back uncommitted
+        location_index.invalidate_popularity()
+
+    def autocomplete(self, term):
+        response = self.client.get(
+            reverse("locations:location-autocomplete"), {"term": term}
+        )
+        return [item["text"] for item in response.json()]
+
+    def test_autocomplete_ranks_name_prefix_first(self):
+        self.assertEqual(
+            self.autocomplete("park"), ["Park Slope Library", "Prospect Park"]
+        )
+
+    def test_other_workers_see_new_locations(self):
+        # an index of another worker, sharing only the cache
+        other_index = LocationIndex()
+        self.assertEqual(
+            [name for _, name in other_index.suggest("museum")], ["Brooklyn Museum"]
+        )
+        Location.objects.create(location_name="Museum of the Moving Image")
+        self.assertEqual(
+            [name for _, name in other_index.suggest("museum")],
+            ["Museum of the Moving Image", "Brooklyn Museum"],
+        )
+
+    def create_event(self, location, start_time):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Event.objects.create(
+                event_name="Picnic",
+                event_location=location,
+                start_time=start_time,
+                end_time=start_time + timedelta(hours=2),
+                capacity=10,
+                creator=self.user,
+            )
+
+    def test_autocomplete_ranks_popular_locations_first(self):
+        Location.objects.create(location_name="Park Avenue Plaza")
+        self.autocomplete("park")
+        self.create_event(self.park_slope, timezone.now() + timedelta(days=1))
+        self.assertEqual(
+            self.autocomplete("park"),
+            ["Park Slope Library", "Park Avenue Plaza", "Prospect Park"],
+        )
+
+    def test_autocomplete_popularity_counts_upcoming_events(self):
+        Location.objects.create(location_name="Park Avenue Plaza")
+        # an ended event does not count
+        self.create_event(self.park_slope, timezone.now() - timedelta(days=2))
+        self.assertEqual(
+            self.autocomplete("park"),
+            ["Park Avenue Plaza", "Park Slope Library", "Prospect Park"],
+        )
+        self.create_event(self.park_slope, timezone.now() + timedelta(days=1))
+        self.assertEqual(
+            self.autocomplete("park"),
+            ["Park Slope Library", "Park Avenue Plaza", "Prospect Park"],
+        )
+
+    def test_autocomplete_is_limited(self):
+        for i in range(AUTOCOMPLETE_LIMIT + 5):
+            Location.objects.create(location_name=f"Pier {i}")
+        self.assertEqual(len(self.autocomplete("pier")), AUTOCOMPLETE_LIMIT)
+
+    def test_autocomplete_does_not_query_once_loaded(self):
+        self.autocomplete("bro")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete("brooklyn mu"), ["Brooklyn Museum"])
+
+    def test_autocomplete_sees_saved_and_deleted_locations(self):
+        self.assertEqual(self.autocomplete("brook"), ["Brooklyn Museum"])
+        Location.objects.create(location_name="Brooklyn Bridge Park")
+        self.museum.delete()
+        self.assertEqual(self.autocomplete("brook"), ["Brooklyn Bridge Park"])
+
+    def test_autocomplete_empty_term(self):
+        response = self.client.get(reverse("locations:location-autocomplete"))
+        self.assertEqual(response.json(), [])
+
+
+class LoadDataCommandTest(TestCase):
+    rows = (
+        "2029,Alexander Hamilton U.S. Custom House,40.70381622,-74.0137558,10004,"
+        "1 Bowling Grn,http://www.oldnycustomhouse.gov/,museum\n"
+        "2030,Alice Austen House Museum,40.61512084,-74.06303179,10305,"
+        "2 Hylan Blvd,http://www.aliceausten.org/,museum\n"
+        "2031,Broken Row,not-a-number,-74.0,10001,1 Main St,http://example.com,park\n"
+    )
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tempdir.name, "locations.csv")
+        with open(self.csv_path, "w", encoding="utf-8") as file:
+            file.write(self.rows)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def load(self, *args, **options):
+        stdout = io.StringIO()
+        call_command("load_data", *args, stdout=stdout, stderr=io.StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_load_creates_locations(self):
+        output = self.load(self.csv_path, batch_size=1)
+        self.assertIn("created 2, updated 0, skipped 1", output)
+        self.assertIn("rows/s", output)
+        location = Location.objects.get(location_name="Alice Austen House Museum")
+        self.assertEqual(location.zipcode, 10305)
+        self.assertEqual(location.geohash, geo.encode(40.61512084, -74.06303179))
+
+    def test_reload_updates_instead_of_duplicating(self):
+        self.load(self.csv_path)
+        with open(self.csv_path, "w", encoding="utf-8") as file:
+            file.write(self.rows.replace("10305", "10306"))
+        output = self.load(self.csv_path)
+        self.assertIn("created 0, updated 2", output)
+        self.assertEqual(Location.objects.count(), 2)
+        self.assertEqual(
+            Location.objects.get(location_name="Alice Austen House Museum").zipcode,
+            10306,
+        )
+
+    def test_dry_run_writes_nothing(self):
+        output = self.load(self.csv_path, dry_run=True)
+        self.assertIn("Dry run: would have created 2", output)
+        self.assertEqual(Location.objects.count(), 0)
+
+    def test_load_from_stdin(self):
+        with mock.patch("sys.stdin", io.StringIO(self.rows)):
+            self.load()
+        self.assertEqual(Location.objects.count(), 2)
+
+    def test_loaded_locations_show_up_in_autocomplete(self):
+        location_index.suggest("alice")
+        self.load(self.csv_path)
+        self.assertEqual(
+            [name for _, name in location_index.suggest("alice")],
+            ["Alice Austen House Museum"],
+        )
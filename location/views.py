@@ -1,5 +1,6 @@
 from django.http import JsonResponse
 from .models import Location
+from .autocomplete import location_index
 from django.contrib.auth.decorators import login_required
 from events.models import FavoriteLocation
 from django.shortcuts import render, get_object_or_404, redirect
@@ -8,11 +9,10 @@ from django.http import HttpResponseBadRequest
 
 def Location_autocomplete(request):
     query = request.GET.get("term", "")
-    results = Location.objects.filter(
-        location_name__icontains=query
-    )  # Adjust the filtering based on your model's fields
-    print(results)
-    data = [{"id": location.id, "text": location.location_name} for location in results]
+    data = [
+        {"id": location_id, "text": location_name}
+        for location_id, location_name in location_index.suggest(query)
+    ]
     return JsonResponse(data, safe=False)
 
 
@@ -5,3 +5,9 @@ WITHDRAWN = "withdrawn"
 APPROVED = "approved"
 REJECTED = "rejected"
 REMOVED = "removed"
+
+# number of notifications per page on the notifications page
+NOTIFICATIONS_PAGE_SIZE = 20
+
+# cached friend and attendee sets are rebuilt at least daily
+FRIEND_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24
@@ -0,0 +1,106 @@
+"""Cached friend graph.
+
+A friendship is stored as two UserFriends rows, one per direction, that
+join a User to the other user's UserProfile. Rather than joining those
+tables on every page, the approved friends of a user are cached as a
+frozenset of user ids, and the approved attendees of an event likewise.
+Friends of, mutual friends and friends attending are then set operations
+on one or two cached sets, in O(degree) and without SQL.
+
+The sets are dropped when a UserFriends or EventJoin row is saved or
+deleted (see the signals in profiles/models.py). Code that changes those
+rows with QuerySet.update() must call forget_friends or forget_attendees
+itself.
+"""
+
+from django.core.cache import cache
+
+from .constants import APPROVED, FRIEND_GRAPH_CACHE_TIMEOUT
+
+
+def _friends_key(user_id):
+    return f"friends:{user_id}"
+
+
+def _attendees_key(event_id):
+    return f"friends:attendees:{event_id}"
+
+
+def _cached_sets(ids, key, load):
+    """Return {id: frozenset} for ``ids``, loading the missing sets with
+    ``load(missing ids)`` and caching them."""
+    keys = {key(item_id): item_id for item_id in ids}
+    cached = cache.get_many(keys)
+    sets = {keys[cache_key]: members for cache_key, members in cached.items()}
+    missing = [
+        item_id for cache_key, item_id in keys.items() if cache_key not in cached
+    ]
+    if missing:
+        loaded = {item_id: set() for item_id in missing}
+        for item_id, member_id in load(missing):
+            loaded[item_id].add(member_id)
+        loaded = {item_id: frozenset(members) for item_id, members in loaded.items()}
+        cache.set_many(
+            {key(item_id): members for item_id, members in loaded.items()},
+            timeout=FRIEND_GRAPH_CACHE_TIMEOUT,
+        )
+        sets.update(loaded)
+    return sets
+
+
+def _load_friends(user_ids):
+    from .models import UserFriends
+
+    # the row of each friend points at the user's profile
+    return UserFriends.objects.filter(
+        friends__user_id__in=user_ids, status=APPROVED
+    ).values_list("friends__user_id", "user_id")
+
+
+def _load_attendees(event_ids):
+    from events.models import EventJoin
+
+    return EventJoin.objects.filter(
+        event_id__in=event_ids, status=APPROVED
+    ).values_list("event_id", "user_id")
+
+
+def friend_ids_many(user_ids):
+    """Return {user id: frozenset of friend ids} in one cache round trip."""
+    return _cached_sets(user_ids, _friends_key, _load_friends)
+
+
+def friend_ids(user_id):
+    """Return the ids of the approved friends of ``user_id``."""
+    return friend_ids_many([user_id])[user_id]
+
+
+def mutual_friend_ids(user_id, other_id):
+    friends = friend_ids_many([user_id, other_id])
+    return friends[user_id] & friends[other_id]
+
+
+def attendee_ids_many(event_ids):
+    """Return {event id: frozenset of approved attendee ids}."""
+    return _cached_sets(event_ids, _attendees_key, _load_attendees)
+
+
+def friends_attending_many(user_id, event_ids):
+    """Return {event id: ids of the friends of ``user_id`` going to it}."""
+    friends = friend_ids(user_id)
+    return {
+        event_id: friends & attendees
+        for event_id, attendees in attendee_ids_many(event_ids).items()
+    }
+
+
+def friends_attending(user_id, event_id):
+    return friends_attending_many(user_id, [event_id])[event_id]
+
+
+def forget_friends(*user_ids):
+    cache.delete_many([_friends_key(user_id) for user_id in user_ids])
+
+
+def forget_attendees(*event_ids):
+    cache.delete_many([_attendees_key(event_id) for event_id in event_ids])
@@ -0,0 +1,83 @@
+"""Friend request state machine.
+
+A friend request is the UserFriends row of the sender pointing at the
+receiver's profile; once answered it has a mirror row pointing the other
+way. Every transition locks both rows, checks the state of the request
+row, and moves the rows with a single conditional UPDATE, so a repeated
+or concurrent click finds the request already moved and changes nothing.
+
+The transitions return ``(status, changed)``: the status of the request
+row afterwards and whether this call moved it, i.e. whether the other
+user should be notified.
+"""
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Q
+
+from events.recommendations import forget_recommendations
+
+from .constants import APPROVED, PENDING, REJECTED, REMOVED
+from .friends import forget_friends
+from .models import UserFriends, UserProfile
+
+
+def _forget(*user_ids):
+    forget_friends(*user_ids)
+    forget_recommendations(*user_ids)
+
+
+def _transition(receiver_profile, sender_id, from_status, to_status, mirror_from):
+    """Move the request of ``sender_id`` to ``receiver_profile`` from
+    ``from_status`` to ``to_status``.
+
+    The mirror row follows when its status is in ``mirror_from``; with
+    ``mirror_from`` None it always follows and is created if missing.
+    Raises UserFriends.DoesNotExist if there is no such request.
+    """
+    receiver_id = receiver_profile.user_id
+    with transaction.atomic():
+        rows = {
+            user_id: (row_id, status)
+            for row_id, user_id, status in UserFriends.objects.select_for_update(
+                of=("self",)
+            )
+            .filter(
+                Q(user_id=sender_id, friends_id=receiver_profile.id)
+                | Q(user_id=receiver_id, friends__user_id=sender_id)
+            )
+            .values_list("id", "user_id", "status")
+        }
+        if sender_id not in rows:
+            raise UserFriends.DoesNotExist("No friend request from this user.")
+        request_id, status = rows[sender_id]
+        if status != from_status:
+            return status, False
+
+        condition = Q(id=request_id, status=from_status)
+        mirror = rows.get(receiver_id)
+        if mirror is not None and (mirror_from is None or mirror[1] in mirror_from):
+            condition |= Q(id=mirror[0], status=mirror[1])
+        UserFriends.objects.filter(condition).update(status=to_status)
+        if mirror is None and mirror_from is None:
+            UserFriends.objects.create(
+                user_id=receiver_id,
+                friends=UserProfile.objects.get(user_id=sender_id),
+                status=to_status,
+            )
+        # update() sends no signals, drop the cached friend sets ourselves
+        transaction.on_commit(partial(_forget, sender_id, receiver_id))
+    return to_status, True
+
+
+def approve_request(receiver_profile, sender_id):
+    return _transition(receiver_profile, sender_id, PENDING, APPROVED, None)
+
+
+def reject_request(receiver_profile, sender_id):
+    return _transition(receiver_profile, sender_id, PENDING, REJECTED, {PENDING})
+
+
+def remove_friend(receiver_profile, friend_id):
+    return _transition(receiver_profile, friend_id, APPROVED, REMOVED, {APPROVED})
@@ -1,8 +1,12 @@
 # profiles/models.py
+from functools import partial
+
 from django.contrib.auth.models import User
-from django.db import models
-from events.models import Event
+from django.db import models, transaction
+from events.models import Event, EventJoin
 from events.constants import STATUS_CHOICES, PENDING
+from events.recommendations import forget_recommendations
+from .friends import forget_attendees, forget_friends
 
 
 class UserProfile(models.Model):
@@ -42,6 +46,31 @@ def save_user_profile(sender, instance, **kwargs):
         UserProfile.objects.get_or_create(user=instance)
 
 
+def friendship_changed(sender, instance, **kwargs):
+    # a friendship changes the friends and recommended events of both users
+    user_ids = [
+        instance.user_id,
+        *UserProfile.objects.filter(id=instance.friends_id).values_list(
+            "user_id", flat=True
+        ),
+    ]
+    # after commit, a read before it would cache the old friends again
+    transaction.on_commit(partial(_forget_friends, user_ids))
+
+
+def _forget_friends(user_ids):
+    forget_friends(*user_ids)
+    forget_recommendations(*user_ids)
+
+
+def event_join_changed(sender, instance, **kwargs):
+    transaction.on_commit(partial(forget_attendees, instance.event_id))
+
+
 # Connect the signals
 models.signals.post_save.connect(create_user_profile, sender=User)
 models.signals.post_save.connect(save_user_profile, sender=User)
+models.signals.post_save.connect(friendship_changed, sender=UserFriends)
+models.signals.post_delete.connect(friendship_changed, sender=UserFriends)
+models.signals.post_save.connect(event_join_changed, sender=EventJoin)
+models.signals.post_delete.connect(event_join_changed, sender=EventJoin)
@@ -3,7 +3,7 @@ from django.test import Client, TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 from .models import UserProfile, save_user_profile
-from events.models import Event, Location, Notification
+from events.models import Event, EventJoin, Location, Notification
 from .forms import ProfileForm
 from django.utils import timezone
 from datetime import timedelta
@@ -11,12 +11,16 @@ from datetime import datetime
 import pytz
 from .models import UserFriends
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from .friends import friend_ids, friends_attending, mutual_friend_ids
+from .friendships import approve_request, reject_request, remove_friend
 from .constants import (
     PENDING,
     APPROVED,
     WITHDRAWN,
     REJECTED,
     REMOVED,
+    NOTIFICATIONS_PAGE_SIZE,
 )
 
 
@@ -276,7 +280,8 @@ class SendFriendRequestTest(TestCase):
         self.client.login(username="testuser", password="testpassword")
         url = reverse("profiles:toggle-friend-request", args=[self.friend_profile.id])
         # Initially, the user has not been added as a friend
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         # Check that the UserFriends was created with the status 'pending'
         friend_request = UserFriends.objects.get(
             user=self.user, friends=self.friend_profile
@@ -284,15 +289,18 @@ class SendFriendRequestTest(TestCase):
         self.assertEqual(friend_request.status, PENDING)
         self.assertEqual(Notification.objects.count(), 1)
         # Make the POST request again to toggle the status to 'withdrawn'
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         # Fetch the updated join object and check its status
         friend_request.refresh_from_db()
         self.assertEqual(friend_request.status, WITHDRAWN)
         self.assertEqual(Notification.objects.count(), 2)
-        self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
         friend_request.refresh_from_db()
         self.assertEqual(friend_request.status, PENDING)
-        self.assertEqual(Notification.objects.count(), 3)
+        # the same request notification was sent moments ago
+        self.assertEqual(Notification.objects.count(), 2)
         # Check the response to ensure the user is redirected to the event detail page
         self.assertRedirects(
             response, reverse("profiles:view_profile", args=[self.friend_profile.id])
@@ -368,7 +376,8 @@ class FriendRequestManageTest(TestCase):
         url = reverse(
             "profiles:approve-request", args=[self.friend_profile.id, self.user.id]
         )
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         friend_request.refresh_from_db()
         self.assertEqual(response.status_code, 302)
         self.assertEqual(Notification.objects.count(), 1)
@@ -386,7 +395,8 @@ class FriendRequestManageTest(TestCase):
         url = reverse(
             "profiles:reject-request", args=[self.friend_profile.id, self.user.id]
         )
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         friend_request.refresh_from_db()
         self.assertEqual(Notification.objects.count(), 1)
         self.assertEqual(response.status_code, 302)
@@ -435,7 +445,8 @@ class FriendRemoveTest(TestCase):
             "profiles:remove-approved-request",
             args=[self.friend_profile.id, self.user.id],
         )
-        response = self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
         friend_request.refresh_from_db()
         user_request.refresh_from_db()
         self.assertEqual(Notification.objects.count(), 1)
@@ -514,3 +525,196 @@ class ProfileNotificationsTest(TestCase):
 
         # Check if the response redirects to the display_notifications view
         self.assertRedirects(response, self.url)
+
+    def test_display_notifications_read_state(self):
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(self.url)
+        # shown for the first time: still highlighted on this page
+        self.assertEqual([n.is_read for n in response.context["notifications"]], [1, 1])
+        self.assertEqual(response.context["unread_notification_count"], 0)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(
+            list(Notification.objects.values_list("is_read", flat=True)), [2, 2]
+        )
+
+    def test_display_notifications_is_paginated(self):
+        Notification.objects.bulk_create(
+            Notification(user=self.user, message=f"Notification {i}")
+            for i in range(3, NOTIFICATIONS_PAGE_SIZE + 6)
+        )
+        self.client.login(username="testuser", password="testpassword")
+        # session, user, count, page rows, update, unread aggregate, and the
+        # profile link in the navigation bar
+        with self.assertNumQueries(7):
+            response = self.client.get(self.url)
+        page = response.context["notifications"]
+        self.assertEqual(len(page), NOTIFICATIONS_PAGE_SIZE)
+        self.assertTrue(page.has_next())
+        # only the notifications that were shown have been marked
+        self.assertEqual(
+            Notification.objects.filter(is_read=0).count(),
+            Notification.objects.count() - NOTIFICATIONS_PAGE_SIZE,
+        )
+        self.assertEqual(response.context["unread_notification_count"], 5)
+
+    def test_cannot_delete_other_users_notification(self):
+        User.objects.create_user(username="otheruser", password="testpassword")
+        self.client.login(username="otheruser", password="testpassword")
+        self.client.post(self.url, {"notification_id": self.notification1.id})
+        self.assertTrue(Notification.objects.filter(id=self.notification1.id).exists())
+
+
+class FriendGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice", password="password")
+        self.bob = User.objects.create_user(username="bob", password="password")
+        self.carol = User.objects.create_user(username="carol", password="password")
+        self.befriend(self.alice, self.bob)
+        self.befriend(self.alice, self.carol)
+
+    def befriend(self, user, other):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFriends.objects.create(
+                user=user, friends=other.userprofile, status=APPROVED
+            )
+            UserFriends.objects.create(
+                user=other, friends=user.userprofile, status=APPROVED
+            )
+
+    def test_friend_ids_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(friend_ids(self.alice.id), {self.bob.id, self.carol.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(friend_ids(self.alice.id), {self.bob.id, self.carol.id})
+
+    def test_friendship_changes_drop_the_cached_sets(self):
+        self.assertEqual(friend_ids(self.bob.id), {self.alice.id})
+        self.assertEqual(mutual_friend_ids(self.bob.id, self.carol.id), {self.alice.id})
+        self.befriend(self.bob, self.carol)
+        self.assertEqual(friend_ids(self.bob.id), {self.alice.id, self.carol.id})
+        UserFriends.objects.filter(user=self.alice).update(status=REMOVED)
+        # queryset updates send no signals, the cached set stays
+        self.assertEqual(friend_ids(self.bob.id), {self.alice.id, self.carol.id})
+        with self.captureOnCommitCallbacks() as callbacks:
+            UserFriends.objects.get(
+                user=self.alice, friends=self.bob.userprofile
+            ).delete()
+            # until the delete commits, other readers still see the friendship
+            self.assertEqual(friend_ids(self.bob.id), {self.alice.id, self.carol.id})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(friend_ids(self.bob.id), {self.carol.id})
+
+    def test_friends_attending(self):
+        now = timezone.now()
+        event = Event.objects.create(
+            event_name="Picnic",
+            event_location=Location.objects.create(location_name="Park"),
+            start_time=now + timedelta(hours=1),
+            end_time=now + timedelta(hours=2),
+            capacity=10,
+            creator=self.carol,
+        )
+        self.assertEqual(friends_attending(self.alice.id, event.id), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            join = EventJoin.objects.create(user=self.bob, event=event, status=PENDING)
+        self.assertEqual(friends_attending(self.alice.id, event.id), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            join.status = APPROVED
+            join.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(friends_attending(self.alice.id, event.id), {self.bob.id})
+
+    def test_profile_shows_mutual_friends(self):
+        self.client.login(username="bob", password="password")
+        response = self.client.get(
+            reverse("profiles:view_profile", args=[self.carol.userprofile.id])
+        )
+        self.assertEqual(response.context["mutual_friend_count"], 1)
+        self.assertEqual(response.context["approved_request_count"], 1)
+        self.assertContains(response, "1 mutual friend")
+
+
+class FriendRequestStateMachineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(username="sender", password="password")
+        self.receiver = User.objects.create_user(
+            username="receiver", password="password"
+        )
+        self.request = UserFriends.objects.create(
+            user=self.sender, friends=self.receiver.userprofile, status=PENDING
+        )
+
+    def statuses(self):
+        return dict(UserFriends.objects.values_list("user__username", "status"))
+
+    def test_approve_creates_the_mirror_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                approve_request(self.receiver.userprofile, self.sender.id),
+                (APPROVED, True),
+            )
+        self.assertEqual(self.statuses(), {"sender": APPROVED, "receiver": APPROVED})
+        self.assertEqual(friend_ids(self.sender.id), {self.receiver.id})
+
+    def test_repeated_transition_changes_nothing(self):
+        approve_request(self.receiver.userprofile, self.sender.id)
+        self.assertEqual(
+            approve_request(self.receiver.userprofile, self.sender.id),
+            (APPROVED, False),
+        )
+        self.assertEqual(
+            reject_request(self.receiver.userprofile, self.sender.id),
+            (APPROVED, False),
+        )
+        self.assertEqual(self.statuses(), {"sender": APPROVED, "receiver": APPROVED})
+
+    def test_remove_moves_both_rows(self):
+        approve_request(self.receiver.userprofile, self.sender.id)
+        friend_ids(self.sender.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                remove_friend(self.receiver.userprofile, self.sender.id),
+                (REMOVED, True),
+            )
+        self.assertEqual(self.statuses(), {"sender": REMOVED, "receiver": REMOVED})
+        # the cached friend set was dropped with the friendship
+        self.assertEqual(friend_ids(self.sender.id), set())
+
+    def test_reject_without_mirror_row(self):
+        self.assertEqual(
+            reject_request(self.receiver.userprofile, self.sender.id),
+            (REJECTED, True),
+        )
+        self.assertEqual(self.statuses(), {"sender": REJECTED})
+
+    def test_unknown_request(self):
+        with self.assertRaises(UserFriends.DoesNotExist):
+            approve_request(self.sender.userprofile, self.receiver.id)
+
+    def test_double_click_notifies_once(self):
+        self.client.login(username="receiver", password="password")
+        url = reverse(
+            "profiles:approve-request",
+            args=[self.receiver.userprofile.id, self.sender.id],
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Notification.objects.filter(user=self.sender).count(), 1)
+
+    def test_cannot_answer_requests_of_another_profile(self):
+        User.objects.create_user(username="other", password="password")
+        self.client.login(username="other", password="password")
+        url = reverse(
+            "profiles:approve-request",
+            args=[self.receiver.userprofile.id, self.sender.id],
+        )
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.statuses(), {"sender": PENDING})
@@ -14,11 +14,18 @@ from .constants import (
     WITHDRAWN,
     REJECTED,
     REMOVED,
+    NOTIFICATIONS_PAGE_SIZE,
 )
 from django.contrib.auth.models import User
 from .models import UserFriends
 from events.models import Notification, FavoriteLocation
-from django.db.models import Q
+from chat.presence import online_users
+from .friends import friend_ids_many
+from .friendships import approve_request, reject_request, remove_friend
+from events.notifications import notify, set_unread_count, forget_unread_count
+from django.db.models import Q, F, Count
+from django.db.models.functions import Least
+from django.core.paginator import Paginator
 from location.models import Location
 
 
@@ -37,15 +44,23 @@ def view_profile(request, userprofile_id):
         except UserFriends.DoesNotExist:
             # if the user has no join record
             pass
-    approved_request = user_profile.userfriends_set.filter(status=APPROVED)
+    approved_request = user_profile.userfriends_set.filter(
+        status=APPROVED
+    ).select_related("user")
     pending_request = approved_request
     if request.user == user_profile.user:
-        pending_request = user_profile.userfriends_set.filter(status=PENDING)
-    approved_request_count = approved_request.count()
+        pending_request = user_profile.userfriends_set.filter(
+            status=PENDING
+        ).select_related("user")
+    friends = friend_ids_many({request.user.id, user_profile.user_id})
+    profile_friend_ids = friends[user_profile.user_id]
+    mutual_friend_count = None
+    if request.user != user_profile.user:
+        mutual_friend_count = len(profile_friend_ids & friends[request.user.id])
+    approved_request_count = len(profile_friend_ids)
     pending_request_count = pending_request.count()
-    cond1 = Q(user=request.user.id)
-    cond2 = Q(is_read__lte=0)
-    unread_notifications = Notification.objects.filter(cond1 & cond2).order_by("-id")
+    # one cache round trip for every friend's presence
+    online_friend_ids = online_users(profile_friend_ids)
     favorite_locations = FavoriteLocation.objects.filter(user=request.user)
     favorite_location_ids = [
         favorite_location.location.id for favorite_location in favorite_locations
@@ -58,13 +73,14 @@ def view_profile(request, userprofile_id):
         "pending_request": pending_request,
         "approved_request": approved_request,
         "approved_request_count": approved_request_count,
+        "mutual_friend_count": mutual_friend_count,
+        "online_friend_ids": online_friend_ids,
         "pending_request_count": pending_request_count,
         "APPROVED": APPROVED,
         "PENDING": PENDING,
         "WITHDRAWN": WITHDRAWN,
         "REJECTED": REJECTED,
         "REMOVED": REMOVED,
-        "unread_notifications": unread_notifications,
         "favorite_locations": favorite_locations_details,
     }
 
@@ -84,21 +100,24 @@ def toggleFriendRequest(request, userprofile_id):
     if not created:
         if add_friend.status == PENDING:
             add_friend.status = WITHDRAWN
-            Notification.objects.create(
+            notify(
                 user=receiver_user.user,
                 message=f"'{request.user}' has removed their request to be your friend.",
+                dedupe=True,
             )
         else:
             add_friend.status = PENDING
-            Notification.objects.create(
+            notify(
                 user=receiver_user.user,
                 message=f"'{request.user}' has requested to be your friend.",
+                dedupe=True,
             )
         add_friend.save()
     else:
-        Notification.objects.create(
+        notify(
             user=receiver_user.user,
             message=f"'{request.user}' has requested to be your friend.",
+            dedupe=True,
         )
     return redirect("profiles:view_profile", userprofile_id=userprofile_id)
 
@@ -106,77 +125,54 @@ def toggleFriendRequest(request, userprofile_id):
 @login_required
 @require_POST
 def userApproveRequest(request, userprofile_id, user_id):
-    with transaction.atomic():
-        try:
-            # Lock the participant row for updating
-            add_friend = UserFriends.objects.select_for_update().get(
-                friends_id=userprofile_id, user_id=user_id
-            )
-
-        except UserFriends.DoesNotExist:
-            raise Http404("User not found.")
-        sender_user = get_object_or_404(UserProfile, user=add_friend.user)
-        selfjoin, created = UserFriends.objects.get_or_create(
-            user=add_friend.friends.user, friends=sender_user
+    receiver_profile = get_object_or_404(
+        UserProfile, id=userprofile_id, user=request.user
+    )
+    try:
+        _, changed = approve_request(receiver_profile, user_id)
+    except UserFriends.DoesNotExist:
+        raise Http404("User not found.")
+    if changed:
+        notify(
+            user_id=user_id,
+            message=f"'{request.user}' has accepted your friend request.",
         )
-
-        if add_friend.status == PENDING:
-            add_friend.status = APPROVED
-            Notification.objects.create(
-                user=add_friend.user,
-                message=f"'{request.user}' has accepted your friend request.",
-            )
-            add_friend.save()
-            selfjoin.status = APPROVED
-            selfjoin.save()
-        return redirect("profiles:view_profile", userprofile_id=userprofile_id)
+    return redirect("profiles:view_profile", userprofile_id=userprofile_id)
 
 
 @login_required
 @require_POST
 def userRejectRequest(request, userprofile_id, user_id):
-    receiver_user = get_object_or_404(UserProfile, id=userprofile_id)
-    user = get_object_or_404(User, id=user_id)
-    add_friend = get_object_or_404(UserFriends, friends=receiver_user, user=user)
-    sender_user = get_object_or_404(UserProfile, user=add_friend.user)
-    selfjoin = get_object_or_404(
-        UserFriends, friends=sender_user, user=add_friend.friends.user
+    receiver_profile = get_object_or_404(
+        UserProfile, id=userprofile_id, user=request.user
     )
-
-    if selfjoin.status == PENDING:
-        selfjoin.status = REJECTED
-        selfjoin.save()
-    if add_friend.status == PENDING:
-        add_friend.status = REJECTED
-        Notification.objects.create(
-            user=add_friend.user,
+    try:
+        _, changed = reject_request(receiver_profile, user_id)
+    except UserFriends.DoesNotExist:
+        raise Http404("User not found.")
+    if changed:
+        notify(
+            user_id=user_id,
             message=f"'{request.user}' has rejected your friend request.",
         )
-        add_friend.save()
     return redirect("profiles:view_profile", userprofile_id=userprofile_id)
 
 
 @login_required
 @require_POST
 def userRemoveApprovedRequest(request, userprofile_id, user_id):
-    receiver_user = get_object_or_404(UserProfile, id=userprofile_id)
-    user = get_object_or_404(User, id=user_id)
-    add_friend = get_object_or_404(UserFriends, friends=receiver_user, user=user)
-    sender_user = get_object_or_404(UserProfile, user=add_friend.user)
-    selfjoin = get_object_or_404(
-        UserFriends, friends=sender_user, user=add_friend.friends.user
+    receiver_profile = get_object_or_404(
+        UserProfile, id=userprofile_id, user=request.user
     )
-
-    if selfjoin.status == APPROVED:
-        selfjoin.status = REMOVED
-        selfjoin.save()
-    if add_friend.status == APPROVED:
-        add_friend.status = REMOVED
-        Notification.objects.create(
-            user=add_friend.user,
+    try:
+        _, changed = remove_friend(receiver_profile, user_id)
+    except UserFriends.DoesNotExist:
+        raise Http404("User not found.")
+    if changed:
+        notify(
+            user_id=user_id,
             message=f"'{request.user}' has removed you from the friend list.",
         )
-        add_friend.save()
     return redirect("profiles:view_profile", userprofile_id=userprofile_id)
 
 
@@ -204,19 +200,30 @@ def display_notifications(request):
     if request.method == "POST":
         notification_id = request.POST.get("notification_id")
         if notification_id:
-            Notification.objects.filter(id=notification_id).delete()
+            Notification.objects.filter(
+                id=notification_id, user=request.user.id
+            ).delete()
+            forget_unread_count(request.user.id)
             return redirect("profiles:display_notifications")
-    for notification in Notification.objects.filter(user=request.user.id):
-        is_read = notification.is_read + 1
-        if is_read > 2:
-            is_read = 2
-        Notification.objects.filter(id=notification.id).update(is_read=is_read)
     notifications = Notification.objects.filter(user=request.user.id).order_by("-id")
-    cond1 = Q(user=request.user.id)
-    cond2 = Q(is_read__lte=0)
-    unread_notifications = Notification.objects.filter(cond1 & cond2).order_by("-id")
+    page = Paginator(notifications, NOTIFICATIONS_PAGE_SIZE).get_page(
+        request.GET.get("page")
+    )
+    # is_read goes 0 (unread) -> 1 (shown once, still highlighted) -> 2 (read),
+    # bump the whole page in one statement and mirror it on the loaded rows
+    page_ids = [notification.id for notification in page]
+    Notification.objects.filter(id__in=page_ids, is_read__lt=2).update(
+        is_read=Least(F("is_read") + 1, 2)
+    )
+    for notification in page:
+        notification.is_read = min(notification.is_read + 1, 2)
+    unread_notification_count = Notification.objects.filter(
+        user=request.user.id
+    ).aggregate(unread=Count("id", filter=Q(is_read__lte=0)))["unread"]
+    set_unread_count(request.user.id, unread_notification_count)
     context = {
-        "notifications": notifications,
-        "unread_notifications": unread_notifications,
+        "notifications": page,
+        "page_obj": page,
+        "unread_notification_count": unread_notification_count,
     }
     return render(request, "profiles/notifications.html", context)